@@ -0,0 +1,98 @@
+"""
+CPU affinity and NUMA-aware placement of cutechess game slots.
+
+The cpus of a node are ordered by NUMA node and split in contiguous chunks,
+one per rank on the node, so that a rank stays within a NUMA domain when
+possible. The cpus of a rank are split again over its concurrent game slots,
+each slot being a cutechess process playing one game at a time.
+
+Ranks are identified by the local rank variables set by the MPI launcher
+(mpich/hydra and Open MPI), do not combine with the launcher's own binding
+(e.g. -bind-to), as that restricts the cpus a rank can use.
+"""
+
+import os
+import glob
+import socket
+
+LOCAL_RANK_VARIABLES = [
+    ("MPI_LOCALRANKID", "MPI_LOCALNRANKS"),
+    ("OMPI_COMM_WORLD_LOCAL_RANK", "OMPI_COMM_WORLD_LOCAL_SIZE"),
+    ("AFFINITY_LOCAL_RANK", "AFFINITY_LOCAL_SIZE"),
+]
+
+
+def parse_cpulist(text):
+    """Parse a linux cpu list such as 0-3,8-11"""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def numa_nodes():
+    """The cpus of each NUMA node, a single node with all cpus if the topology is unknown"""
+    nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        with open(path, "r") as infile:
+            cpus = parse_cpulist(infile.read())
+        if cpus:
+            nodes.append(cpus)
+    if not nodes:
+        nodes = [sorted(os.sched_getaffinity(0))]
+    return nodes
+
+
+def local_rank():
+    """(rank, number of ranks) of this process on its node"""
+    for rank_variable, size_variable in LOCAL_RANK_VARIABLES:
+        if rank_variable in os.environ and size_variable in os.environ:
+            return int(os.environ[rank_variable]), int(os.environ[size_variable])
+    return 0, 1
+
+
+def rank_name():
+    """host/local rank of this process, host/pid if the launcher sets no local rank"""
+    for rank_variable, size_variable in LOCAL_RANK_VARIABLES:
+        if rank_variable in os.environ:
+            return "%s/%s" % (socket.gethostname(), os.environ[rank_variable])
+    return "%s/pid%d" % (socket.gethostname(), os.getpid())
+
+
+def split(cpus, parts):
+    """Split a list of cpus in parts contiguous chunks of (almost) equal size"""
+    chunks = []
+    for i in range(parts):
+        chunk = cpus[i * len(cpus) // parts:(i + 1) * len(cpus) // parts]
+        # with fewer cpus than parts, chunks share cpus
+        chunks.append(chunk if chunk else [cpus[i % len(cpus)]])
+    return chunks
+
+
+def rank_cpus():
+    """The cpus of this rank, ordered by NUMA node"""
+    rank, size = local_rank()
+    cpus = [cpu for node in numa_nodes() for cpu in node]
+    return split(cpus, size)[rank % size]
+
+
+def slot_cpus(cpus, slots):
+    """The cpus of each of the concurrent game slots of a rank"""
+    return split(cpus, slots)
+
+
+def cpulist(cpus):
+    """Format cpus as a compact linux cpu list"""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join("%d" % a if a == b else "%d-%d" % (a, b) for a, b in ranges)
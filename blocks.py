@@ -0,0 +1,62 @@
+"""
+Parameter groups for block-coordinate tuning.
+
+With many parameters, a single optimizer over all of them needs a huge number of
+games. Instead, the parameters can be split into groups that are tuned in turn,
+each for a number of evaluations, while the others stay at the current
+recommendation. The groups are either given as json, e.g.
+
+   {"search": ["razorMargin", "futMargin"], "eval": ["PawnValueMg", "PawnValueEg"]}
+
+(inline, or the name of a file holding it), or derived from the parameter names
+with "prefix": names are grouped by their first word, i.e. up to the first index,
+underscore, digit or upper case letter following a lower case one.
+"""
+
+import os
+import re
+import sys
+import json
+
+PREFIX = re.compile(r"[A-Z]+(?![a-z])|[A-Za-z][a-z]*|[^\[_\d]+")
+
+
+def prefix(name):
+    """The first word of a parameter name, e.g. futility of futilityMargin[1]"""
+    m = PREFIX.match(name)
+    return m.group(0) if m else name
+
+
+def group_params(spec, names):
+    """The groups of names described by spec, as a dict of group: [names]
+
+    Names that are not in any group given as json form a last group, "other".
+    Names that are not tunable are dropped from the groups, and empty groups are dropped.
+    """
+    if spec == "prefix":
+        groups = {}
+        for name in names:
+            groups.setdefault(prefix(name), []).append(name)
+        return groups
+
+    if os.path.isfile(spec):
+        with open(spec, "r") as infile:
+            spec = infile.read()
+    try:
+        given = json.loads(spec)
+    except json.JSONDecodeError as e:
+        sys.exit(f"Param groups are neither 'prefix', nor a json file or string: {e}\n")
+    if not isinstance(given, dict):
+        sys.exit("Param groups must be a json object of group: [names]\n")
+
+    groups = {}
+    grouped = set()
+    for group, members in given.items():
+        members = [name for name in members if name in names and name not in grouped]
+        grouped.update(members)
+        if members:
+            groups[group] = members
+    other = [name for name in names if name not in grouped]
+    if other:
+        groups["other"] = other
+    return groups
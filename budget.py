@@ -0,0 +1,90 @@
+"""
+Wall-clock and game-count budgets of an optimization.
+
+Games are reserved for a point (or a group of points) before it is asked from
+the optimizer, and released when its games have been played. The games that
+still fit in the budget are estimated from the games/s measured so far, so that
+batches shrink, and fewer points are evaluated concurrently, as the deadline
+approaches. A part of the budget is kept for a final evaluation of the
+recommendation.
+"""
+
+import math
+import time
+import threading
+
+
+class Budget:
+    def __init__(self, time_budget=0.0, games_budget=0, final_games=0, min_fraction=0.5):
+        """time_budget in seconds and games_budget in games, 0 for no limit
+
+        final_games are kept for evaluating the final recommendation, and a point is only
+        evaluated with at least min_fraction of the games requested for it.
+        """
+        self.time_budget = time_budget
+        self.games_budget = games_budget
+        self.final_games = final_games if self else 0
+        self.min_fraction = min_fraction
+        self.start = time.monotonic()
+        self.games_played = 0
+        self.games_reserved = 0
+        # points can reserve more games while they are being evaluated
+        self.lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.time_budget or self.games_budget)
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def games_per_second(self):
+        """Measured games/s, None before any games have been played"""
+        elapsed = self.elapsed()
+        if self.games_played == 0 or elapsed <= 0:
+            return None
+        return self.games_played / elapsed
+
+    def remaining_games(self):
+        """Games that still fit in the budget, infinite if unknown"""
+        remaining = math.inf
+        if self.games_budget:
+            remaining = self.games_budget - self.games_played
+        games_per_second = self.games_per_second()
+        if self.time_budget and games_per_second:
+            remaining = min(remaining, (self.time_budget - self.elapsed()) * games_per_second)
+        return max(0, remaining)
+
+    def reserve(self, games):
+        """Reserve games for new evaluations, fewer if the budget runs out
+
+        Returns the (even) number of games reserved, 0 if not even min_fraction of games fits.
+        """
+        with self.lock:
+            available = self.remaining_games() - self.final_games - self.games_reserved
+            reserved = int(min(games, available)) // 2 * 2
+            if reserved <= 0 or reserved < self.min_fraction * games:
+                return 0
+            self.games_reserved += reserved
+            return reserved
+
+    def release(self, reserved, played):
+        """Release a reservation once its games, played in total, are done"""
+        with self.lock:
+            self.games_reserved -= reserved
+            self.games_played += played
+
+    def final_evaluation_games(self):
+        """Games left for the final evaluation, the remaining budget if known"""
+        remaining = self.remaining_games()
+        if math.isinf(remaining):
+            return self.final_games
+        return int(remaining) // 2 * 2
+
+    def __str__(self):
+        remaining = self.remaining_games()
+        text = "%d games played in %.0fs" % (self.games_played, self.elapsed())
+        if not math.isinf(remaining):
+            text += ", %d games left" % remaining
+        if self.time_budget:
+            text += ", %.0fs left" % max(0, self.time_budget - self.elapsed())
+        return text
@@ -0,0 +1,200 @@
+"""
+Measure the throughput of cutechess batches for a grid of settings.
+
+Runs short bursts of games for each combination of cutechess concurrency,
+engine hash size and number of concurrent cutechess processes (ranks), and
+reports games/s and the CPU utilization of the hosts. The best configuration
+is written as a json file that nevergrad4sf.py and cutechess_batches.py can
+load with --config.
+"""
+
+import os
+import json
+import time
+import socket
+import argparse
+import itertools
+import textwrap
+from concurrent.futures import as_completed
+
+from cutechess_batches import CutechessLocalBatch
+from executors import add_backend_arguments, create_executor
+
+
+def timed_run(local_batch, variables):
+    """Run a local batch, measuring wall time and the cpu time used by cutechess and the engines"""
+    start_times = os.times()
+    start = time.monotonic()
+    results = local_batch.run(variables)
+    elapsed = time.monotonic() - start
+    end_times = os.times()
+    cpu = (end_times.children_user - start_times.children_user) + (
+        end_times.children_system - start_times.children_system
+    )
+    return {
+        "games": len(results),
+        "elapsed": elapsed,
+        "cpu": cpu,
+        "host": socket.gethostname(),
+        "cpus": len(os.sched_getaffinity(0)),
+    }
+
+
+def measure(executor, settings, games, args):
+    """Play a burst of games with the given settings, return games/s and cpu utilization"""
+    ranks = settings["ranks"]
+    local_batch = CutechessLocalBatch(
+        cutechess=args.cutechess,
+        stockfish=args.stockfish,
+        stockfishRef=args.stockfish,
+        book=args.book,
+        tc=args.tc,
+        tcRef=args.tc,
+        rounds=max(1, (games + 1) // 2 // ranks),
+        concurrency=settings["cutechess_concurrency"],
+        hash=settings["hash"],
+    )
+
+    start = time.monotonic()
+    fs = [executor.submit(timed_run, local_batch, {}) for _ in range(ranks)]
+    runs = [f.result() for f in as_completed(fs)]
+    elapsed = time.monotonic() - start
+
+    # utilization of the cpus of the hosts used, over the duration of the burst
+    cpus = {run["host"]: run["cpus"] for run in runs}
+    games_played = sum(run["games"] for run in runs)
+    return {
+        **settings,
+        "games": games_played,
+        "games_per_second": games_played / elapsed,
+        "cpu_utilization": sum(run["cpu"] for run in runs) / (elapsed * sum(cpus.values())),
+    }
+
+
+def int_list(text):
+    return [int(value) for value in text.split(",")]
+
+
+if __name__ == "__main__":
+
+    class MyFormatter(
+        argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter
+    ):
+        pass
+
+    parser = argparse.ArgumentParser(
+        formatter_class=MyFormatter,
+        description=textwrap.dedent(
+            """\
+                  Measure games/s of cutechess batches for a grid of settings.
+
+                  With the default mpi backend, this program requires mpi to run. A typical invocation could be:
+                     mpirun -np 9 python3 -m mpi4py.futures calibrate.py -tc "10000+10000 nodes=5000" --cc 4,8,16
+                  or, without mpi:
+                     python3 calibrate.py --backend local --local_workers 8 -tc "10000+10000 nodes=5000"
+
+                  The best settings are written to --output, to be used with --config.
+                  """
+        ),
+    )
+    parser.add_argument(
+        "--stockfish",
+        type=str,
+        default="stockfish",
+        help="Name of the stockfish binary",
+    )
+    parser.add_argument(
+        "--cutechess",
+        type=str,
+        default="cutechess-cli",
+        help="Name of the cutechess binary",
+    )
+    parser.add_argument(
+        "--book",
+        type=str,
+        default="./UHO_XXL_+0.90_+1.19.epd",
+        help="opening book in epd or pgn fomat",
+    )
+    parser.add_argument(
+        "-tc", "--tc", type=str, default="10000+10000 nodes=5000", help="time control"
+    )
+    parser.add_argument(
+        "-g",
+        "--games",
+        type=int,
+        default=400,
+        help="Number of games of each measured burst",
+    )
+    parser.add_argument(
+        "--cc",
+        type=int_list,
+        default=[4, 8, 16],
+        help="Comma separated cutechess concurrencies to try",
+    )
+    parser.add_argument(
+        "--hash",
+        type=int_list,
+        default=[16, 64],
+        help="Comma separated engine hash sizes (MB) to try",
+    )
+    parser.add_argument(
+        "--ranks",
+        type=int_list,
+        default=[],
+        help="Comma separated numbers of concurrent cutechess processes to try, defaults to all workers",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="throughput.json",
+        help="File to which the best configuration is written",
+    )
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    executor, workers = create_executor(
+        args.backend,
+        args.listen,
+        args.authkey,
+        args.min_workers,
+        args.local_workers,
+        args.scheduler,
+        args.experiment or "calibrate",
+        args.weight,
+    )
+    ranks = [r for r in args.ranks if r <= workers] or [workers]
+
+    measurements = []
+    for cc, hash_mb, r in itertools.product(args.cc, args.hash, ranks):
+        settings = {"cutechess_concurrency": cc, "hash": hash_mb, "ranks": r}
+        measurement = measure(executor, settings, args.games, args)
+        measurements.append(measurement)
+        print(
+            "cc %3d  hash %5d  ranks %3d : %8.3f games/s  %6.1f%% cpu"
+            % (cc, hash_mb, r, measurement["games_per_second"], 100 * measurement["cpu_utilization"]),
+            flush=True,
+        )
+    executor.shutdown()
+
+    best = max(measurements, key=lambda m: m["games_per_second"])
+    config = {
+        "cutechess_concurrency": best["cutechess_concurrency"],
+        "hash": best["hash"],
+        # cutechess processes running at once, over all points evaluated concurrently. cutechess_batches.py
+        # splits its games over that many processes, nevergrad4sf.py the games of each of its points over
+        # that many divided by --evaluation_concurrency. One worker per process, and a master rank in addition.
+        "cutechess_processes": best["ranks"],
+        "mpi_ranks": best["ranks"] + 1,
+        "games_per_second": best["games_per_second"],
+        "cpu_utilization": best["cpu_utilization"],
+        "measurements": measurements,
+    }
+    with open(args.output, "w") as outfile:
+        json.dump(config, outfile, indent=2)
+
+    print()
+    print("Best configuration written to %s:" % args.output)
+    print(
+        "cc %d  hash %d  ranks %d : %.3f games/s"
+        % (best["cutechess_concurrency"], best["hash"], best["ranks"], best["games_per_second"])
+    )
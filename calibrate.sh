@@ -0,0 +1,19 @@
+#!/bin/bash
+
+# measure games/s for a grid of settings, writing the best to throughput.json
+mpi_concurrency=$(( $(nproc) / 4 + 1 ))
+# numbers of concurrent cutechess processes to try: 1, 2, 4, ... up to the number of workers
+workers=$(( mpi_concurrency - 1 ))
+ranks=1
+while [ $(( ${ranks##*,} * 2 )) -lt $workers ]; do
+  ranks="$ranks,$(( ${ranks##*,} * 2 ))"
+done
+[ $workers -gt 1 ] && ranks="$ranks,$workers"
+mpiexec -np $mpi_concurrency python3 \
+  -m mpi4py.futures calibrate.py \
+  --tc "10000+10000 nodes=5000" \
+  --games 400 \
+  --cc 4,8,16 \
+  --hash 16,64 \
+  --ranks $ranks \
+  --output throughput.json
@@ -7,8 +7,13 @@ The more interesting version, cutechess_executor_batch, runs multiple
 batches asynchronously, using an executor (which can be MPIPoolExecutor).
 """
 from concurrent.futures import as_completed
-from subprocess import Popen, PIPE
+from subprocess import Popen
+import os
 import sys
+import copy
+import time
+import socket
+import tempfile
 import math
 import random
 import re
@@ -17,11 +22,35 @@ import argparse
 from pprint import pprint
 import textwrap
 
-from mpi4py.futures import MPIPoolExecutor
-from mpi4py import MPI
 from scipy.stats import norm
 
 from stats.sprt import sprt
+from result_cache import ResultCache
+from opening_book import get_book
+from host_speeds import HostSpeeds, engine_nps
+from executors import create_executor, add_backend_arguments
+from telemetry import parse_pgn, position_key, summarize, combine, report
+from affinity import rank_cpus, slot_cpus as slot_cpus_of, local_rank, rank_name, cpulist
+
+# with load balancing, the batch of each rank is split in this many smaller batches
+SMALL_BATCHES = 4
+
+
+def load_throughput_config(parser):
+    """Use the settings of a --config file (as written by calibrate.py) as parser defaults
+
+    Arguments given explicitly on the command line still take precedence. Returns the config, empty without one.
+    """
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument("--config", type=str, default="")
+    config_file = config_parser.parse_known_args()[0].config
+    if not config_file:
+        return {}
+    with open(config_file, "r") as infile:
+        config = json.load(infile)
+    dests = [action.dest for action in parser._actions]
+    parser.set_defaults(**{key: value for key, value in config.items() if key in dests})
+    return config
 
 
 def elo(score):
@@ -66,6 +95,31 @@ def calc_los(pentanomial):
     return los
 
 
+def pentanomial_elo(pentanomial):
+    """Elo of a pentanomial and its variance, from the variance of the game pair scores"""
+    N = sum(pentanomial)
+    scores = [0, 0.25, 0.5, 0.75, 1]
+    score = sum(n * s for n, s in zip(pentanomial, scores)) / N
+    variance = sum(n * (s - score) ** 2 for n, s in zip(pentanomial, scores)) / N
+    # a few pairs can show no spread at all, assume at least that of a draw-heavy match
+    variance = max(variance, 0.01) / N
+    score = max(0.01, min(0.99, score))
+    derivative = 400.0 / (math.log(10) * score * (1 - score))
+    return elo(score), derivative * derivative * variance
+
+
+def fishtest_sprt():
+    """The SPRT used to judge results, as in fishtest with normalized Elo bounds [0, 2]"""
+    return sprt(alpha=0.05, beta=0.05, elo0=0, elo1=2.0, elo_model='normalized')
+
+
+def sprt_llr(pentanomial):
+    """SPRT LLR of a pentanomial, counts may be fractional (e.g. for down-weighted results)"""
+    fishtest_stats = fishtest_sprt()
+    fishtest_stats.set_state(pentanomial)
+    return fishtest_stats.llr
+
+
 def calc_stats(result_sequence):
     """Given a list of "w" "l" "d", compute score, elo and LOS, with error estimates"""
     wld = [0, 0, 0]
@@ -91,7 +145,7 @@ def calc_stats(result_sequence):
     los = norm.cdf(a)
 
     pentanomial = pentanomial_results(result_sequence)
-    fishtest_stats = sprt(alpha=0.05, beta=0.05, elo0=0, elo1=2.0, elo_model='normalized')
+    fishtest_stats = fishtest_sprt()
     fishtest_stats.set_state(pentanomial)
 
     return {
@@ -120,8 +174,17 @@ class CutechessLocalBatch:
         tcRef="10.0+1.0",
         rounds=100,
         concurrency=2,
+        hash=16,
+        affinity=False,
+        draw="movenumber=50 movecount=8 score=5",
+        resign="movecount=3 score=600",
+        telemetry=False,
     ):
-        """Basic properties of the batch of games can be specified"""
+        """Basic properties of the batch of games can be specified
+
+        draw and resign are the cutechess adjudication settings. With telemetry, the games are
+        also written as PGN, and summarized per game (see telemetry.py).
+        """
         self.cutechess = cutechess
         self.stockfish = stockfish
         self.stockfishRef = stockfishRef
@@ -130,20 +193,19 @@ class CutechessLocalBatch:
         self.tcRef = tcRef
         self.rounds = rounds
         self.concurrency = concurrency
+        self.hash = hash
+        self.affinity = affinity
+        self.draw = draw
+        self.resign = resign
+        self.telemetry = telemetry
+        self.utilization = None
+        self.incomplete_pairs = 0
+        self.summary = None
         self.total_games = 2 * rounds
 
-    def run(self, variables):
-        """Run a batch of games returning a list  containing 'w' 'l' 'd' results
-
-        The results are show from the point of view of test, which is the version that is
-        setup using the options set using the variables.
-        """
-
-        # The engine whose parameters will be optimized
-        fcp = "name=test cmd=%s tc=%s" % (self.stockfish, self.tc)
-
-        # The reference engine
-        scp = "name=base cmd=%s tc=%s" % (self.stockfishRef, self.tcRef)
+    def engine_args(self, name, variables):
+        """cutechess engine arguments of a test engine, setup using the options set using the variables"""
+        fcp = "name=%s cmd=%s tc=%s" % (name, self.stockfish, self.tc)
 
         # Parse the parameters that should be optimized
         for name in variables:
@@ -151,69 +213,228 @@ class CutechessLocalBatch:
             try:
                 float(variables[name])
             except ValueError:
-                sys.exit(
-                    "invalid value for parameter %s: %s\n" % (argv[i], argv[i + 1])
-                )
+                raise ValueError("invalid value for parameter %s: %s" % (name, variables[name]))
 
             initstr = "option.{name}={value}".format(name=name, value=variables[name])
             fcp += ' "%s"' % initstr
 
+        return fcp
+
+    def run(self, variables, openings=None, seed=None):
+        """Run a batch of games returning a list  containing 'w' 'l' 'd' results
+
+        The results are show from the point of view of test, which is the version that is
+        setup using the options set using the variables.
+        """
+        return self.run_multi([variables], openings, seed)[0]
+
+    def run_multi(self, variables_list, openings=None, seed=None):
+        """Run a batch of games for several parameter sets in a single cutechess process
+
+        Each parameter set is a separate test engine, playing rounds game pairs against
+        the reference engine in a gauntlet. Returns a list with the 'w' 'l' 'd' results
+        of each parameter set.
+
+        If openings (start, count, repeat) is given, the games are played in order from this
+        slice of the indexed book, each opening repeated repeat times, instead of from random
+        openings of the full book. seed is passed to -srand, random if not given.
+
+        With affinity, the process is pinned to the cpus of its rank, and the rounds are split
+        over one cutechess process per game slot, each pinned to the cpus of its slot.
+        """
+
+        # The engines whose parameters will be optimized
+        names = ["test"] if len(variables_list) == 1 else ["test%d" % i for i in range(len(variables_list))]
+        fcps = [self.engine_args(name, variables) for name, variables in zip(names, variables_list)]
+
+        # The reference engine
+        scp = "name=base cmd=%s tc=%s" % (self.stockfishRef, self.tcRef)
+
         extension = None
         m = re.compile("(pgn|epd)$").search(self.book)
         if m:
             extension = m.group(1)
 
         if not extension:
-            sys.exit("books must have epd or pgn extension: %s" % self.book)
-
-        cutechess_base_args = (
-            "-games 2 -repeat "
-            + " -openings file=%s format=%s order=random" % (self.book, extension)
-            + " -draw movenumber=50 movecount=8 score=5 -resign movecount=3 score=600"
-        )
-        cutechess_args = "-engine %s -engine %s -each proto=uci option.Hash=16 -rounds %d -concurrency %d -srand %d" % (
-            fcp,
-            scp,
-            self.rounds,
-            self.concurrency,
-            random.SystemRandom().randint(0, 2 ** 31 - 1),
+            raise ValueError("books must have epd or pgn extension: %s" % self.book)
+
+        if len(fcps) == 1:
+            engines = "-engine %s -engine %s" % (fcps[0], scp)
+        else:
+            # the first engine of a gauntlet plays all others
+            engines = "-tournament gauntlet -engine %s %s" % (scp, " ".join("-engine %s" % fcp for fcp in fcps))
+
+        if seed is None:
+            seed = random.SystemRandom().randint(0, 2 ** 31 - 1)
+
+        # (rounds, concurrency, openings, seed, cpus) of each cutechess process
+        slots = [(self.rounds, self.concurrency, openings, seed, None)]
+        # the share of the cpus of its node of this rank, over which its utilization is measured
+        cpus = rank_cpus()
+        if self.affinity:
+            # the rank process itself is not pinned, it runs later tasks that may not use affinity
+            slots = self.affinity_slots(cpus, openings, seed)
+        start_times = os.times()
+        start = time.monotonic()
+
+        processes = []
+        for rounds, concurrency, slot_openings, slot_seed, slot_cpus in slots:
+            book, order = self.book, "random"
+            if slot_openings:
+                book, order = get_book(self.book).write_slice(*slot_openings), "sequential"
+
+            cutechess_base_args = (
+                "-games 2 -repeat "
+                + " -openings file=%s format=%s order=%s" % (book, extension, order)
+                + " -draw %s -resign %s" % (self.draw, self.resign)
+            )
+            pgn = None
+            if self.telemetry:
+                fd, pgn = tempfile.mkstemp(suffix=".pgn")
+                os.close(fd)
+                cutechess_base_args += " -pgnout %s" % pgn
+            cutechess_args = "%s -each proto=uci option.Hash=%d -rounds %d -concurrency %d -srand %d" % (
+                engines,
+                self.hash,
+                rounds,
+                concurrency,
+                slot_seed,
+            )
+            command = "%s %s %s" % (self.cutechess, cutechess_base_args, cutechess_args)
+            if slot_cpus:
+                # pinned by taskset rather than in a preexec_fn, which is unsafe with threads running
+                command = "taskset -c %s %s" % (cpulist(slot_cpus), command)
+
+            # Run cutechess-cli, output goes to a file so that concurrent processes never block
+            output_file = tempfile.TemporaryFile()
+            process = Popen(command, shell=True, stdout=output_file)
+            processes.append((process, command, output_file, book if slot_openings else None, pgn, slot_openings))
+
+        # and wait for them to finish
+        results = {name: [] for name in names}
+        records = []
+        self.incomplete_pairs = 0
+        for process, command, output_file, book, pgn, slot_openings in processes:
+            process.wait()
+            if book:
+                os.remove(book)
+            if pgn:
+                with open(pgn, "r", errors="replace") as infile:
+                    records += parse_pgn(infile, names, self.opening_indices(slot_openings))
+                os.remove(pgn)
+            if process.returncode != 0:
+                # raised rather than exiting, so that the worker running the batch survives
+                raise RuntimeError("failed to execute command: %s" % command)
+            output_file.seek(0)
+            output = output_file.read()
+            output_file.close()
+            pair_sequences, incomplete_pairs = parse_game_results(output.decode("utf-8"), names)
+            # the batch returns the games one by one, as the cache and the pentanomials expect
+            for name, pair_sequence in pair_sequences.items():
+                results[name].extend("".join(pair_sequence))
+            self.incomplete_pairs += incomplete_pairs
+
+        if self.incomplete_pairs:
+            print("Dropped %d game pairs that did not terminate properly." % self.incomplete_pairs, flush=True)
+
+        if self.telemetry:
+            self.summary = summarize(records)
+            print("telemetry: %s rank %d of %d: %s" % (socket.gethostname(), *local_rank(), report(self.summary)), flush=True)
+
+        end_times = os.times()
+        cpu_time = (end_times.children_user - start_times.children_user) + (
+            end_times.children_system - start_times.children_system
         )
-        command = "%s %s %s" % (self.cutechess, cutechess_base_args, cutechess_args)
-
-        # Run cutechess-cli and wait for it to finish
-        process = Popen(command, shell=True, stdout=PIPE)
-        output = process.communicate()[0]
-        if process.returncode != 0:
-            sys.exit("failed to execute command: %s\n" % command)
-
-        # Convert Cutechess-cli's result into W/L/D (putting game pairs together)
-        lines = []
-        for line in output.decode("utf-8").splitlines():
-            if line.startswith("Finished game"):
-                lines.append(line)
-
-        lines.sort(key=lambda l: float(l.split()[2]))
-
-        # Convert cutechess-cli game results into a sequence of W/L/D from the test engine's perspective
-        result_sequence = []
-        for line in lines:
-            if line.find(": 1-0") != -1:
-                if line.find("test vs base") != -1:
-                    result_sequence.append("w")
-                if line.find("base vs test") != -1:
-                    result_sequence.append("l")
-            elif line.find(": 0-1") != -1:
-                if line.find("test vs base") != -1:
-                    result_sequence.append("l")
-                if line.find("base vs test") != -1:
-                    result_sequence.append("w")
-            elif line.find(": 1/2-1/2") != -1:
-                result_sequence.append("d")
-            else:
-                # ignore for now.
-                print("The game did not terminate properly!")
-
-        return result_sequence
+        self.utilization = cpu_time / ((time.monotonic() - start) * len(cpus))
+        if self.affinity:
+            print(
+                "affinity: %s rank %d of %d, cpus %s, %d game slots, %.1f%% core utilization"
+                % (socket.gethostname(), *local_rank(), cpulist(cpus), len(slots), 100 * self.utilization),
+                flush=True,
+            )
+
+        return [results[name] for name in names]
+
+    def opening_indices(self, openings):
+        """Index in the book of the start positions of a slice of an epd book, None if unknown"""
+        if not openings or not self.book.endswith("epd"):
+            return None
+        book = get_book(self.book)
+        start, count, repeat = openings
+        return {position_key(book.opening(i).decode("utf-8", "replace")): i % len(book) for i in range(start, start + count)}
+
+    def affinity_slots(self, cpus, openings, seed):
+        """Split the rounds over the game slots, one single game cutechess process per slot"""
+        slots = []
+        slot_count = min(self.concurrency, self.rounds)
+        # the openings of a round are consecutive in the slice
+        openings_per_round = openings[1] // self.rounds if openings else 0
+        played_rounds = 0
+        for i, slot_cpus in enumerate(slot_cpus_of(cpus, slot_count)):
+            rounds = (i + 1) * self.rounds // slot_count - i * self.rounds // slot_count
+            slot_openings = None
+            if openings:
+                slot_openings = (
+                    openings[0] + played_rounds * openings_per_round,
+                    rounds * openings_per_round,
+                    openings[2],
+                )
+            slots.append((rounds, 1, slot_openings, (seed + i) % 2 ** 31, slot_cpus))
+            played_rounds += rounds
+        return slots
+
+    def run_measured(self, variables_list, openings=None, seed=None, load_balance=False):
+        """run_multi, also returning the host and rank, the games and time of this run, and its telemetry
+
+        With load_balance, the engine nps of the host is measured too.
+        """
+        nps = engine_nps(self.stockfish) if load_balance else 0
+        start = time.monotonic()
+        results = self.run_multi(variables_list, openings, seed)
+        return results, {
+            "host": socket.gethostname(),
+            "rank": rank_name(),
+            "nps": nps,
+            "games": sum(len(result) for result in results),
+            "elapsed": time.monotonic() - start,
+            "utilization": self.utilization,
+            "incomplete_pairs": self.incomplete_pairs,
+            "telemetry": self.summary,
+        }
+
+
+GAME_RESULT = re.compile(r"^Finished game (\d+) \((\S+) vs (\S+)\): (\S+)", re.MULTILINE)
+WHITE_RESULTS = {"1-0": "w", "0-1": "l", "1/2-1/2": "d"}
+BLACK_RESULTS = {"1-0": "l", "0-1": "w", "1/2-1/2": "d"}
+
+
+def parse_game_results(output, names):
+    """Parse cutechess-cli output into a sequence of game pairs for each test engine
+
+    Results are from the test engine's perspective, demultiplexed by engine name.
+    Games 2k+1 and 2k+2 are a pair (same opening, colors reversed), coded as in the
+    result cache (e.g. "wl"). Only complete pairs are kept, in the order of the game numbers.
+    Returns the pair sequences and the number of incomplete pairs dropped.
+    """
+    games = {}
+    for m in GAME_RESULT.finditer(output):
+        number, white, black, result = m.groups()
+        if white in names:
+            games[int(number)] = (white, WHITE_RESULTS.get(result))
+        elif black in names:
+            games[int(number)] = (black, BLACK_RESULTS.get(result))
+
+    pair_sequences = {name: [] for name in names}
+    incomplete_pairs = 0
+    for pair in sorted({(number - 1) // 2 for number in games}):
+        first, second = games.get(2 * pair + 1), games.get(2 * pair + 2)
+        if first and second and first[0] == second[0] and first[1] and second[1]:
+            pair_sequences[first[0]].append(first[1] + second[1])
+        else:
+            # a game that did not terminate properly, or is missing
+            incomplete_pairs += 1
+
+    return pair_sequences, incomplete_pairs
 
 
 class CutechessExecutorBatch:
@@ -229,35 +450,147 @@ class CutechessExecutorBatch:
         concurrency=2,
         batches=1,
         executor=None,
+        opening_book=None,
+        hash=16,
+        host_speeds=None,
+        load_balance=False,
+        affinity=False,
+        draw="movenumber=50 movecount=8 score=5",
+        resign="movecount=3 score=600",
+        telemetry=False,
     ):
         """Compute a batch of games using cutechess, specifying an executor
 
-        The executor (e.g. MPIPoolExecutor) allows for concurrency, in evaluating batches
+        The executor (e.g. MPIPoolExecutor) allows for concurrency, in evaluating batches.
+        With an OpeningBook, each batch plays a disjoint slice of its openings.
+        HostSpeeds collects the speed of the hosts and the cpu utilization of the ranks. With
+        load_balance, the games are split in many small batches, so that faster hosts play more.
+        With telemetry, the summaries of the games of all batches are combined in self.summary.
         """
 
         self.local_batch = CutechessLocalBatch(
-            cutechess, stockfish, stockfishRef, book, tc, tcRef, rounds, concurrency
+            cutechess, stockfish, stockfishRef, book, tc, tcRef, rounds, concurrency, hash, affinity,
+            draw, resign, telemetry
         )
+        self.summary = None
         self.batches = batches
         self.total_games = self.batches * self.local_batch.total_games
         self.executor = executor
+        self.opening_book = opening_book
+        self.host_speeds = host_speeds
+        self.load_balance = load_balance
 
-    def run(self, variables):
+    def opening_slices(self, openings_per_batch, repeat=1, crn=None):
+        """(start, count, repeat) of the openings of each batch, or None without an indexed book
+
+        With common random numbers crn = (start, seed), the slices start at the given opening
+        instead of at the next unused one of the book.
+        """
+        if not self.opening_book:
+            return [None] * self.batches
+        start = crn[0] if crn else self.opening_book.take(self.batches * openings_per_batch)
+        return [(start + i * openings_per_batch, openings_per_batch, repeat) for i in range(self.batches)]
+
+    def seeds(self, crn=None):
+        """-srand seed of each batch, deterministic with common random numbers"""
+        if not crn:
+            return [None] * self.batches
+        return [(crn[1] + i) % 2 ** 31 for i in range(self.batches)]
+
+    def run(self, variables, crn=None):
         """Run a batch of games returning a list containing 'w' 'l' 'd' results
 
         The results are shown from the point of view of test, which is the version that is
-        setup using the options set using the variables.
+        setup using the options set using the variables. Runs sharing the same common random
+        numbers crn = (start, seed) play the same openings with the same seeds.
         """
-        score = []
+        if self.load_balance:
+            return self.run_balanced([variables], crn)[0]
+
+        return self.run_multi([variables], crn)[0]
+
+    def run_multi(self, variables_list, crn=None):
+        """Run a batch of games for several parameter sets, sharing the cutechess processes
+
+        Returns a list with the 'w' 'l' 'd' results of each parameter set.
+        """
+        if self.load_balance:
+            return self.run_balanced(variables_list, crn)
+
+        scores = [[] for _ in variables_list]
         fs = []
 
-        for i in range(0, self.batches):
-            fs.append(self.executor.submit(self.local_batch.run, variables))
+        # in a gauntlet, each round plays a game pair with its own opening per test engine,
+        # with common random numbers all test engines of a round play the same opening.
+        if crn:
+            slices = self.opening_slices(self.local_batch.rounds, len(variables_list), crn)
+        else:
+            slices = self.opening_slices(self.local_batch.rounds * len(variables_list))
+        for openings, seed in zip(slices, self.seeds(crn)):
+            fs.append(self.executor.submit(self.local_batch.run_measured, variables_list, openings, seed))
+
+        summaries = []
+        for f in as_completed(fs):
+            results, info = f.result()
+            for score, result in zip(scores, results):
+                score.extend(result)
+            if self.host_speeds:
+                self.host_speeds.update(info)
+            if info["telemetry"]:
+                summaries.append(info["telemetry"])
+
+        if self.local_batch.telemetry:
+            self.summary = combine(summaries)
+        return scores
+
+    def run_balanced(self, variables_list, crn=None):
+        """Run the game pairs in many small batches of equal size, so that faster hosts play more of them
+
+        The workers take the next queued batch whenever they are free, so the games are shared in
+        proportion to the speed of the hosts, without knowing in advance which host runs a batch.
+        Each batch is split in SMALL_BATCHES, the measured speed of the hosts is only reported.
+        """
+        total_rounds = self.local_batch.rounds * self.batches
+        small_rounds = max(1, self.local_batch.rounds // SMALL_BATCHES)
+
+        # openings used per round, see run_multi
+        openings_per_round = 1 if crn else len(variables_list)
+        repeat = len(variables_list) if crn else 1
+        if self.opening_book:
+            start = crn[0] if crn else self.opening_book.take(total_rounds * openings_per_round)
+
+        scores = [[] for _ in variables_list]
+        summaries = []
+        fs = set()
+        submitted_rounds = 0
+
+        def submit(rounds):
+            nonlocal submitted_rounds
+            local_batch = copy.copy(self.local_batch)
+            local_batch.rounds = rounds
+            local_batch.total_games = 2 * rounds
+            openings = None
+            if self.opening_book:
+                openings = (start + submitted_rounds * openings_per_round, rounds * openings_per_round, repeat)
+            seed = (crn[1] + submitted_rounds) % 2 ** 31 if crn else None
+            fs.add(self.executor.submit(local_batch.run_measured, variables_list, openings, seed, True))
+            submitted_rounds += rounds
+
+        while submitted_rounds < total_rounds:
+            submit(min(small_rounds, total_rounds - submitted_rounds))
 
         for f in as_completed(fs):
-            score = score + f.result()
+            results, info = f.result()
+            for score, result in zip(scores, results):
+                score.extend(result)
+            if self.host_speeds:
+                self.host_speeds.update(info)
+            if info["telemetry"]:
+                summaries.append(info["telemetry"])
 
-        return score
+        if self.local_batch.telemetry:
+            self.summary = combine(summaries)
+        return scores
 
 
 # mpirun -np 3 python3 -m mpi4py.futures cutechess_batches.py
@@ -275,7 +608,7 @@ if __name__ == "__main__":
             """\
                   Compute batches of chess games using cutechess.
 
-                  This program requires mpi to run. A typical invocation could be:
+                  With mpi, a typical invocation could be:
                      mpirun -np 3 python3 -m mpi4py.futures cutechess_batches.py -tc 1.0+0.01 -g 10000 -cc 8
 
                   More documentation at:
@@ -338,31 +671,182 @@ if __name__ == "__main__":
         default="optimal.json",
         help="A dictionary containingthe parameters at which evaluation should happen",
     )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default="",
+        help="Directory of a persistent game result cache, shared across runs (disabled if empty)",
+    )
+    parser.add_argument(
+        "--cache_max_mb",
+        type=int,
+        default=256,
+        help="Maximum size of the game result cache in MB, least recently used entries are evicted",
+    )
+    parser.add_argument(
+        "--hash",
+        type=int,
+        default=16,
+        help="Hash size in MB of the engines",
+    )
+    parser.add_argument(
+        "--mpi_subbatches",
+        type=int,
+        default=0,
+        help="Number of cutechess processes the games are split over, defaults to the number of workers",
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default="",
+        help="Throughput settings written by calibrate.py, used as defaults for the corresponding arguments",
+    )
+    parser.add_argument(
+        "--load_balance",
+        action="store_true",
+        help="Split the batches of games in smaller ones that faster hosts take more of, reporting the speed of the hosts",
+    )
+    parser.add_argument(
+        "--affinity",
+        action="store_true",
+        help="Pin each rank and each of its game slots to dedicated cpus, NUMA aware",
+    )
+    parser.add_argument(
+        "--sprt",
+        action="store_true",
+        help="Play waves of games until the SPRT passes or fails, with --games_per_batch as maximum",
+    )
+    parser.add_argument(
+        "--wave_games",
+        type=int,
+        default=2000,
+        help="Number of games per wave with --sprt",
+    )
+    parser.add_argument(
+        "--book_slices",
+        action="store_true",
+        help="Index the book once and give each cutechess worker a disjoint slice of its openings",
+    )
+    parser.add_argument(
+        "--draw",
+        type=str,
+        default="movenumber=50 movecount=8 score=5",
+        help="cutechess -draw adjudication settings",
+    )
+    parser.add_argument(
+        "--resign",
+        type=str,
+        default="movecount=3 score=600",
+        help="cutechess -resign adjudication settings",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store_true",
+        help="Record per-game telemetry (plies, termination, engine time) from the PGN of the games",
+    )
+    add_backend_arguments(parser)
+    config = load_throughput_config(parser)
     args = parser.parse_args()
 
-    workers = MPI.COMM_WORLD.Get_size() - 1
+    import cutechess_batches
+
+    executor, workers = create_executor(
+        args.backend,
+        args.listen,
+        args.authkey,
+        args.min_workers,
+        args.local_workers,
+        args.scheduler,
+        args.experiment,
+        args.weight,
+    )
+    batches = args.mpi_subbatches if args.mpi_subbatches > 0 else config.get("cutechess_processes", workers)
 
     with open(args.parameters, "r") as infile:
         variables = json.load(infile)
 
     print(
-        "Starting evaluation (%d games, tc %s) with %d workers for parameter set:"
-        % (args.games_per_batch, args.tc, workers),
+        "Starting %sevaluation (%d games, tc %s) with %d workers for parameter set:"
+        % ("sequential " if args.sprt else "", args.games_per_batch, args.tc, workers),
         flush=True,
     )
     print(variables, flush=True)
 
-    batch = CutechessExecutorBatch(
-        cutechess=args.cutechess,
-        stockfish=args.stockfish,
-        stockfishRef=args.stockfishRef if args.stockfishRef else args.stockfish,
-        book=args.book,
-        tc=args.tc,
-        tcRef=args.tcRef if args.tcRef else args.tc,
-        rounds=((args.games_per_batch + 1) // 2 + workers - 1) // workers,
-        concurrency=args.cutechess_concurrency,
-        batches=workers,
-        executor=MPIPoolExecutor(),
-    )
-    results = batch.run(variables)
+    stockfishRef = args.stockfishRef if args.stockfishRef else args.stockfish
+    tcRef = args.tcRef if args.tcRef else args.tc
+    host_speeds = HostSpeeds() if args.load_balance else None
+
+    def play(games):
+        """play (at least) the given number of games, adding them to the cache"""
+        # use the class of the imported module, which the workers can unpickle (unlike that of __main__)
+        batch = cutechess_batches.CutechessExecutorBatch(
+            cutechess=args.cutechess,
+            stockfish=args.stockfish,
+            stockfishRef=stockfishRef,
+            book=args.book,
+            tc=args.tc,
+            tcRef=tcRef,
+            rounds=((games + 1) // 2 + batches - 1) // batches,
+            concurrency=args.cutechess_concurrency,
+            batches=batches,
+            executor=executor,
+            opening_book=get_book(args.book) if args.book_slices else None,
+            hash=args.hash,
+            host_speeds=host_speeds,
+            load_balance=args.load_balance,
+            affinity=args.affinity,
+            draw=args.draw,
+            resign=args.resign,
+            telemetry=args.telemetry,
+        )
+        results = batch.run(variables)
+        if args.telemetry:
+            print("telemetry: %s" % report(batch.summary), flush=True)
+        if host_speeds:
+            print("host weights: %s" % host_speeds, flush=True)
+        if args.cache_dir:
+            cache.add(key, results)
+        return results
+
+    # games already played for this setup can be taken from the cache
+    results = []
+    if args.cache_dir:
+        cache = ResultCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+        key = cache.key(
+            args.stockfish,
+            stockfishRef,
+            args.tc,
+            tcRef,
+            args.book,
+            variables,
+            hash=args.hash,
+            draw=args.draw,
+            resign=args.resign,
+        )
+        results = cache.lookup_sequence(key)
+        print("Found %d cached games." % len(results), flush=True)
+
+    if args.sprt:
+        # play waves of games until the SPRT accepts or rejects, or the games run out
+        while True:
+            fishtest_stats = fishtest_sprt()
+            fishtest_stats.set_state(pentanomial_results(results))
+            print(
+                "%d games, LLR %.2f [%.2f, %.2f]"
+                % (len(results), fishtest_stats.llr, fishtest_stats.a, fishtest_stats.b),
+                flush=True,
+            )
+            if len(results) > 0 and not fishtest_stats.a < fishtest_stats.llr < fishtest_stats.b:
+                print("SPRT %s." % ("accepted" if fishtest_stats.llr >= fishtest_stats.b else "rejected"))
+                break
+            if len(results) >= args.games_per_batch:
+                print("SPRT did not finish within %d games." % args.games_per_batch)
+                break
+            results = results + play(
+                min(args.wave_games, args.games_per_batch - len(results))
+            )
+    elif len(results) < args.games_per_batch:
+        results = results + play(args.games_per_batch - len(results))
+
     pprint(calc_stats(results))
+    executor.shutdown()
@@ -8,4 +8,5 @@ mpiexec -np $mpi_concurrency python3 \
   -m mpi4py.futures cutechess_batches.py \
   -tc "10000+10000 nodes=5000" \
   -g 20000 \
+  --sprt \
   -cc 8
@@ -0,0 +1,147 @@
+"""
+Executors running the cutechess batches on the workers.
+
+mpi: MPIPoolExecutor, the workers are the MPI ranks other than the master,
+     fixed when mpiexec starts the program.
+tcp: TCPPoolExecutor, the workers connect to the master over TCP (see
+     tcp_executor.py), and can join or leave at any time.
+local: ProcessPoolExecutor on this host, results come back through pipes.
+     No mpirun is needed, and no core is kept for a master rank.
+scheduler: SchedulerExecutor, the batches are submitted to a scheduler sharing
+     its tcp workers fairly between several experiments (see scheduler.py).
+
+The backends are only imported when used, so that mpi4py is only needed with mpi.
+"""
+
+import os
+import sys
+import socket
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+BACKENDS = ["mpi", "tcp", "local", "scheduler"]
+
+
+def _init_local_worker(counter, workers):
+    """Give each local worker process a rank, used for its cpu affinity"""
+    with counter.get_lock():
+        rank = counter.value
+        counter.value += 1
+    os.environ["AFFINITY_LOCAL_RANK"] = str(rank % workers)
+    os.environ["AFFINITY_LOCAL_SIZE"] = str(workers)
+
+
+def add_backend_arguments(parser):
+    """Add the arguments selecting and configuring the backend to an argparse parser"""
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="mpi",
+        help="How the games are distributed over the workers",
+    )
+    parser.add_argument(
+        "--listen",
+        type=str,
+        default="0.0.0.0:5555",
+        help="host:port on which the master waits for workers, with --backend tcp",
+    )
+    parser.add_argument(
+        "--authkey",
+        type=str,
+        default=os.environ.get("NG4SF_AUTHKEY", ""),
+        help="Key the tcp workers need, defaults to the NG4SF_AUTHKEY environment variable, random if empty",
+    )
+    parser.add_argument(
+        "--min_workers",
+        type=int,
+        default=1,
+        help="Number of tcp workers to wait for before starting, more can join later",
+    )
+    parser.add_argument(
+        "--local_workers",
+        type=int,
+        default=0,
+        help="Number of worker processes with --backend local, 0 for one per 8 cpus",
+    )
+    parser.add_argument(
+        "--scheduler",
+        type=str,
+        default="127.0.0.1:5556",
+        help="host:port on which the scheduler waits for experiments, with --backend scheduler",
+    )
+    parser.add_argument(
+        "--experiment",
+        type=str,
+        default="",
+        help="Name of the experiment for the scheduler, defaults to the output dir",
+    )
+    parser.add_argument(
+        "--weight",
+        type=float,
+        default=1.0,
+        help="Share of the workers of the scheduler relative to the other experiments",
+    )
+
+
+def create_executor(
+    backend="mpi",
+    listen="0.0.0.0:5555",
+    authkey="",
+    min_workers=1,
+    local_workers=0,
+    scheduler="127.0.0.1:5556",
+    experiment="",
+    weight=1.0,
+):
+    """The executor of a backend, and its number of workers when starting"""
+    if backend == "mpi":
+        from mpi4py import MPI
+        from mpi4py.futures import MPIPoolExecutor
+
+        workers = MPI.COMM_WORLD.Get_size() - 1
+        if workers < 1:
+            sys.stderr.write("The mpi backend needs to run under mpi with at least 2 MPI ranks.\n")
+            sys.exit(1)
+        return MPIPoolExecutor(), workers
+
+    if backend == "tcp":
+        from tcp_executor import TCPPoolExecutor, parse_address
+
+        executor = TCPPoolExecutor(parse_address(listen), authkey.encode())
+        print(
+            "Waiting for %d tcp %s, start them with:\n   python3 tcp_executor.py --connect %s:%d --authkey %s"
+            % (
+                min_workers,
+                "worker" if min_workers == 1 else "workers",
+                socket.gethostname(),
+                executor.address[1],
+                executor.authkey.decode(),
+            ),
+            flush=True,
+        )
+        executor.wait_for_workers(min_workers)
+        return executor, executor.num_workers
+
+    if backend == "local":
+        workers = local_workers if local_workers > 0 else max(1, len(os.sched_getaffinity(0)) // 8)
+        # forkserver: the workers do not inherit the threads of the master
+        context = multiprocessing.get_context("forkserver")
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_local_worker,
+            initargs=(context.Value("i", 0), workers),
+        )
+        return executor, workers
+
+    if backend == "scheduler":
+        from scheduler import SchedulerExecutor
+        from tcp_executor import parse_address
+
+        experiment = experiment or "%s:%d" % (socket.gethostname(), os.getpid())
+        executor = SchedulerExecutor(parse_address(scheduler, "127.0.0.1"), authkey.encode(), experiment, weight)
+        print("Experiment %s joined the scheduler at %s, which has %d workers" % (experiment, scheduler, executor.workers))
+        # the batches are split for all workers, those of the other experiments included
+        return executor, max(1, executor.workers)
+
+    sys.exit("Unknown backend: %s" % backend)
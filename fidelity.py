@@ -0,0 +1,35 @@
+"""
+Fidelity levels at which points can be evaluated.
+
+A fidelity is a time control for test and reference together with a number of
+games. Cheap levels (e.g. a low nodes= limit) are used to screen points, only
+promising points are evaluated at the target fidelity of the run.
+"""
+
+import argparse
+
+
+class Fidelity:
+    def __init__(self, tc, tcRef, games):
+        self.tc = tc
+        self.tcRef = tcRef
+        self.games = games
+
+    def __str__(self):
+        if self.tc == self.tcRef:
+            return "%s (%d games)" % (self.tc, self.games)
+        return "%s vs %s (%d games)" % (self.tc, self.tcRef, self.games)
+
+
+def parse_fidelity(spec):
+    """Parse 'GAMES:TC' or 'GAMES:TC:TCREF', e.g. '64:10000+10000 nodes=500'"""
+    fields = spec.split(":")
+    if len(fields) not in (2, 3):
+        raise argparse.ArgumentTypeError(
+            "fidelity must be GAMES:TC or GAMES:TC:TCREF, got: %s" % spec
+        )
+    try:
+        games = int(fields[0])
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid number of games in fidelity: %s" % spec)
+    return Fidelity(fields[1], fields[2] if len(fields) == 3 else fields[1], games)
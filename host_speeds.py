@@ -0,0 +1,69 @@
+"""
+Speed of the hosts running cutechess batches, for load balancing, and utilization of the ranks.
+
+With load balancing, the games are split in many small batches of equal size,
+which the workers take as soon as they are free, so that faster hosts play more
+of them. Every batch reports the games/s it achieved, and the engine nps its
+host measured once with a short bench. The master keeps a running average of
+the games/s per host, and reports the relative speed (weight) of each host.
+
+With or without load balancing, every batch also reports the cpu utilization of
+the rank that ran it, the master keeps the last one of each rank.
+"""
+
+import re
+import threading
+from subprocess import Popen, PIPE, STDOUT
+
+_engine_nps = {}
+
+
+def engine_nps(stockfish):
+    """Nodes/second of a short stockfish bench on this host, measured once per process"""
+    if stockfish not in _engine_nps:
+        process = Popen("%s bench 16 1 10" % stockfish, shell=True, stdout=PIPE, stderr=STDOUT)
+        output = process.communicate()[0].decode("utf-8")
+        m = re.search(r"Nodes/second\s*:\s*(\d+)", output)
+        _engine_nps[stockfish] = int(m.group(1)) if m else 0
+    return _engine_nps[stockfish]
+
+
+class HostSpeeds:
+    def __init__(self, smoothing=0.3):
+        """smoothing is the weight of a new measurement in the running average"""
+        self.smoothing = smoothing
+        self.hosts = {}
+        self.ranks = {}
+        self.lock = threading.Lock()
+
+    def update(self, info):
+        """Add the measurement of a batch: host, rank, nps, games, elapsed seconds and utilization"""
+        with self.lock:
+            if info.get("utilization") is not None:
+                self.ranks[info["rank"]] = info["utilization"]
+        if info["elapsed"] <= 0 or info["games"] == 0:
+            return
+        games_per_second = info["games"] / info["elapsed"]
+        with self.lock:
+            host = self.hosts.setdefault(
+                info["host"], {"nps": info["nps"], "games_per_second": games_per_second, "batches": 0}
+            )
+            host["nps"] = info["nps"]
+            host["games_per_second"] += self.smoothing * (games_per_second - host["games_per_second"])
+            host["batches"] += 1
+
+    def utilization(self):
+        """The last measured cpu utilization of each rank"""
+        with self.lock:
+            return dict(self.ranks)
+
+    def __str__(self):
+        with self.lock:
+            hosts = {name: dict(h) for name, h in self.hosts.items()}
+        if not hosts:
+            return "no measurements"
+        average = sum(h["games_per_second"] for h in hosts.values()) / len(hosts)
+        return ", ".join(
+            "%s %.2f (%d nps, %.2f games/s)" % (name, h["games_per_second"] / average, h["nps"], h["games_per_second"])
+            for name, h in sorted(hosts.items())
+        )
@@ -0,0 +1,212 @@
+"""
+Losses the optimizer minimizes, computed from the pentanomial of a point.
+
+   sprt                the fishtest SPRT: -LLR with the alt2 (Brownian) drift, in normalized Elo,
+                       clamped to the bounds of an SPRT with alpha = beta = 0.05 (the default)
+   llr_normalized      -LLR of the GSPRT with the t-value statistic, in normalized Elo, not clamped
+   llr_normalized_alt  -LLR of the approximation of the GSPRT in normalized Elo, not clamped
+   llr_logistic        -LLR of the GSPRT with the expectation statistic, in logistic Elo, not clamped
+   elo                 -normalized Elo
+   los                 1 - likelihood of superiority
+
+The LLR losses test elo0 against elo1. The LLR grows with the number of games,
+so that points with more games (e.g. those evaluated again) count more, while
+the Elo and LOS do not depend on the number of games in this way.
+
+Running this module compares the losses on simulated pentanomials: the cost of
+a call, and the number of games after which the loss ranks a point that is
+better by a given Elo difference above the other one reliably. As in a run,
+where the optimizer evaluates the points it converges to again, the other point
+has more games than the better one, so that the losses that grow with the
+number of games need more games of the better point than those that do not.
+"""
+
+import sys
+import math
+import time
+import argparse
+import textwrap
+
+from stats import LLRcalc
+from stats.sprt import sprt
+
+
+def sprt_loss(pentanomial, elo0, elo1):
+    fishtest_stats = sprt(alpha=0.05, beta=0.05, elo0=elo0, elo1=elo1, elo_model="normalized")
+    fishtest_stats.set_state(pentanomial)
+    return -fishtest_stats.llr
+
+
+def llr_normalized_loss(pentanomial, elo0, elo1):
+    return -LLRcalc.LLR_normalized(elo0, elo1, pentanomial)
+
+
+def llr_normalized_alt_loss(pentanomial, elo0, elo1):
+    return -LLRcalc.LLR_normalized_alt(elo0, elo1, pentanomial)
+
+
+def llr_logistic_loss(pentanomial, elo0, elo1):
+    return -LLRcalc.LLR_logistic(elo0, elo1, pentanomial)
+
+
+def elo_loss(pentanomial, elo0, elo1):
+    N, pdf = LLRcalc.results_to_pdf(pentanomial)
+    mu, var = LLRcalc.stats(pdf)
+    return -(mu - 0.5) / math.sqrt(2 * var) * LLRcalc.nelo_divided_by_nt
+
+
+def los_loss(pentanomial, elo0, elo1):
+    N, pdf = LLRcalc.results_to_pdf(pentanomial)
+    mu, var = LLRcalc.stats(pdf)
+    return 1 - (1 + math.erf((mu - 0.5) / math.sqrt(2 * var / N))) / 2
+
+
+LOSSES = {
+    "sprt": sprt_loss,
+    "llr_normalized": llr_normalized_loss,
+    "llr_normalized_alt": llr_normalized_alt_loss,
+    "llr_logistic": llr_logistic_loss,
+    "elo": elo_loss,
+    "los": los_loss,
+}
+
+
+def get_loss(name="sprt", elo0=0.0, elo1=2.0):
+    """The loss of a pentanomial, as a function of the pentanomial only"""
+    if name not in LOSSES:
+        sys.exit("Unknown loss: %s, choose from %s" % (name, ", ".join(LOSSES)))
+    loss = LOSSES[name]
+    return lambda pentanomial: loss(pentanomial, elo0, elo1)
+
+
+def pentanomial_probabilities(elo, draw_pairs=0.6):
+    """Probabilities of the game pair results of a point with a (logistic) Elo, and a typical spread
+
+    The probabilities are those closest to a symmetric distribution with draw_pairs
+    balanced pairs (LW+DD+WL), that have the expected score of the Elo.
+    """
+    side = (1 - draw_pairs) / 2
+    pdf = [(0.0, 0.05 * side), (0.25, 0.95 * side), (0.5, draw_pairs), (0.75, 0.95 * side), (1.0, 0.05 * side)]
+    return [p for value, p in LLRcalc.MLE_expected(pdf, LLRcalc.L_(elo))]
+
+
+def benchmark(names, elo0, elo1, better_elo, base_elo, max_games, repeats, correct, uneven=4, seed=0):
+    """Rank simulated pairs of points with each loss, printing their cost and the games needed
+
+    The other point has uneven times the games of the better point.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    probabilities = [pentanomial_probabilities(base_elo + better_elo), pentanomial_probabilities(base_elo)]
+    games = [64]
+    while games[-1] < max_games:
+        games.append(2 * games[-1])
+    # the same simulated matches for all losses
+    samples = {
+        g: [[rng.multinomial(n // 2, p).tolist() for n, p in zip([g, uneven * g], probabilities)] for _ in range(repeats)]
+        for g in games
+    }
+
+    print(
+        f"{better_elo} Elo better than {base_elo} Elo with {uneven} times its games,"
+        f" ranked correctly in {correct:.0%} of {repeats} simulations:"
+    )
+    print(f'   {"loss":20} {"us/call":>10} {"games":>10} {"ties":>8}')
+    for name in names:
+        loss = get_loss(name, elo0, elo1)
+        calls, seconds, needed, ties = 0, 0.0, None, 0.0
+        for g in games:
+            wins, tied = 0.0, 0
+            for better, other in samples[g]:
+                start = time.perf_counter()
+                better_loss, other_loss = loss(better), loss(other)
+                seconds += time.perf_counter() - start
+                calls += 2
+                if better_loss < other_loss:
+                    wins += 1
+                elif better_loss == other_loss:
+                    wins += 0.5
+                    tied += 1
+            if needed is None and wins >= correct * repeats:
+                needed = g
+            ties = tied / repeats
+        print(
+            f'   {name:20} {1e6 * seconds / calls:10.1f} {needed if needed else ">" + str(max_games):>10} {ties:8.1%}',
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+
+    class MyFormatter(
+        argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter
+    ):
+        pass
+
+    parser = argparse.ArgumentParser(
+        formatter_class=MyFormatter,
+        description=textwrap.dedent(
+            """\
+                  Compare the losses on simulated pentanomials: the cost of a call, the
+                  number of games of a better point after which it is ranked correctly
+                  against a point with more games, and the fraction of ties (e.g. of
+                  clamped LLRs) with the most games.
+
+                  A typical invocation could be:
+                     python3 losses.py --better_elo 2 --base_elo 0
+                  """
+        ),
+    )
+    parser.add_argument(
+        "--losses",
+        type=str,
+        default=",".join(LOSSES),
+        help="Comma separated losses to compare",
+    )
+    parser.add_argument("--elo0", type=float, default=0.0, help="Lower (normalized) Elo bound of the LLR losses")
+    parser.add_argument("--elo1", type=float, default=2.0, help="Upper (normalized) Elo bound of the LLR losses")
+    parser.add_argument(
+        "--better_elo",
+        type=float,
+        default=5.0,
+        help="Elo difference of the better of the two simulated points",
+    )
+    parser.add_argument(
+        "--base_elo",
+        type=float,
+        default=0.0,
+        help="Elo of the other simulated point, relative to the reference",
+    )
+    parser.add_argument(
+        "--max_games",
+        type=int,
+        default=65536,
+        help="Games of the better point in the largest simulated match, starting from 64 and doubling",
+    )
+    parser.add_argument(
+        "--uneven",
+        type=int,
+        default=4,
+        help="Games of the other point, as a multiple of those of the better point (1 for equal games)",
+    )
+    parser.add_argument("--repeats", type=int, default=200, help="Simulated matches per number of games")
+    parser.add_argument(
+        "--correct",
+        type=float,
+        default=0.9,
+        help="Fraction of the simulations in which the better point must be ranked first",
+    )
+    args = parser.parse_args()
+
+    benchmark(
+        args.losses.split(","),
+        args.elo0,
+        args.elo1,
+        args.better_elo,
+        args.base_elo,
+        args.max_games,
+        args.repeats,
+        args.correct,
+        args.uneven,
+    )
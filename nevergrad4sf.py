@@ -15,16 +15,33 @@ import datetime
 import time
 import argparse
 import json
+import random
+import threading
+import multiprocessing
 from pathlib import Path
 from pprint import pprint
 from subprocess import Popen, PIPE
+import signal
 import textwrap
 
 import nevergrad as ng
-from cutechess_batches import CutechessExecutorBatch, calc_stats
-from mpi4py import MPI
-from mpi4py.futures import MPIPoolExecutor
-from concurrent.futures import ThreadPoolExecutor
+from cutechess_batches import CutechessExecutorBatch, calc_stats, sprt_llr, pentanomial_results, pentanomial_elo, load_throughput_config
+from result_cache import ResultCache, pairs_to_sequence
+from warm_start import load_experiment, warm_start_values, prior_observations
+from racing import race
+from fidelity import Fidelity, parse_fidelity
+from opening_book import get_book
+from host_speeds import HostSpeeds
+from budget import Budget
+from surrogate import Surrogate
+from spatial_index import SpatialIndex
+from blocks import group_params
+from sensitivity import design, effects
+from losses import LOSSES, get_loss
+from precision import METRICS, point_error, more_games
+from telemetry import combine, report
+from executors import create_executor, add_backend_arguments
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
 
 
 def get_sf_parameters(stockfish_exe):
@@ -74,6 +91,50 @@ def ng4sf(
     cutechess_concurrency,
     evaluation_concurrency,
     output_dir,
+    cache_dir="",
+    cache_max_mb=256,
+    warm_start="",
+    warm_start_weight=0.0,
+    racing=False,
+    race_min_games=32,
+    screening=None,
+    promote_llr=0.0,
+    multi_candidate=False,
+    book_slices=False,
+    crn=False,
+    hash=16,
+    mpi_subbatches=0,
+    load_balance=False,
+    affinity=False,
+    stats_workers=1,
+    time_budget=0.0,
+    games_budget=0,
+    final_games=1024,
+    surrogate=False,
+    pool_radius=0.0,
+    backend="mpi",
+    listen="0.0.0.0:5555",
+    authkey="",
+    min_workers=1,
+    local_workers=0,
+    draw="movenumber=50 movecount=8 score=5",
+    resign="movecount=3 score=600",
+    telemetry=False,
+    plot_interval=0.0,
+    param_groups="",
+    block_evals=0,
+    sensitivity_games=0,
+    freeze_z=1.0,
+    loss="sprt",
+    elo0=0.0,
+    elo1=2.0,
+    scheduler="127.0.0.1:5556",
+    experiment="",
+    weight=1.0,
+    target_se=0.0,
+    min_games=0,
+    max_games=0,
+    precision_metric="logistic_elo",
 ):
     """
     nevergrad for sf: optimize parameters in a tuning enabled stockfish.
@@ -82,17 +143,23 @@ def ng4sf(
     games per batch, cutechess concurrency, and evaluation batch concurrency
     """
 
-    # ready to run with mpi
-    size = MPI.COMM_WORLD.Get_size()
-    print()
-    if size > 1:
-        print(f"Launched ... with {size} mpi ranks (1 master, {size - 1} workers).")
-        print(flush=True)
-    else:
-        sys.stderr.write("ng4sf needs to run under mpi with at least 2 MPI ranks.\n")
-        sys.exit(1)
+    screening = screening or []
+
+    # the final evaluation may take at most a quarter of a games budget, leaving the rest for the optimization
+    if games_budget and final_games > games_budget // 4:
+        capped = games_budget // 4 // 2 * 2
+        print(
+            f"final_games {final_games} does not leave enough of the games budget {games_budget}, "
+            f"using {capped} games for the final evaluation instead.",
+            flush=True,
+        )
+        final_games = capped
 
     # print summary
+    print()
+    print("worker backend                            : ", backend)
+    if backend == "scheduler":
+        print("scheduler, experiment and weight          : ", scheduler, experiment or output_dir, weight)
     print("stockfish binary                          : ", stockfish)
     print("stockfish reference binary                : ", stockfishRef)
     print("cutechess binary                          : ", cutechess)
@@ -104,8 +171,35 @@ def ng4sf(
     print("initial batch size in games               : ", games_per_batch)
     print("batch size increase per ng iteration      : ", batch_increase_per_iter)
     print("cutechess concurrency                     : ", cutechess_concurrency)
+    print("engine hash (MB)                          : ", hash)
     print("batch evaluation concurrency:             : ", evaluation_concurrency)
     print("output dir:                               : ", output_dir)
+    print("result cache dir:                         : ", cache_dir)
+    print("warm start from:                          : ", warm_start)
+    print("warm start observation weight:            : ", warm_start_weight)
+    print("racing (initial games per candidate):     : ", racing, race_min_games)
+    print("screening fidelities:                     : ", [str(fidelity) for fidelity in screening])
+    print("screening LLR needed for promotion:       : ", promote_llr)
+    print("multi-candidate batches:                  : ", multi_candidate)
+    print("disjoint book slices:                     : ", book_slices)
+    print("common random numbers:                    : ", crn)
+    print("load balancing by host speed:             : ", load_balance)
+    print("cpu affinity of ranks and game slots:     : ", affinity)
+    print("background statistics processes:         : ", stats_workers)
+    print("time budget (s) and games budget:         : ", time_budget, games_budget)
+    print("final evaluation games (with a budget):   : ", final_games)
+    print("quadratic surrogate model:                : ", surrogate)
+    print("radius for pooling nearby points:         : ", pool_radius)
+    print("cutechess draw and resign adjudication:   : ", draw, "/", resign)
+    print("per-game telemetry:                       : ", telemetry)
+    print("seconds between plot refreshes:           : ", plot_interval)
+    print("parameter groups tuned in turn:           : ", param_groups)
+    print("evaluations per parameter group:          : ", block_evals)
+    print("sensitivity screening games per point:    : ", sensitivity_games)
+    print("significance needed to not freeze (z):    : ", freeze_z)
+    print("loss (and Elo bounds of LLR losses):      : ", loss, [elo0, elo1])
+    print("target error of a point (0 for fixed):    : ", target_se, precision_metric)
+    print("min and max games of a point:             : ", min_games, max_games)
     print(flush=True)
 
     # get info from sf
@@ -120,27 +214,192 @@ def ng4sf(
     pprint(sf_params)
     print(flush=True)
 
-    # our choice of making mpi_subbatches, i.e. mpi processes per batch (this could be tunable for performance?)
-    mpi_subbatches = 2 * (
-        (size - 1 + evaluation_concurrency - 1) // evaluation_concurrency
+    # the reporting statistics are computed off the master thread, in processes started by a
+    # forkserver: under mpi the master is already initialized, so it must not be forked
+    stats_executor = None
+    if stats_workers > 0:
+        stats_executor = ProcessPoolExecutor(
+            max_workers=stats_workers, mp_context=multiprocessing.get_context("forkserver")
+        )
+        stats_executor.submit(int).result()
+
+    # all batches share the pool of workers
+    worker_executor, workers = create_executor(
+        backend, listen, authkey, min_workers, local_workers, scheduler, experiment or output_dir, weight
     )
+    print(f"Launched ... with {workers} workers ({backend} backend).")
+    print(flush=True)
+
+    # our choice of making mpi_subbatches, i.e. worker processes per batch (tunable with calibrate.py)
+    if mpi_subbatches <= 0:
+        mpi_subbatches = 2 * (
+            (workers + evaluation_concurrency - 1) // evaluation_concurrency
+        )
+
+    # and, optionally, the indexed opening book from which they take disjoint slices
+    opening_book = get_book(book) if book_slices or crn else None
+
+    # and the measured speed of the hosts, for balancing the load, and the cpu utilization of the ranks
+    host_speeds = HostSpeeds()
+
+    # the target fidelity of the run, its number of games grows with batch_increase_per_iter
+    target = Fidelity(tc, tcRef, games_per_batch)
 
     # creating the batch
-    def create_cutechess_executor_batch(games_per_batch):
+    def create_cutechess_executor_batch(games_per_batch, fidelity=target, batches=mpi_subbatches):
         return CutechessExecutorBatch(
             cutechess=cutechess,
             stockfish=stockfish,
             stockfishRef=stockfishRef,
             book=book,
-            tc=tc,
-            tcRef=tcRef,
-            rounds=((games_per_batch + 1) // 2 + mpi_subbatches - 1) // mpi_subbatches,
+            tc=fidelity.tc,
+            tcRef=fidelity.tcRef,
+            rounds=((games_per_batch + 1) // 2 + batches - 1) // batches,
             concurrency=cutechess_concurrency,
-            batches=mpi_subbatches,
-            executor=MPIPoolExecutor(),
+            batches=batches,
+            executor=worker_executor,
+            opening_book=opening_book,
+            hash=hash,
+            host_speeds=host_speeds,
+            load_balance=load_balance,
+            affinity=affinity,
+            draw=draw,
+            resign=resign,
+            telemetry=telemetry,
         )
 
-    batch = create_cutechess_executor_batch(games_per_batch)
+    # optional per-game telemetry, totals per fidelity over the whole run
+    telemetry_totals = {}
+    telemetry_lock = threading.Lock()
+    telemetry_file_path = str(Path(output_dir, "telemetry.json"))
+
+    def run_batch(batch, params, crn=None, fidelity=target):
+        """Run a batch of games for a point, reporting the telemetry of its games"""
+        results = batch.run(params, crn)
+        if telemetry:
+            print(f"telemetry at {fidelity}: {report(batch.summary)}", flush=True)
+            with telemetry_lock:
+                key = f"{fidelity.tc} vs {fidelity.tcRef}"
+                telemetry_totals[key] = combine([telemetry_totals.get(key, combine([])), batch.summary])
+                with open(telemetry_file_path, "w") as outfile:
+                    json.dump(telemetry_totals, outfile, indent=2)
+        return results
+
+    # optional persistent cache of game results, shared across runs
+    cache = ResultCache(cache_dir, cache_max_mb * 1024 * 1024) if cache_dir else None
+
+    def cache_key(params, fidelity):
+        return cache.key(stockfish, stockfishRef, fidelity.tc, fidelity.tcRef, book, params, hash=hash, draw=draw, resign=resign)
+
+    # games played at the same point and fidelity, results of different fidelities are kept apart
+    games_accumulator = {}
+
+    def accumulator_key(params, fidelity):
+        params = {key: params[key] for key in sorted(params)}
+        return str((fidelity.tc, fidelity.tcRef, params))
+
+    def previous_results(params, fidelity):
+        if cache:
+            return cache.lookup_sequence(cache_key(params, fidelity))
+        return games_accumulator.get(accumulator_key(params, fidelity), []).copy()
+
+    def games_ceiling():
+        """Most games of a point with target_se"""
+        return max_games if max_games > 0 else 8 * target.games
+
+    # common random numbers: points of the same block play the same openings with the same seeds
+    crn_blocks = {}
+
+    def crn_block(block, games_played=0):
+        """(first opening, seed) of a block of points, None without common random numbers
+
+        games_played skips the openings of games the points of the block already played.
+        With target_se, the openings of the block cover the extra games up to the ceiling.
+        """
+        if not crn:
+            return None
+        if block not in crn_blocks:
+            games = games_ceiling() if target_se > 0 else target.games
+            pairs = create_cutechess_executor_batch(games).total_games // 2
+            crn_blocks[block] = (opening_book.take(pairs), random.SystemRandom().randint(0, 2 ** 31 - 1))
+        start, seed = crn_blocks[block]
+        return (start + games_played // 2, seed + games_played)
+
+    def play_games(params, games, fidelity, crn=None, played=0, scheduled=None):
+        """Play games for a point at a fidelity, only those not yet in the cache
+
+        played counts games of the point that are already played, but not yet in the cache.
+        The games of the batch are added to scheduled, a list holding the games scheduled.
+        """
+        games -= played
+        if cache:
+            cached_games = len(previous_results(params, fidelity))
+            if cached_games >= games:
+                print(f"Found {cached_games} cached games for this point, not playing any.")
+                return []
+            if cached_games > 0:
+                print(f"Found {cached_games} cached games for this point, playing {games - cached_games} more.")
+            games -= cached_games
+        batch = create_cutechess_executor_batch(games, fidelity)
+        if scheduled is not None:
+            scheduled[0] += batch.total_games
+        return run_batch(batch, params, crn, fidelity)
+
+    def evaluate_point(params, crn=None, games=None, reservation=None):
+        """Screen a point at the cheap fidelities, evaluate it at the target fidelity if promising
+
+        games overrides the number of games at the target fidelity. With target_se, the games
+        reserved for further rounds are added to reservation, a list holding the games reserved.
+        Returns a list of (fidelity, results) for the fidelities at which games were played.
+        """
+        played = []
+        for fidelity in screening:
+            results = play_games(params, fidelity.games, fidelity, crn)
+            played.append((fidelity, results))
+            llr = sprt_llr(pentanomial_results(previous_results(params, fidelity) + results))
+            if llr < promote_llr:
+                return played
+        if target_se > 0:
+            played.append((target, play_to_precision(params, games or target.games, crn, reservation)))
+        else:
+            played.append((target, play_games(params, games or target.games, target, crn)))
+        return played
+
+    def play_to_precision(params, games, crn=None, reservation=None):
+        """Play games at the target fidelity until the error of the point is below target_se
+
+        The first round plays games, the next ones reserve their games from the budget.
+        min_games and max_games count the games of previous evaluations of the point too.
+        """
+        ceiling = games_ceiling()
+        # the games scheduled so far, in whole pairs even if some pairs are incomplete
+        scheduled = [0]
+        results = play_games(params, games, target, crn, scheduled=scheduled)
+        while True:
+            combined = previous_results(params, target) + results
+            error = point_error(pentanomial_results(combined), precision_metric, elo0, elo1)
+            extra = more_games(len(combined), error, target_se, min_games, ceiling)
+            reserved = budget.reserve(extra) if extra else 0
+            if not reserved:
+                return results
+            # the next openings of the block with common random numbers
+            round_crn = (crn[0] + scheduled[0] // 2, crn[1] + scheduled[0]) if crn else None
+            # sub-batches play the same number of game pairs, leave out those that would exceed the reservation
+            batches = max(1, min(mpi_subbatches, reserved // 2))
+            batch = create_cutechess_executor_batch(reserved // (2 * batches) * 2 * batches, batches=batches)
+            scheduled[0] += batch.total_games
+            more = run_batch(batch, params, round_crn)
+            # the games stay reserved until those of the point are released
+            if reservation is not None:
+                reservation[0] += reserved
+            else:
+                budget.release(reserved, len(more))
+            if not more:
+                return results
+            results += more
+
+    def submit_point(x, block, games=None, reservation=None):
+        return executor.submit(evaluate_point, point_params(x), crn_block(block), games, reservation)
 
     # paths for experiment output files
     if output_dir:
@@ -150,129 +409,405 @@ def ng4sf(
     all_optimals_file_path = str(Path(output_dir, "all_optimals.json"))
     last_optimal_file_path = str(Path(output_dir, "optimal.json"))
 
-    # Create a dictionary describing to nevergrad the variables of our black box function
-    variables = {}
+    # append-only logs of the evaluations and recommendations, tailed by plots.py
+    evalpoints_log_path = str(Path(output_dir, "evalpoints.jsonl"))
+    optimals_log_path = str(Path(output_dir, "optimals.jsonl"))
+    if not do_restart:
+        for path in [evalpoints_log_path, optimals_log_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def append_log(path, entry):
+        with open(path, "a") as outfile:
+            outfile.write(json.dumps(entry) + "\n")
+    surrogate_file_path = str(Path(output_dir, "surrogate.json"))
+
+    # optionally, a response surface fitted to the games of all points played at the target fidelity
+    if surrogate:
+        surrogate = Surrogate({v: sf_params[v][1:] for v in sf_params if sf_params[v][1] != sf_params[v][2]})
+
+    # optionally, an index of the games played at all points, to pool those of nearby points in the loss
+    spatial_index = None
+    if pool_radius > 0:
+        spatial_index = SpatialIndex({v: sf_params[v][1:] for v in sf_params if sf_params[v][1] != sf_params[v][2]}, pool_radius)
+
+    start_time = datetime.datetime.now()
+
+    # plots are rendered by a separate process, tailing the logs
+    plot_process = None
+    if plot_interval > 0:
+        plots_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plots.py")
+        plot_process = Popen([sys.executable, plots_script, "--output_dir", output_dir or ".", "--interval", str(plot_interval)])
+
+    # optional limits on wall time and games, the batches shrink to fit them
+    budget = Budget(time_budget, games_budget, final_games)
+
+    def reserve_point():
+        """(games reserved, target fidelity games) for the next point, (0, 0) if the budget is used up"""
+        screening_games = sum(fidelity.games for fidelity in screening)
+        reserved = budget.reserve(screening_games + target.games)
+        if reserved - screening_games < 2:
+            budget.release(reserved, 0)
+            return 0, 0
+        return reserved, reserved - screening_games
+
+    # with this executor, we can parallelize over evaluation_concurrency.
+    executor = ThreadPoolExecutor(max_workers=evaluation_concurrency)
+
+    # the loss minimized by the optimizer, a function of the pentanomial of a point
+    point_loss = get_loss(loss, elo0, elo1)
+
+    # initial value and mutation sigma of the parameters, let equal bounds imply fixed not a parameter.
+    start_values = {}
     for v in sf_params:
-        if (
-            sf_params[v][1] != sf_params[v][2]
-        ):  # Let equal bounds imply fixed not a parameter.
+        if sf_params[v][1] != sf_params[v][2]:
+            start_values[v] = (float(sf_params[v][0]), (float(sf_params[v][2]) - float(sf_params[v][1])) / 4)
+
+    # optionally start from what a previous experiment learned
+    previous_experiment = None
+    if warm_start and not do_restart:
+        previous_experiment = load_experiment(warm_start)
+        start_values = warm_start_values(sf_params, previous_experiment)
+        print("Warm start values (init, sigma):")
+        pprint(start_values)
+        print(flush=True)
+
+    # optionally, a short one-at-a-time screening freezes the parameters that barely affect strength
+    sensitivity_file_path = str(Path(output_dir, "sensitivity.json"))
+    sensitivity_games_played = 0
+    frozen = []
+    center = {}
+    if sensitivity_games > 0 and not do_restart:
+        points = design(start_values, sf_params)
+        reserved = budget.reserve(len(points) * sensitivity_games)
+        games = reserved // len(points) // 2 * 2
+        if games >= 2:
+            print(f"Screening the sensitivity of {len(start_values)} parameters at {len(points)} points, {games} games each...", flush=True)
+            sensitivity_crn = crn_block("sensitivity")
+            futures = [
+                executor.submit(run_batch, create_cutechess_executor_batch(games), params, sensitivity_crn)
+                for name, sign, params in points
+            ]
+            results = [future.result() for future in futures]
+            sensitivity_games_played = sum(len(r) for r in results)
+            budget.release(reserved, sensitivity_games_played)
+            sensitivity = effects(points, [pentanomial_results(r) for r in results], freeze_z)
+            frozen = [name for name in sensitivity if sensitivity[name]["frozen"]]
+            center = points[0][2]
+            print("Elo difference with the start values, of each parameter moved by +- sigma:")
+            for name, entry in sensitivity.items():
+                sides = [
+                    f'{entry[side]["elo"]:8.2f} +- {entry[side]["elo_error"]:6.2f}' if side in entry else " " * 18
+                    for side in ["plus", "minus"]
+                ]
+                print(f'   {name:24} {sides[0]}   {sides[1]}   z: {entry["z"]:5.2f}{"   frozen" if entry["frozen"] else ""}')
+            print(f"Freezing {len(frozen)} of {len(start_values)} parameters at their start values")
+            print(flush=True)
+            with open(sensitivity_file_path, "w") as outfile:
+                json.dump({
+                    "games": games,
+                    "threshold": freeze_z,
+                    "center": center,
+                    "effects": sensitivity,
+                    "frozen": frozen
+                }, outfile, indent=2)
+        else:
+            budget.release(reserved, 0)
+            print("No budget left for the sensitivity screening.")
+    elif do_restart and os.path.isfile(sensitivity_file_path):
+        # the start values of a restart are the sf defaults, the frozen parameters keep the screened ones
+        with open(sensitivity_file_path, "r") as infile:
+            sensitivity = json.load(infile)
+        frozen, center = sensitivity["frozen"], sensitivity["center"]
+    elif os.path.exists(sensitivity_file_path):
+        # left by a previous experiment in the same output dir
+        os.remove(sensitivity_file_path)
+
+    # the frozen parameters keep their start values, as the parameters of the blocks not being tuned
+    current = {v: start_values[v][0] for v in start_values}
+    current.update({v: center[v] for v in frozen if v in center})
+    tunable = [v for v in start_values if v not in frozen]
+
+    # the parameters are tuned in blocks, by default a single block of all parameters.
+    # With several blocks, each is tuned for block_evals evaluations, in turn, while
+    # the parameters of the other blocks stay at their current values.
+    blocks = group_params(param_groups, tunable) if param_groups else {"all": tunable}
+    block_names = list(blocks)
+    if len(blocks) == 1:
+        block_evals = nevergrad_evals
+    elif block_evals <= 0:
+        # by default, two rounds over all blocks
+        block_evals = max(1, nevergrad_evals // (2 * len(blocks)))
+    if len(blocks) > 1:
+        print(f"Tuning {len(blocks)} parameter groups in turn, {block_evals} evaluations each:")
+        pprint(blocks)
+        print(flush=True)
+    block = 0
+    block_asked = 0
+    block_told = 0
+    block_history = []
+    blocks_file_path = str(Path(output_dir, "blocks.json"))
+
+    def create_optimizer(names):
+        """the parametrization and optimizer of a block of parameters, starting from their current values"""
+        # Create a dictionary describing to nevergrad the variables of our black box function
+        variables = {}
+        for v in names:
             variables[v] = (
-                ng.p.Scalar(init=float(sf_params[v][0]))
+                ng.p.Scalar(init=float(current[v]))
                 .set_bounds(
                     lower=float(sf_params[v][1]),
                     upper=float(sf_params[v][2]),
                     method="constraint",
                 )
-                .set_mutation(
-                    sigma=(float(sf_params[v][2]) - float(sf_params[v][1])) / 4
-                )
+                .set_mutation(sigma=start_values[v][1])
             )
-
-    # init ng optimizer, restarting as hardcoded
-    instrum = ng.p.Instrumentation(**variables)
-    if not do_restart:
+        instrum = ng.p.Instrumentation(**variables)
         optimizer = ng.optimizers.TBPSA(
             parametrization=instrum,
-            budget=nevergrad_evals,
+            budget=block_evals,
             num_workers=evaluation_concurrency,
         )
+        return instrum, optimizer
+
+    def point_params(x):
+        """the values of all parameters at a point of the current block"""
+        return var2int(**{**current, **x.kwargs})
+
+    # init ng optimizer, restarting as hardcoded
+    if not do_restart:
+        instrum, optimizer = create_optimizer(blocks[block_names[block]])
     else:
         if os.path.isfile(restart_file_path):
             optimizer = ng.optimizers.TBPSA.load(restart_file_path)
+            instrum = optimizer.parametrization
         else:
             sys.exit(f"Missing restart file: {restart_file_path}\n")
+        if len(blocks) > 1:
+            # the optimizer is that of the block being tuned, the others keep their values
+            if not os.path.isfile(blocks_file_path):
+                sys.exit(f"Missing restart file: {blocks_file_path}\n")
+            with open(blocks_file_path, "r") as infile:
+                block_state = json.load(infile)
+            if block_state["groups"] != blocks:
+                sys.exit(f"The parameter groups differ from those in {blocks_file_path}\n")
+            block = block_names.index(block_state["block"])
+            block_asked = block_told = block_state["evals"]
+            block_history = block_state["history"]
+            current.update(block_state["values"])
+            print(f"Restarting the tuning of parameter group {block_names[block]} after {block_told} evaluations")
+            print(flush=True)
 
-    start_time = datetime.datetime.now()
+    # tell the optimizer about the down-weighted observations of the previous experiment
+    if previous_experiment and warm_start_weight > 0:
+        if len(blocks) > 1 or frozen:
+            print("The previous observations are not told when tuning parameter groups in turn, or with frozen parameters")
+        else:
+            observations = prior_observations(
+                sf_params, previous_experiment, warm_start_weight, loss=point_loss, fidelity=[target.tc, target.tcRef]
+            )
+            for params, observed_loss in observations:
+                optimizer.tell(instrum.spawn_child(new_value=((), params)), observed_loss)
+            print(f"Told {len(observations)} previous observations with weight {warm_start_weight}")
+        print(flush=True)
 
-    # with this executor, we can parallelize over evaluation_concurrency.
-    executor = ThreadPoolExecutor(max_workers=evaluation_concurrency)
-    evalpoints = []
-    evalpoints_submitted = 0
-    evalpoints_running = 0
-    for i in range(evaluation_concurrency):
-        x = optimizer.ask()
-        print(f'optimizer.ask() got params. running batch...')
-        evalpoints.append([x, executor.submit(batch.run, var2int(*x.args, **x.kwargs))])
-        time.sleep(0.1)  # try to give some time to submit all batches of this point
-        evalpoints_submitted = evalpoints_submitted + 1
-        evalpoints_running = evalpoints_running + 1
+    def dump_state():
+        """make a backup of the old restart and dump current state"""
+        if os.path.exists(restart_file_path):
+            shutil.move(restart_file_path, f"{restart_file_path}.bak")
+        optimizer.dump(restart_file_path)
+        if len(blocks) > 1:
+            with open(blocks_file_path, "w") as outfile:
+                json.dump({
+                    "groups": blocks,
+                    "block": block_names[block],
+                    "evals": block_told,
+                    "values": current,
+                    "history": block_history
+                }, outfile, indent=2)
+
+    def ask_point():
+        """ask the optimizer for a point of the current block"""
+        nonlocal block_asked
+        block_asked += 1
+        return optimizer.ask()
+
+    def next_block():
+        """continue with the next block, from the recommendation of the current one"""
+        nonlocal block, block_asked, block_told, instrum, optimizer
+        block_history.append({
+            "group": block_names[block],
+            "evals_done": evals_done,
+            "total_games": total_games_played,
+            "recommendation": {v: recommendation[v] for v in blocks[block_names[block]]}
+        })
+        current.update(recommendation)
+        block = (block + 1) % len(blocks)
+        block_asked = block_told = 0
+        instrum, optimizer = create_optimizer(blocks[block_names[block]])
+        print(f"------- tuning parameter group {block_names[block]} ({len(blocks[block_names[block]])} parameters) after {evals_done} evaluations")
+        print(flush=True)
+        dump_state()
 
     ng_iter = 0
+    evals_done = 0
     eval_of_last_ng_iter = 0
     previous_recommendation = None
-    total_games_played = 0
+    recommendation = None
+    total_games_played = sensitivity_games_played
     all_optimals = []
     all_evalpoints = []
-    games_accumulator = {}
+    worst_target_loss = None
+    pending_stats = []
 
-    # optimizer loop
-    while evalpoints_running > 0:
+    def accumulate(params, fidelity, wld_game_results):
+        """accumulate games from the same point and fidelity so SPRT LLR can give better data"""
+        combined_game_results = wld_game_results.copy()
+        if cache:
+            # the cache holds all games ever played at this point, including the new ones
+            return pairs_to_sequence(cache.add(cache_key(params, fidelity), wld_game_results))
+        key = accumulator_key(params, fidelity)
+        if games_accumulator.get(key):
+            prev_game_results = games_accumulator[key]
+            print(f'Found previous evaluation of same point. Adding {len(prev_game_results)} game results')
+            combined_game_results.extend(prev_game_results)
+        games_accumulator[key] = combined_game_results.copy()
+        return combined_game_results
 
-        # find the point which is ready
-        ready_batch = -1
-        while ready_batch == -1:
-            time.sleep(0.1)
-            for i in range(evaluation_concurrency):
-                if evalpoints[i][1].done():
-                    ready_batch = i
-                    evalpoints_running = evalpoints_running - 1
-                    break
-
-        # use this point to inform the optimizer.
-        x = evalpoints[ready_batch][0]
-        wld_game_results = evalpoints[ready_batch][1].result()
-        num_games_played = len(wld_game_results)
+    def report_stats(wait_all=False):
+        """print the statistics of the evaluations that are ready, and export them to json"""
+        ready = []
+        for pending in list(pending_stats):
+            if wait_all or pending[2].done():
+                pending_stats.remove(pending)
+                ready.append(pending)
+        if not ready:
+            return
+
+        for evaluation, record, stats_future in ready:
+            stats = stats_future.result()
+            record['stats'] = stats
+            a = stats["fishtest_stats"]
+            print(f"statistics of evaluation {evaluation}:")
+            print(f'   score                 : {stats["score"] * 100:8.3f} +- {stats["score_error"] * 100:8.3f}')
+            print(f'   elo                   : {stats["Elo"]:8.3f} +- {stats["Elo_error"]:8.3f}')
+            print(f'   ldw                   :   {str(stats["ldw"]):24}   {stats["ldw_los"]:4.2f}% LOS')
+            print(f'   pentanomial           :   {str(stats["pentanomial"]):24}   {stats["pentanomial_los"]:4.2f}% LOS')
+            print(f'   LLR [-2.94, 2.94]     : {a["LLR"]:7.2f}                      {a["LOS"]:4.2%} LOS')
+            # print("   Elo                   :   {:.2f}".format(a["elo"]))
+            # print("   Confidence interval   :   [{:.2f},{:.2f}] (95%)".format(a["ci"][0], a["ci"][1]))
+
+        # export data to json files, evaluations still waiting for their statistics are not included
+        with open(all_evalpoints_file_path, "w") as outfile:
+            json.dump([record for record in all_evalpoints if record['stats'] is not None], outfile, indent=2)
+
+    def rescaled_loss(pentanomial, games):
+        """the loss of a pentanomial as if measured with games, as the LLR losses grow with the games"""
+        pairs = sum(pentanomial)
+        scale = games / (2 * pairs) if pairs else 1.0
+        return point_loss([n * scale for n in pentanomial])
+
+    def tell_point(x, played, worker, games=None):
+        """use the games played at a point to inform the optimizer, report and export results
+
+        played is a list of (fidelity, results), the loss is computed at the last fidelity.
+        With games, a point with fewer games at the target fidelity (e.g. dropped in a race)
+        is told the loss as if measured with games, to compare it with the points that got them.
+        """
+        nonlocal ng_iter, evals_done, eval_of_last_ng_iter, previous_recommendation, recommendation
+        nonlocal total_games_played, games_per_batch, block_told, worst_target_loss
+
+        num_games_played = sum(len(results) for fidelity, results in played)
         total_games_played += num_games_played
+        evals_done += 1
 
-        params_evaluated = var2int(**x.kwargs)
+        params_evaluated = point_params(x)
         params_evaluated = {key: params_evaluated[key] for key in sorted(params_evaluated)}
-        params_evaluated_key = str(params_evaluated)
 
-        # accumulate games from the same point so SPRT LLR can give better data
-        combined_game_results = wld_game_results.copy()
-        if games_accumulator.get(params_evaluated_key):
-            prev_game_results = games_accumulator[params_evaluated_key]
-            print(f'Found previous evaluation of same point. Adding {len(prev_game_results)} game results')
-            combined_game_results.extend(prev_game_results)
-        games_accumulator[params_evaluated_key] = combined_game_results.copy()
+        # screening games are only accumulated, the loss comes from the last fidelity played
+        for fidelity, wld_game_results in played:
+            combined_game_results = accumulate(params_evaluated, fidelity, wld_game_results)
+            if surrogate and fidelity is target:
+                surrogate.add(params_evaluated, pentanomial_results(wld_game_results))
+            if spatial_index is not None and fidelity is target and wld_game_results:
+                spatial_index.add(params_evaluated, pentanomial_results(wld_game_results))
 
-        stats = calc_stats(combined_game_results)
-        # loss = (100 - stats["pentanomial_los"]) / 100.0
-        loss = -stats["fishtest_stats"]["LLR"]              # maximize SPRT LLR measured from pentanomial results
+        # only the loss is needed by the optimizer, the other statistics are computed in the background
+        pentanomial = pentanomial_results(combined_game_results)
+        if spatial_index is not None and fidelity is target:
+            # games of nearby points count with a weight decreasing with their distance
+            pentanomial = spatial_index.pooled(params_evaluated, pool_radius, pentanomial)
+        llr = sprt_llr(pentanomial)
+        if fidelity is target:
+            if games and 2 * sum(pentanomial) < games:
+                loss = rescaled_loss(pentanomial, games)
+            else:
+                loss = point_loss(pentanomial)
+            worst_target_loss = loss if worst_target_loss is None else max(worst_target_loss, loss)
+        else:
+            # a point that failed screening is told a loss on the scale of the target fidelity,
+            # and no better than that of any point evaluated at the target fidelity
+            loss = rescaled_loss(pentanomial, target.games)
+            if worst_target_loss is not None:
+                loss = max(loss, worst_target_loss)
         optimizer.tell(x, loss)
 
         current_time = datetime.datetime.now()
         used_time = current_time - start_time
-        evals_done = evalpoints_submitted - evalpoints_running
-        a = stats["fishtest_stats"]
 
-        print(f"evaluation: {evals_done} of {nevergrad_evals} (worker {ready_batch+1} of {evaluation_concurrency}, games played: {num_games_played}) ng iter: {ng_iter}, total: {total_games_played} games in {used_time.total_seconds():.3f}s, games/s: {total_games_played / used_time.total_seconds():.3f}")
+        print(f"evaluation: {evals_done} of {nevergrad_evals} (worker {worker+1} of {evaluation_concurrency}, games played: {num_games_played}) ng iter: {ng_iter}, total: {total_games_played} games in {used_time.total_seconds():.3f}s, games/s: {total_games_played / used_time.total_seconds():.3f}")
         print(params_evaluated)
+        print(f'   fidelity              :   {"target" if fidelity is target else "screening"} {fidelity}')
         print(f'   games considered      :   {len(combined_game_results)}')
-        print(f'   score                 : {stats["score"] * 100:8.3f} +- {stats["score_error"] * 100:8.3f}')
-        print(f'   elo                   : {stats["Elo"]:8.3f} +- {stats["Elo_error"]:8.3f}')
-        print(f'   ldw                   :   {str(stats["ldw"]):24}   {stats["ldw_los"]:4.2f}% LOS')
-        print(f'   pentanomial           :   {str(stats["pentanomial"]):24}   {stats["pentanomial_los"]:4.2f}% LOS')
-        print(f'   LLR [-2.94, 2.94]     : {a["LLR"]:7.2f}                      {a["LOS"]:4.2%} LOS')
-        # print("   Elo                   :   {:.2f}".format(a["elo"]))
-        # print("   Confidence interval   :   [{:.2f},{:.2f}] (95%)".format(a["ci"][0], a["ci"][1]))
+        if target_se > 0 and fidelity is target:
+            print(f'   {precision_metric + " error":22}: {point_error(pentanomial_results(combined_game_results), precision_metric, elo0, elo1):11.6f}')
+        if spatial_index is not None and fidelity is target:
+            print(f'   pooled pentanomial    :   {[round(n, 1) for n in pentanomial]}')
+        elo, elo_variance = pentanomial_elo(pentanomial) if sum(pentanomial) > 0 else (0.0, 0.0)
+        print(f'   LLR [-2.94, 2.94]     : {llr:7.2f}')
         print(f"   loss                  : {loss:11.6f}")
+        if load_balance:
+            print(f"   host weights          :   {host_speeds}")
+        if budget:
+            print(f"   budget                :   {budget}")
+        if surrogate and surrogate.observations:
+            surrogate_state = surrogate.export()
+            print(f'   surrogate optimum     : {surrogate_state["elo"]:8.3f} +- {surrogate_state["elo_error"]:8.3f}   {surrogate_state["recommendation"]}')
+            with open(surrogate_file_path, "w") as outfile:
+                json.dump(surrogate_state, outfile, indent=2)
 
-        # make a backup of the old restart and dump current state
-        if os.path.exists(restart_file_path):
-            shutil.move(restart_file_path, f"{restart_file_path}.bak")
-        optimizer.dump(restart_file_path)
+        block_told += 1
+        dump_state()
 
-        # export data to json files after each evaluation
-        all_evalpoints.append({
-            'params': x.kwargs,
-            'num_games': num_games_played,
-            'stats': stats
+        append_log(evalpoints_log_path, {
+            "evaluation": evals_done,
+            "time": used_time.total_seconds(),
+            "games": num_games_played,
+            "total_games": total_games_played,
+            "llr": llr,
+            "elo": elo,
+            "elo_error": 1.96 * math.sqrt(elo_variance),
+            "params": params_evaluated,
+            "utilization": host_speeds.utilization(),
         })
-        with open(all_evalpoints_file_path, "w") as outfile:
-            json.dump(all_evalpoints, outfile, indent=2)
 
-        recommendation = var2int(**optimizer.provide_recommendation().kwargs)
+        # the evaluation is exported once its statistics are ready
+        record = {
+            'params': {**current, **x.kwargs},
+            'num_games': num_games_played,
+            'fidelity': [fidelity.tc, fidelity.tcRef],
+            'stats': None
+        }
+        all_evalpoints.append(record)
+        if stats_executor:
+            stats_future = stats_executor.submit(calc_stats, combined_game_results)
+        else:
+            stats_future = Future()
+            stats_future.set_result(calc_stats(combined_game_results))
+        pending_stats.append((evals_done, record, stats_future))
+        report_stats()
+
+        recommendation = var2int(**{**current, **optimizer.provide_recommendation().kwargs})
         if recommendation != previous_recommendation:
             ng_iter = ng_iter + 1
             eval_str = "evaluation" if evals_done == 1 else "evaluations"
@@ -289,35 +824,181 @@ def ng4sf(
                 "recommendation": recommendation
             })
             with open(all_optimals_file_path, "w") as outfile:
-                json.dump(all_optimals_file_path, outfile, indent=2)
+                json.dump(all_optimals, outfile, indent=2)
             with open(last_optimal_file_path, "w") as outfile:
                 json.dump(recommendation, outfile, indent=2)
+            append_log(optimals_log_path, {
+                "evaluation": evals_done,
+                "time": used_time.total_seconds(),
+                "total_games": total_games_played,
+                "recommendation": recommendation,
+            })
 
             # increase the games per batch after each iteration beyond the first
             if ng_iter > 1 and batch_increase_per_iter > 0:
                 games_per_batch += batch_increase_per_iter
+                target.games = games_per_batch
                 print(f'Increasing games per batch by {batch_increase_per_iter} to: {games_per_batch}')
-                batch = create_cutechess_executor_batch(games_per_batch)
 
             print('-------')
 
-        # queue the next point for evaluation.
-        if evalpoints_submitted < nevergrad_evals:
-            x = optimizer.ask()
-            evalpoints[ready_batch] = [
-                x,
-                executor.submit(batch.run, var2int(*x.args, **x.kwargs)),
-            ]
-            evalpoints_submitted = evalpoints_submitted + 1
-            evalpoints_running = evalpoints_running + 1
-
         print(flush=True)
         previous_recommendation = recommendation
 
+        # all points of the block are told, the next block continues from its recommendation
+        if len(blocks) > 1 and block_told >= block_evals and evals_done < nevergrad_evals:
+            next_block()
+
+    if racing:
+        # racing: ask a group of points, only keep playing the ones that can still win
+        def play(params, games, games_played):
+            crn = crn_block(evalpoints_submitted, games_played)
+            # play_games only subtracts the cached games, the race already counts the accumulated ones
+            cached_games = len(previous_results(params, target)) if cache else 0
+            return executor.submit(play_games, params, cached_games + games_played + games, target, crn, games_played)
+
+        evalpoints_submitted = 0
+        while evalpoints_submitted < nevergrad_evals:
+            points = min(evaluation_concurrency, nevergrad_evals - evalpoints_submitted, block_evals - block_asked)
+            reserved = budget.reserve(points * games_per_batch)
+            if not reserved:
+                break
+            race_max_games = reserved // points // 2 * 2
+            xs = []
+            for i in range(points):
+                xs.append(ask_point())
+            evalpoints_submitted += len(xs)
+            print(f'optimizer.ask() got {len(xs)} points. racing with up to {race_max_games} games each...')
+            candidates = [point_params(x) for x in xs]
+            race_results = race(
+                candidates,
+                play,
+                min(race_min_games, race_max_games),
+                race_max_games,
+                [previous_results(params, target) for params in candidates],
+            )
+            budget.release(reserved, sum(len(results) for results in race_results))
+            # dropped candidates are told their loss on the scale of the games of the survivors
+            race_games = max(len(previous_results(params, target)) + len(results)
+                             for params, results in zip(candidates, race_results))
+            for i, x in enumerate(xs):
+                tell_point(x, [(target, race_results[i])], i, race_games)
+
+    elif multi_candidate:
+        # a group of points is evaluated by single cutechess processes, each point being a separate engine
+        evalpoints_submitted = 0
+        while evalpoints_submitted < nevergrad_evals:
+            points = min(evaluation_concurrency, nevergrad_evals - evalpoints_submitted, block_evals - block_asked)
+            reserved = budget.reserve(points * games_per_batch)
+            if not reserved:
+                break
+            xs = []
+            for i in range(points):
+                xs.append(ask_point())
+            evalpoints_submitted += len(xs)
+            print(f'optimizer.ask() got {len(xs)} points. running multi-candidate batch...')
+            multi_batch = create_cutechess_executor_batch(reserved // points, batches=workers)
+            multi_results = multi_batch.run_multi(
+                [point_params(x) for x in xs], crn_block(evalpoints_submitted)
+            )
+            if telemetry:
+                print(f"telemetry of the multi-candidate batch: {report(multi_batch.summary)}")
+            budget.release(reserved, sum(len(results) for results in multi_results))
+            for i, x in enumerate(xs):
+                tell_point(x, [(target, multi_results[i])], i)
+
+    else:
+        evalpoints = [None] * evaluation_concurrency
+        evalpoints_submitted = 0
+        evalpoints_running = 0
+
+        def fill_slots():
+            """queue points for evaluation in the free slots, while the budget and the current block allow"""
+            nonlocal evalpoints_submitted, evalpoints_running
+            for i in range(evaluation_concurrency):
+                if evalpoints[i] or evalpoints_submitted >= nevergrad_evals or block_asked >= block_evals:
+                    continue
+                reserved, games = reserve_point()
+                if not reserved:
+                    return
+                x = ask_point()
+                print(f'optimizer.ask() got params. running batch...')
+                reservation = [reserved]
+                evalpoints[i] = [x, submit_point(x, evalpoints_submitted // evaluation_concurrency, games, reservation), reservation]
+                time.sleep(0.1)  # try to give some time to submit all batches of this point
+                evalpoints_submitted = evalpoints_submitted + 1
+                evalpoints_running = evalpoints_running + 1
+
+        fill_slots()
+
+        # optimizer loop
+        while evalpoints_running > 0:
+
+            # find the point which is ready
+            ready_batch = -1
+            while ready_batch == -1:
+                time.sleep(0.1)
+                report_stats()
+                for i in range(evaluation_concurrency):
+                    if evalpoints[i] and evalpoints[i][1].done():
+                        ready_batch = i
+                        evalpoints_running = evalpoints_running - 1
+                        break
+
+            # use this point to inform the optimizer.
+            x, future, reservation = evalpoints[ready_batch]
+            evalpoints[ready_batch] = None
+            played = future.result()
+            budget.release(reservation[0], sum(len(results) for fidelity, results in played))
+            tell_point(x, played, ready_batch)
+
+            # queue the next points for evaluation, after the last point of a block all slots are free.
+            fill_slots()
+
+    # with a budget, the games left evaluate the final recommendation on fresh openings
+    if budget and recommendation:
+        final_games = budget.final_evaluation_games()
+        if final_games >= 2:
+            print(f"Evaluating the final recommendation with {final_games} games...", flush=True)
+            final_results = create_cutechess_executor_batch(final_games).run(recommendation)
+            budget.release(0, len(final_results))
+            final_stats = calc_stats(final_results)
+            print(f'   elo                   : {final_stats["Elo"]:8.3f} +- {final_stats["Elo_error"]:8.3f}')
+            print(f'   pentanomial           :   {str(final_stats["pentanomial"]):24}   {final_stats["pentanomial_los"]:4.2f}% LOS')
+            print(f"   budget                :   {budget}")
+            with open(str(Path(output_dir, "final_evaluation.json")), "w") as outfile:
+                json.dump({
+                    "recommendation": recommendation,
+                    "num_games": len(final_results),
+                    "fidelity": [target.tc, target.tcRef],
+                    "stats": final_stats
+                }, outfile, indent=2)
+        else:
+            print("No budget left to evaluate the final recommendation.")
+
+    report_stats(wait_all=True)
+    if stats_executor:
+        stats_executor.shutdown()
+    worker_executor.shutdown()
+    if plot_process:
+        plot_process.send_signal(signal.SIGTERM)
+        plot_process.wait()
+
+    if len(blocks) > 1 and recommendation:
+        # the combined recommendation, the blocks not being tuned at the end keep their last values
+        with open(last_optimal_file_path, "w") as outfile:
+            json.dump(recommendation, outfile, indent=2)
+        print("Recommendations of the parameter groups:")
+        for entry in block_history:
+            print(f"   {entry['group']:20} after {entry['evals_done']} evaluations and {entry['total_games']} games : {entry['recommendation']}")
+
     print("Parameter optimization inputs:")
     print(sf_params)
     print(f"Optimization finished with optimal parameters (ng iteration: {ng_iter}) :")
     pprint(recommendation)
+    if surrogate and surrogate.observations:
+        print(f"Surrogate model optimum over {surrogate.observations} observations ({surrogate.games} games) :")
+        pprint(surrogate.recommendation()[0])
 
 
 if __name__ == "__main__":
@@ -333,9 +1014,18 @@ if __name__ == "__main__":
             """\
                   Use nevergrad to optimize tunable stockfish parameters.
 
-                  This program requires mpi to run. A typical invocation could be:
+                  With mpi, a typical invocation could be:
                      mpirun -np 3 python3 -m mpi4py.futures nevergrad4sf.py -tc 1.0+0.01 -g 2 -cc 2 -ec 3 --ng 10
 
+                  Alternatively, with workers connecting over tcp (see tcp_executor.py):
+                     python3 nevergrad4sf.py --backend tcp --listen 5555 -tc 1.0+0.01 -g 2 -cc 2 -ec 3 --ng 10
+
+                  Or, on a single host, without mpi:
+                     python3 nevergrad4sf.py --backend local --local_workers 2 -tc 1.0+0.01 -g 2 -cc 2 -ec 3 --ng 10
+
+                  Or, sharing the workers of a scheduler with other experiments (see scheduler.py):
+                     python3 nevergrad4sf.py --backend scheduler --scheduler host:5556 --experiment name -tc 1.0+0.01 -g 2 -cc 2 -ec 3 --ng 10
+
                   More documentation at:
                      https://github.com/vondele/nevergrad4sf/blob/master/README.md
 
@@ -420,7 +1110,238 @@ if __name__ == "__main__":
     parser.add_argument(
         "--restart", action="store_true", help="Restart a previous optimization"
     )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default="",
+        help="Directory of a persistent game result cache, shared across runs (disabled if empty)",
+    )
+    parser.add_argument(
+        "--cache_max_mb",
+        type=int,
+        default=256,
+        help="Maximum size of the game result cache in MB, least recently used entries are evicted",
+    )
+    parser.add_argument(
+        "--warm_start",
+        type=str,
+        default="",
+        help="Output dir (or optimal.json) of a previous experiment, used to set initial values and mutation sigmas",
+    )
+    parser.add_argument(
+        "--warm_start_weight",
+        type=float,
+        default=0.0,
+        help="Weight of the games of the previous experiment when telling them to the optimizer (0 to not tell)",
+    )
+    # racing and multi-candidate batches are different ways of evaluating a group of points
+    group_evaluation = parser.add_mutually_exclusive_group()
+    group_evaluation.add_argument(
+        "--racing",
+        action="store_true",
+        help="Race groups of evaluation_concurrency points, only giving more games to those that can still win",
+    )
+    parser.add_argument(
+        "--race_min_games",
+        type=int,
+        default=32,
+        help="Number of games each candidate gets in the first round of a race",
+    )
+    parser.add_argument(
+        "--fidelity",
+        type=parse_fidelity,
+        action="append",
+        default=[],
+        help="Screening fidelity GAMES:TC[:TCREF], e.g. '64:10000+10000 nodes=500', can be repeated from cheap to expensive. "
+        "Points are only evaluated at the next fidelity, and finally at --tc, if their LLR reaches --promote_llr",
+    )
+    parser.add_argument(
+        "--promote_llr",
+        type=float,
+        default=0.0,
+        help="LLR a point needs at a screening fidelity to be evaluated at the next fidelity",
+    )
+    group_evaluation.add_argument(
+        "--multi_candidate",
+        action="store_true",
+        help="Evaluate groups of evaluation_concurrency points together, as separate engines of the same cutechess processes",
+    )
+    parser.add_argument(
+        "--book_slices",
+        action="store_true",
+        help="Index the book once and give each cutechess worker a disjoint slice of its openings",
+    )
+    parser.add_argument(
+        "--crn",
+        action="store_true",
+        help="Common random numbers: points evaluated together play the same openings with the same seeds (implies --book_slices)",
+    )
+    parser.add_argument(
+        "--hash",
+        type=int,
+        default=16,
+        help="Hash size in MB of the engines",
+    )
+    parser.add_argument(
+        "--mpi_subbatches",
+        type=int,
+        default=0,
+        help="Number of cutechess processes the games of a point are split over, 0 for 2 * workers / evaluation_concurrency",
+    )
+    parser.add_argument(
+        "--load_balance",
+        action="store_true",
+        help="Split the batches of games in smaller ones that faster hosts take more of, reporting the speed of the hosts",
+    )
+    parser.add_argument(
+        "--affinity",
+        action="store_true",
+        help="Pin each rank and each of its game slots to dedicated cpus, NUMA aware",
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default="",
+        help="Throughput settings written by calibrate.py, used as defaults for the corresponding arguments",
+    )
+    parser.add_argument(
+        "--stats_workers",
+        type=int,
+        default=1,
+        help="Number of background processes computing the reporting statistics, 0 to compute them inline",
+    )
+    parser.add_argument(
+        "--time_budget",
+        type=float,
+        default=0.0,
+        help="Wall time budget of the optimization in minutes, 0 for none. Batches shrink to finish in time",
+    )
+    parser.add_argument(
+        "--games_budget",
+        type=int,
+        default=0,
+        help="Total number of games the optimization may play, 0 for no limit",
+    )
+    parser.add_argument(
+        "--final_games",
+        type=int,
+        default=1024,
+        help="With a budget, games kept for evaluating the final recommendation, which gets all games left. At most a quarter of a games budget",
+    )
+    parser.add_argument(
+        "--surrogate",
+        action="store_true",
+        help="Fit a quadratic response surface to all points, reporting its optimum and suggested points in surrogate.json",
+    )
+    parser.add_argument(
+        "--pool_radius",
+        type=float,
+        default=0.0,
+        help="Pool the games of points within this distance (parameters scaled to [-1, 1]) in the loss, 0 to disable",
+    )
+    parser.add_argument(
+        "--draw",
+        type=str,
+        default="movenumber=50 movecount=8 score=5",
+        help="cutechess -draw adjudication settings",
+    )
+    parser.add_argument(
+        "--resign",
+        type=str,
+        default="movecount=3 score=600",
+        help="cutechess -resign adjudication settings",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store_true",
+        help="Record per-game telemetry (plies, termination, engine time) from the PGN of the games, written to telemetry.json",
+    )
+    parser.add_argument(
+        "--plot_interval",
+        type=float,
+        default=0.0,
+        help="Seconds between refreshes of the convergence plots (PNGs in the output dir), 0 to not plot",
+    )
+    parser.add_argument(
+        "--param_groups",
+        type=str,
+        default="",
+        help="Tune groups of parameters in turn: 'prefix' to group by the first word of their names, or a json file or string of {group: [names]}",
+    )
+    parser.add_argument(
+        "--block_evals",
+        type=int,
+        default=0,
+        help="Evaluations per turn of a parameter group, 0 for two rounds over all groups within --ng_evals",
+    )
+    parser.add_argument(
+        "--sensitivity_games",
+        type=int,
+        default=0,
+        help="Games per point of a sensitivity screening before tuning, moving each parameter by +- sigma (0 to not screen)",
+    )
+    parser.add_argument(
+        "--freeze_z",
+        type=float,
+        default=1.0,
+        help="Parameters whose effect in the sensitivity screening is below this many standard errors are frozen",
+    )
+    parser.add_argument(
+        "--loss",
+        choices=list(LOSSES),
+        default="sprt",
+        help="Loss minimized by the optimizer, computed from the pentanomial of a point (compare them with losses.py)",
+    )
+    parser.add_argument(
+        "--elo0",
+        type=float,
+        default=0.0,
+        help="Lower Elo bound of the LLR losses (logistic Elo for llr_logistic, normalized Elo otherwise)",
+    )
+    parser.add_argument(
+        "--elo1",
+        type=float,
+        default=2.0,
+        help="Upper Elo bound of the LLR losses",
+    )
+    parser.add_argument(
+        "--target_se",
+        type=float,
+        default=0.0,
+        help="Play games at a point until the standard error of its estimate is below this (0 for -g games per point)",
+    )
+    parser.add_argument(
+        "--precision_metric",
+        choices=METRICS,
+        default="logistic_elo",
+        help="Estimate whose error is targeted: logistic_elo (error in logistic Elo, not the normalized Elo of"
+        " the SPRT bounds), or llr (error relative to the LLR)",
+    )
+    parser.add_argument(
+        "--min_games",
+        type=int,
+        default=0,
+        help="Least number of games of a point with --target_se",
+    )
+    parser.add_argument(
+        "--max_games",
+        type=int,
+        default=0,
+        help="Most games of a point with --target_se, 0 for 8 times the games per batch",
+    )
+    add_backend_arguments(parser)
+    config = load_throughput_config(parser)
     args = parser.parse_args()
+    # racing decides on the games of the target fidelity alone, and stops on its own confidence bounds
+    if args.racing and (args.fidelity or args.target_se > 0):
+        parser.error("--racing can not be combined with --fidelity or --target_se")
+    # the points of a multi-candidate batch share the games of the same cutechess processes
+    if args.multi_candidate and (args.fidelity or args.target_se > 0):
+        parser.error("--multi_candidate can not be combined with --fidelity or --target_se")
+
+    # the calibrated cutechess processes are shared by the points evaluated concurrently
+    if args.mpi_subbatches <= 0 and "cutechess_processes" in config:
+        args.mpi_subbatches = max(1, config["cutechess_processes"] // args.evaluation_concurrency)
 
     ng4sf(
         args.stockfish,
@@ -436,4 +1357,48 @@ if __name__ == "__main__":
         args.cutechess_concurrency,
         args.evaluation_concurrency,
         args.output_dir,
+        cache_dir=args.cache_dir,
+        cache_max_mb=args.cache_max_mb,
+        warm_start=args.warm_start,
+        warm_start_weight=args.warm_start_weight,
+        racing=args.racing,
+        race_min_games=args.race_min_games,
+        screening=args.fidelity,
+        promote_llr=args.promote_llr,
+        multi_candidate=args.multi_candidate,
+        book_slices=args.book_slices,
+        crn=args.crn,
+        hash=args.hash,
+        mpi_subbatches=args.mpi_subbatches,
+        load_balance=args.load_balance,
+        affinity=args.affinity,
+        stats_workers=args.stats_workers,
+        time_budget=60 * args.time_budget,
+        games_budget=args.games_budget,
+        final_games=args.final_games,
+        surrogate=args.surrogate,
+        pool_radius=args.pool_radius,
+        backend=args.backend,
+        listen=args.listen,
+        authkey=args.authkey,
+        min_workers=args.min_workers,
+        local_workers=args.local_workers,
+        draw=args.draw,
+        resign=args.resign,
+        telemetry=args.telemetry,
+        plot_interval=args.plot_interval,
+        param_groups=args.param_groups,
+        block_evals=args.block_evals,
+        sensitivity_games=args.sensitivity_games,
+        freeze_z=args.freeze_z,
+        loss=args.loss,
+        elo0=args.elo0,
+        elo1=args.elo1,
+        scheduler=args.scheduler,
+        experiment=args.experiment,
+        weight=args.weight,
+        target_se=args.target_se,
+        min_games=args.min_games,
+        max_games=args.max_games,
+        precision_metric=args.precision_metric,
     )
@@ -0,0 +1,127 @@
+"""
+Indexed, memory-mapped opening books.
+
+The byte offsets of the openings of an epd or pgn book are computed once and
+stored next to the book (or in the temp dir if that is not writable). Both the
+book and the index are memory-mapped, so that a slice of openings can be written
+to a small temporary book without reading the full book.
+
+The master hands out disjoint slices of the book to the sub-batches, which play
+them in order, so that no two ranks play the same opening by chance.
+"""
+
+import os
+import mmap
+import random
+import tempfile
+import threading
+from array import array
+
+# header of the index file: book size and modification time, used to detect stale indices
+HEADER = 2
+
+_books = {}
+
+
+def get_book(path):
+    """The OpeningBook for path, opened only once per process"""
+    if path not in _books:
+        _books[path] = OpeningBook(path)
+    return _books[path]
+
+
+class OpeningBook:
+    def __init__(self, path):
+        self.path = path
+        self.extension = "pgn" if path.endswith("pgn") else "epd"
+        with open(path, "rb") as infile:
+            self.data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = self.load_index()
+        self.cursor = random.SystemRandom().randrange(len(self))
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def index_paths(self):
+        name = os.path.basename(self.path) + ".idx"
+        yield self.path + ".idx"
+        yield os.path.join(tempfile.gettempdir(), name)
+
+    def load_index(self):
+        """Memory-map the index, building it first if missing or stale"""
+        st = os.stat(self.path)
+        header = [st.st_size, st.st_mtime_ns]
+        for index_path in self.index_paths():
+            try:
+                with open(index_path, "rb") as infile:
+                    index = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):
+                continue
+            offsets = memoryview(index).cast("Q")
+            if list(offsets[:HEADER]) == header:
+                return offsets[HEADER:]
+
+        offsets = array("Q", header + self.build_index())
+        for index_path in self.index_paths():
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(index_path)))
+            except OSError:
+                continue
+            with os.fdopen(fd, "wb") as outfile:
+                offsets.tofile(outfile)
+            os.replace(tmp_path, index_path)
+            break
+        return memoryview(offsets)[HEADER:]
+
+    def build_index(self):
+        """Byte offsets of the start of each opening, followed by the end of the last one"""
+        offsets = []
+        position = 0
+        in_headers = False
+        size = len(self.data)
+        while position < size:
+            end = self.data.find(b"\n", position)
+            end = size if end == -1 else end + 1
+            line = self.data[position:end].strip()
+            if self.extension == "epd":
+                if line:
+                    offsets.append(position)
+            elif line.startswith(b"["):
+                # the first tag pair after movetext starts a new game
+                if not in_headers:
+                    offsets.append(position)
+                in_headers = True
+            elif line:
+                in_headers = False
+            position = end
+        if not offsets:
+            raise ValueError("no openings found in book: %s" % self.path)
+        offsets.append(size)
+        return offsets
+
+    def take(self, count):
+        """Reserve the next count openings, returning the index of the first one"""
+        with self.lock:
+            start = self.cursor
+            self.cursor = (self.cursor + count) % len(self)
+        return start
+
+    def opening(self, i):
+        i = i % len(self)
+        text = self.data[self.offsets[i]:self.offsets[i + 1]]
+        return text if text.endswith(b"\n") else text + b"\n"
+
+    def write_slice(self, start, count, repeat=1):
+        """Write openings start .. start + count - 1 (wrapping around) to a temporary book
+
+        Each opening is written repeat times in a row.
+        """
+        fd, slice_path = tempfile.mkstemp(suffix="." + self.extension)
+        with os.fdopen(fd, "wb") as outfile:
+            for i in range(start, start + count):
+                for _ in range(repeat):
+                    outfile.write(self.opening(i))
+                    if self.extension == "pgn":
+                        outfile.write(b"\n")
+        return slice_path
@@ -0,0 +1,200 @@
+"""
+Convergence plots of a running (or finished) optimization.
+
+nevergrad4sf.py appends a line per evaluation to evalpoints.jsonl and a line per
+new recommendation to optimals.jsonl in its output dir. This program tails both
+files, only reading the lines added since the previous refresh, and periodically
+renders PNGs next to them:
+
+   convergence.png  LLR and Elo (with error bars) per evaluation
+   parameters.png   trajectories of the recommended parameters
+   throughput.png   games/s over time, and the cpu utilization per rank
+
+With --plot_interval, nevergrad4sf.py runs this program as a separate process,
+so plotting never blocks the optimization.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import textwrap
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+
+class LogTail:
+    """The records appended to a json lines file since the previous read"""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.partial = ""
+
+    def read(self):
+        try:
+            with open(self.path, "r") as infile:
+                if os.fstat(infile.fileno()).st_size < self.offset:
+                    # the file was started anew
+                    self.offset, self.partial = 0, ""
+                infile.seek(self.offset)
+                data = infile.read()
+                self.offset = infile.tell()
+        except FileNotFoundError:
+            return []
+        lines = (self.partial + data).split("\n")
+        # the last line may still be being written
+        self.partial = lines.pop()
+        return [json.loads(line) for line in lines if line.strip()]
+
+
+class Plotter:
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.evalpoints = LogTail(os.path.join(output_dir, "evalpoints.jsonl"))
+        self.optimals = LogTail(os.path.join(output_dir, "optimals.jsonl"))
+        self.evaluations = []
+        self.recommendations = []
+
+    def update(self):
+        """Read the new records, returns True if there are any"""
+        new_evaluations = self.evalpoints.read()
+        new_recommendations = self.optimals.read()
+        self.evaluations += new_evaluations
+        self.recommendations += new_recommendations
+        return bool(new_evaluations or new_recommendations)
+
+    def save(self, figure, name):
+        # write and rename, so that a viewer never sees a partial file
+        path = os.path.join(self.output_dir, name)
+        figure.savefig(path + ".tmp.png", dpi=100)
+        os.replace(path + ".tmp.png", path)
+        plt.close(figure)
+
+    def render(self):
+        if self.evaluations:
+            self.render_convergence()
+            self.render_throughput()
+        if self.recommendations:
+            self.render_parameters()
+
+    def render_convergence(self):
+        evaluation = [e["evaluation"] for e in self.evaluations]
+        figure, (llr_axes, elo_axes) = plt.subplots(2, 1, sharex=True, figsize=(10, 8))
+        llr_axes.plot(evaluation, [e["llr"] for e in self.evaluations], ".", markersize=3)
+        llr_axes.axhline(0, color="gray", linewidth=0.5)
+        llr_axes.set_ylabel("LLR")
+        elo_axes.errorbar(
+            evaluation,
+            [e["elo"] for e in self.evaluations],
+            yerr=[e["elo_error"] for e in self.evaluations],
+            fmt=".",
+            markersize=3,
+            elinewidth=0.5,
+        )
+        elo_axes.axhline(0, color="gray", linewidth=0.5)
+        elo_axes.set_ylabel("Elo")
+        elo_axes.set_xlabel("evaluation")
+        self.save(figure, "convergence.png")
+
+    def render_parameters(self):
+        names = sorted(self.recommendations[-1]["recommendation"])
+        columns = min(4, len(names))
+        rows = (len(names) + columns - 1) // columns
+        figure, axes = plt.subplots(rows, columns, sharex=True, squeeze=False, figsize=(4 * columns, 2.5 * rows))
+        evaluation = [r["evaluation"] for r in self.recommendations]
+        for i, name in enumerate(names):
+            ax = axes[i // columns][i % columns]
+            ax.step(evaluation, [r["recommendation"].get(name) for r in self.recommendations], where="post")
+            ax.set_title(name, fontsize=8)
+            ax.tick_params(labelsize=7)
+        for i in range(len(names), rows * columns):
+            axes[i // columns][i % columns].set_visible(False)
+        figure.tight_layout()
+        self.save(figure, "parameters.png")
+
+    def render_throughput(self):
+        elapsed = [e["time"] for e in self.evaluations]
+        total_games = [e["total_games"] for e in self.evaluations]
+        # rate between consecutive evaluations, and over the whole run
+        rate = [
+            (total_games[i] - total_games[i - 1]) / (elapsed[i] - elapsed[i - 1]) if elapsed[i] > elapsed[i - 1] else None
+            for i in range(1, len(elapsed))
+        ]
+        ranks = sorted({rank for e in self.evaluations for rank in e.get("utilization", {})})
+        figure, axes = plt.subplots(2 if ranks else 1, 1, sharex=True, squeeze=False, figsize=(10, 8 if ranks else 4))
+        axes[0][0].plot(elapsed[1:], rate, ".", markersize=3, label="between evaluations")
+        axes[0][0].plot(elapsed, [g / t if t > 0 else None for g, t in zip(total_games, elapsed)], label="average")
+        axes[0][0].set_ylabel("games/s")
+        axes[0][0].legend()
+        for rank in ranks:
+            points = [(e["time"], e["utilization"][rank]) for e in self.evaluations if rank in e.get("utilization", {})]
+            axes[1][0].plot([t for t, u in points], [100 * u for t, u in points], label=rank)
+        if ranks:
+            axes[1][0].set_ylabel("cpu utilization (%)")
+            axes[1][0].legend(fontsize=7)
+        axes[-1][0].set_xlabel("time (s)")
+        self.save(figure, "throughput.png")
+
+
+def watch(output_dir, interval):
+    """Render the plots every interval seconds, until terminated, then render a last time"""
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    plotter = Plotter(output_dir)
+    while True:
+        if plotter.update():
+            plotter.render()
+        if stopping:
+            return
+        deadline = time.monotonic() + interval
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(min(1.0, interval))
+
+
+if __name__ == "__main__":
+
+    class MyFormatter(
+        argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter
+    ):
+        pass
+
+    parser = argparse.ArgumentParser(
+        formatter_class=MyFormatter,
+        description=textwrap.dedent(
+            """\
+                  Plot the convergence of an optimization from the logs in its output dir.
+
+                  Render once:
+                     python3 plots.py --output_dir ./experiments/ng-tuning
+                  or keep refreshing while the optimization runs:
+                     python3 plots.py --output_dir ./experiments/ng-tuning --interval 60
+                  """
+        ),
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="",
+        help="Output dir of the optimization",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0,
+        help="Seconds between refreshes, 0 to render once",
+    )
+    args = parser.parse_args()
+
+    if args.interval > 0:
+        watch(args.output_dir, args.interval)
+    else:
+        plotter = Plotter(args.output_dir)
+        if not plotter.update():
+            sys.exit("No evaluations found in %s" % os.path.abspath(args.output_dir))
+        plotter.render()
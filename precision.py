@@ -0,0 +1,58 @@
+"""
+Precision-targeted number of games per point.
+
+Instead of a fixed number of games, a point keeps receiving game pairs until the
+standard error of its estimate is below a target, between a floor and a ceiling
+of games. The error follows from the variance of the game pair scores of its
+pentanomial, as in LLRcalc.stats:
+
+   logistic_elo  the standard error of the logistic Elo of the point, so that points
+                 with a large spread of the results (e.g. few draws) get more games
+   llr           the standard error of the (unclamped) SPRT LLR of the point, relative
+                 to the LLR itself, so that points whose LLR is clearly away from 0
+                 (easy calls) get fewer games
+
+The error of the normalized Elo of the SPRT bounds is not offered: it only depends on
+the number of games, so targeting it would be a fixed number of games in disguise.
+
+Both errors shrink as one over the square root of the number of games, which
+gives the games still needed. As the variance is noisy with few games, each
+round at most doubles the games of a point.
+"""
+
+import math
+
+from stats import LLRcalc
+from stats.sprt import sprt
+from cutechess_batches import pentanomial_elo
+
+METRICS = ["logistic_elo", "llr"]
+
+
+def pentanomial_llr(pentanomial, elo0=0.0, elo1=2.0):
+    """The SPRT LLR of a pentanomial (normalized Elo bounds, not clamped), and its standard error"""
+    test = sprt(alpha=0.05, beta=0.05, elo0=elo0, elo1=elo1, elo_model="normalized")
+    test.set_state(pentanomial)
+    mu, var = LLRcalc.LLR_drift_variance_alt2(test.pdf, test.s0, test.s1, None)
+    N = sum(pentanomial)
+    return N * mu, math.sqrt(N * var)
+
+
+def point_error(pentanomial, metric="logistic_elo", elo0=0.0, elo1=2.0):
+    """The error of the estimate of a point, infinite without game pairs"""
+    if sum(pentanomial) == 0:
+        return math.inf
+    if metric == "logistic_elo":
+        return math.sqrt(pentanomial_elo(pentanomial)[1])
+    llr, error = pentanomial_llr(pentanomial, elo0, elo1)
+    return error / abs(llr) if llr else math.inf
+
+
+def more_games(games, error, target_error, min_games, max_games):
+    """Games to play next at a point with games played, 0 if the target or the ceiling is reached"""
+    if games >= max_games or (games >= min_games and error <= target_error):
+        return 0
+    needed = games * (error / target_error) ** 2 if math.isfinite(error) else 2 * games
+    extra = int(math.ceil(max(min_games - games, min(needed - games, games), 2) / 2)) * 2
+    # game pairs that do not fit below the ceiling are left out
+    return min(extra, (max_games - games) // 2 * 2)
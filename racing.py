@@ -0,0 +1,59 @@
+"""
+Racing of candidate points: spend games where they change the decision.
+
+All candidates start with a small number of games. After each round the Elo
+confidence interval of every candidate is computed from its pentanomial (using
+the fishtest sprt analytics). Candidates whose upper bound is below the lower
+bound of the current leader are dropped, the others get their number of games
+doubled, until the maximum number of games is reached or a single candidate is left.
+Games a candidate played before the race (e.g. found in the cache) count towards
+its games and its confidence interval.
+"""
+
+from cutechess_batches import calc_stats
+
+
+def race(candidates, play, min_games, max_games, previous=None):
+    """Race a list of parameter dicts, returning the list of game results of each candidate
+
+    play(params, games, games_played) must return a future with the 'w' 'l' 'd' results of
+    the games, games_played being the number of games the candidate already played in the race.
+    previous optionally holds the results of each candidate before the race, these are not returned.
+    Dropped candidates keep the results of the games played before they were dropped.
+    """
+    previous = previous or [[] for _ in candidates]
+    results = [[] for _ in candidates]
+    alive = list(range(len(candidates)))
+    games = min_games
+    race_round = 0
+
+    while True:
+        race_round += 1
+        futures = {}
+        for i in alive:
+            have = len(previous[i]) + len(results[i])
+            if games > have:
+                futures[i] = play(candidates[i], games - have, len(results[i]))
+        for i in futures:
+            results[i].extend(futures[i].result())
+
+        if len(alive) == 1 or games >= max_games:
+            break
+
+        bounds = {}
+        for i in alive:
+            fishtest_stats = calc_stats(previous[i] + results[i])["fishtest_stats"]
+            bounds[i] = (fishtest_stats["ci"][0], fishtest_stats["elo"], fishtest_stats["ci"][1])
+        leader = max(alive, key=lambda i: bounds[i][1])
+        dropped = [i for i in alive if bounds[i][2] < bounds[leader][0]]
+        alive = [i for i in alive if i not in dropped]
+
+        print(f"race round {race_round}: {len(previous[leader]) + len(results[leader])} games, leader {leader + 1} "
+              f"elo {bounds[leader][1]:.2f} [{bounds[leader][0]:.2f}, {bounds[leader][2]:.2f}], "
+              f"dropped {[i + 1 for i in dropped]}, {len(alive)} left", flush=True)
+
+        if len(alive) == 1:
+            break
+        games = min(2 * games, max_games)
+
+    return results
@@ -0,0 +1,173 @@
+"""
+Content-addressed, on-disk cache of game results.
+
+Games played for a given (binary, reference binary, tc, book, parameters)
+combination are stored under a key derived from a hash of those inputs, where
+the binaries and the book are fingerprinted by their content. Separate runs
+(experiments, duels) sharing a cache directory can thus reuse each others games.
+
+Results are stored as counts of game pairs ("wl", "dd", ...), from which both
+the pentanomial and the w/l/d sequence (pair aligned) can be reconstructed.
+Writes are serialized with a lock file and made atomic with os.replace, so
+several runs can top up the same cache concurrently. The total size of the
+cache is bounded, least recently used entries are evicted first.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import fcntl
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+PAIR_CODES = ["ww", "wd", "wl", "dw", "dd", "dl", "lw", "ld", "ll"]
+
+_fingerprints = {}
+
+
+def file_fingerprint(name):
+    """sha256 of the content of a file, which can also be a binary found in PATH"""
+    path = shutil.which(name) or name
+    if not os.path.isfile(path):
+        sys.exit("result_cache: can not fingerprint missing file: %s\n" % name)
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    memo_key = (path, st.st_size, st.st_mtime_ns)
+    if memo_key not in _fingerprints:
+        sha = hashlib.sha256()
+        with open(path, "rb") as infile:
+            for chunk in iter(lambda: infile.read(1 << 20), b""):
+                sha.update(chunk)
+        _fingerprints[memo_key] = sha.hexdigest()
+    return _fingerprints[memo_key]
+
+
+def pair_counts(result_sequence):
+    """Count the game pairs in a sequence of 'w' 'l' 'd' results"""
+    counts = {}
+    for i in range(0, len(result_sequence) - 1, 2):
+        pair = result_sequence[i] + result_sequence[i + 1]
+        counts[pair] = counts.get(pair, 0) + 1
+    return counts
+
+
+def pairs_to_sequence(counts):
+    """Expand game pair counts into a (pair aligned) sequence of 'w' 'l' 'd' results"""
+    result_sequence = []
+    for pair in PAIR_CODES:
+        result_sequence.extend(list(pair) * counts.get(pair, 0))
+    return result_sequence
+
+
+def pairs_to_pentanomial(counts):
+    pentanomial = [0, 0, 0, 0, 0]
+    for pair, count in counts.items():
+        pentanomial[sum({"l": 0, "d": 1, "w": 2}[r] for r in pair)] += count
+    return pentanomial
+
+
+class ResultCache:
+    """A directory of json entries, one per key, holding game pair counts"""
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.cache_dir / ".lock"
+
+    def key(self, stockfish, stockfishRef, tc, tcRef, book, variables, **settings):
+        """Hash of all inputs that determine the outcome of the games
+
+        Additional settings affecting the games (e.g. engine options) can be passed
+        as keyword arguments.
+        """
+        inputs = {
+            "stockfish": file_fingerprint(stockfish),
+            "stockfishRef": file_fingerprint(stockfishRef),
+            "tc": tc,
+            "tcRef": tcRef,
+            "book": file_fingerprint(book),
+            "variables": {name: variables[name] for name in sorted(variables)},
+            "settings": {name: settings[name] for name in sorted(settings)},
+        }
+        return hashlib.sha256(
+            json.dumps(inputs, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def _entry_path(self, key):
+        return self.cache_dir / key[:2] / ("%s.json" % key)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, "a") as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def lookup(self, key):
+        """Return the game pair counts stored for key (empty if not cached)"""
+        path = self._entry_path(key)
+        try:
+            with open(path, "r") as infile:
+                entry = json.load(infile)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return entry["pairs"]
+
+    def lookup_sequence(self, key):
+        return pairs_to_sequence(self.lookup(key))
+
+    def add(self, key, result_sequence):
+        """Top up the entry for key with new results, return the merged pair counts"""
+        path = self._entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._locked():
+            counts = {}
+            if path.exists():
+                with open(path, "r") as infile:
+                    counts = json.load(infile)["pairs"]
+            for pair, count in pair_counts(result_sequence).items():
+                counts[pair] = counts.get(pair, 0) + count
+            entry = {
+                "pairs": counts,
+                "pentanomial": pairs_to_pentanomial(counts),
+                "games": 2 * sum(counts.values()),
+                "updated": time.time(),
+            }
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w") as outfile:
+                json.dump(entry, outfile)
+            os.replace(tmp_path, path)
+            self._evict()
+        return counts
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -1,12 +1,19 @@
 #!/bin/bash
 
+# use the settings measured by calibrate.py if available
+config_args=""
 mpi_concurrency=$(( $(nproc) / 8 ))
+if [ -f throughput.json ]; then
+  config_args="--config throughput.json"
+  mpi_concurrency=$(jq .mpi_ranks throughput.json)
+fi
+
 mpiexec -np $mpi_concurrency python3 \
   -m mpi4py.futures nevergrad4sf.py \
   --output_dir ./experiments/ng-tuning \
   --tc "10000+10000 nodes=5000" \
   --games_per_batch 96 \
   --batch_increase_per_iter 64 \
-  --cutechess_concurrency 8 \
   --evaluation_concurrency 3 \
-  --ng_evals 512
+  --ng_evals 512 \
+  $config_args
@@ -0,0 +1,326 @@
+"""
+Fair-share scheduler: several experiments sharing one pool of workers.
+
+The scheduler is a long-running service. Workers connect to it as to a master
+started with --backend tcp (see tcp_executor.py), experiments connect to it with
+--backend scheduler, and submit their cutechess batches to it. A free worker
+runs the next task of the experiment with queued tasks that received the least
+worker time relative to its weight (weighted fair queueing, charged with the
+measured duration of the tasks). An experiment that becomes active again starts
+from the least usage of the active ones, so it does not get a burst for the time
+it was idle. Workers are never left idle while any experiment has queued tasks.
+
+Start the scheduler, and workers on any machine that can reach it:
+   python3 scheduler.py --listen 0.0.0.0:5555 --clients 0.0.0.0:5556 --authkey KEY
+   python3 tcp_executor.py --connect scheduler:5555 --authkey KEY --workers 8
+
+then experiments, e.g. with twice the share of the first for the second:
+   python3 nevergrad4sf.py --backend scheduler --scheduler scheduler:5556 --authkey KEY --experiment eval ...
+   python3 nevergrad4sf.py --backend scheduler --scheduler scheduler:5556 --authkey KEY --experiment search --weight 2 ...
+"""
+
+import os
+import sys
+import time
+import pickle
+import argparse
+import textwrap
+import threading
+import collections
+from concurrent.futures import Executor, Future, wait as wait_for
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+from tcp_executor import TCPPoolExecutor, parse_address, HEARTBEAT
+
+
+class Experiment:
+    def __init__(self, name, weight):
+        self.name = name
+        self.weight = weight
+        self.queue = collections.deque()
+        self.usage = 0.0  # worker seconds, including the estimates of the running tasks
+        self.running = 0
+        self.done = 0
+        self.seconds = 0.0  # measured worker seconds of the finished tasks
+        self.reported = (0, 0.0)  # done and seconds at the previous report
+
+    def estimate(self):
+        """Expected worker seconds of the next task"""
+        return self.seconds / self.done if self.done else 1.0
+
+
+class FairShareScheduler(TCPPoolExecutor):
+    def __init__(self, address, client_address, authkey=b"", heartbeat=HEARTBEAT):
+        """Listen for workers on address, and for experiments on client_address"""
+        self.experiments = {}
+        self.tasks_of = {}
+        super().__init__(address, authkey, heartbeat)
+        self.client_listener = Listener(client_address, authkey=self.authkey)
+        self.client_address = self.client_listener.address
+        self.report_time = time.monotonic()
+        threading.Thread(target=self.accept_clients, daemon=True).start()
+
+    # task selection, called with the condition held
+    def has_tasks(self):
+        return any(experiment.queue for experiment in self.experiments.values())
+
+    def next_task(self):
+        experiment = min(
+            (e for e in self.experiments.values() if e.queue), key=lambda e: e.usage / e.weight
+        )
+        task = experiment.queue.popleft()
+        estimate = experiment.estimate()
+        experiment.usage += estimate
+        experiment.running += 1
+        self.tasks_of[task[0]] = (experiment, estimate)
+        return task
+
+    def requeue(self, task):
+        experiment, estimate = self.tasks_of.pop(task[0])
+        experiment.usage -= estimate
+        experiment.running -= 1
+        experiment.queue.appendleft(task)
+
+    def task_failed(self, task):
+        experiment, estimate = self.tasks_of.pop(task[0])
+        experiment.usage -= estimate
+        experiment.running -= 1
+
+    def task_done(self, task, seconds):
+        with self.condition:
+            experiment, estimate = self.tasks_of.pop(task[0])
+            experiment.usage += seconds - estimate
+            experiment.running -= 1
+            experiment.done += 1
+            experiment.seconds += seconds
+
+    def submit_to(self, name, fn, *args, **kwargs):
+        """Queue a task of the experiment name"""
+        future = Future()
+        with self.condition:
+            experiment = self.experiments[name]
+            if not experiment.queue and not experiment.running:
+                # no credit for the time the experiment was idle
+                active = [e.usage / e.weight for e in self.experiments.values() if e.queue or e.running]
+                if active:
+                    experiment.usage = max(experiment.usage, min(active) * experiment.weight)
+            experiment.queue.append((future, fn, args, kwargs))
+            self.condition.notify()
+        return future
+
+    def accept_clients(self):
+        while True:
+            try:
+                connection = self.client_listener.accept()
+            except AuthenticationError:
+                print("scheduler: rejected an experiment with a wrong authkey", flush=True)
+                continue
+            except OSError:
+                return
+            threading.Thread(target=self.serve_client, args=(connection,), daemon=True).start()
+
+    def serve_client(self, connection):
+        """Queue the tasks an experiment submits, and send back their results"""
+        try:
+            info = connection.recv()
+        except (EOFError, OSError):
+            connection.close()
+            return
+        name = info["experiment"]
+        with self.condition:
+            if name in self.experiments:
+                self.experiments[name].weight = info["weight"]
+            else:
+                self.experiments[name] = Experiment(name, info["weight"])
+        print("scheduler: experiment %s joined with weight %g" % (name, info["weight"]), flush=True)
+        lock = threading.Lock()
+        futures = set()
+
+        def reply(task_id, future):
+            futures.discard(future)
+            if future.cancelled():
+                return
+            error = future.exception()
+            try:
+                with lock:
+                    if error:
+                        connection.send(("error", task_id, error))
+                    else:
+                        connection.send(("result", task_id, future.result()))
+            except (EOFError, OSError):
+                pass
+
+        try:
+            connection.send({"workers": self.num_workers})
+            while True:
+                message = connection.recv()
+                if message is None:
+                    break
+                kind, task_id, payload = message
+                try:
+                    fn, args, kwargs = pickle.loads(payload)
+                except Exception as e:
+                    with lock:
+                        connection.send(("error", task_id, RuntimeError("cannot unpickle task: %r" % e)))
+                    continue
+                future = self.submit_to(name, fn, *args, **kwargs)
+                futures.add(future)
+                future.add_done_callback(lambda future, task_id=task_id: reply(task_id, future))
+        except (EOFError, OSError):
+            print("scheduler: lost experiment %s" % name, flush=True)
+        finally:
+            # the queued tasks of the experiment are no longer needed, the running ones finish
+            with self.condition:
+                experiment = self.experiments[name]
+                for task in list(experiment.queue):
+                    if task[0] in futures:
+                        experiment.queue.remove(task)
+                        task[0].cancel()
+            connection.close()
+
+    def report(self):
+        """Throughput and share of the worker time of each experiment, since the previous report"""
+        with self.condition:
+            now = time.monotonic()
+            interval = max(now - self.report_time, 1e-9)
+            self.report_time = now
+            lines = ["scheduler: %d workers, over the last %.0fs:" % (len(self.workers), interval)]
+            # the fair share is among the experiments that had work in the interval
+            active = [e for e in self.experiments.values() if e.queue or e.running or e.done > e.reported[0]]
+            total_weight = sum(e.weight for e in active) or 1.0
+            total_seconds = sum(e.seconds - e.reported[1] for e in self.experiments.values()) or 1e-9
+            for e in self.experiments.values():
+                done, seconds = e.done - e.reported[0], e.seconds - e.reported[1]
+                e.reported = (e.done, e.seconds)
+                lines.append(
+                    "   %-20s weight %5.2g, %4d queued, %3d running, %6.2f tasks/min, %7.1f worker s, share %5.1f%% (fair %5.1f%%)"
+                    % (
+                        e.name,
+                        e.weight,
+                        len(e.queue),
+                        e.running,
+                        60 * done / interval,
+                        seconds,
+                        100 * seconds / total_seconds,
+                        100 * e.weight / total_weight if e in active else 0.0,
+                    )
+                )
+        return "\n".join(lines)
+
+
+class SchedulerExecutor(Executor):
+    def __init__(self, address, authkey, experiment, weight=1.0):
+        """Submit the tasks of an experiment to the scheduler at address"""
+        try:
+            self.connection = Client(address, authkey=authkey)
+        except AuthenticationError:
+            sys.exit("The scheduler rejected the authkey")
+        self.connection.send({"experiment": experiment, "weight": weight})
+        self.workers = self.connection.recv()["workers"]
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.next_id = 0
+        threading.Thread(target=self.receive, daemon=True).start()
+
+    def receive(self):
+        try:
+            while True:
+                kind, task_id, value = self.connection.recv()
+                with self.lock:
+                    future = self.futures.pop(task_id)
+                if kind == "result":
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+        except (EOFError, OSError):
+            with self.lock:
+                futures, self.futures = self.futures, {}
+            for future in futures.values():
+                future.set_exception(ConnectionError("lost the scheduler"))
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        try:
+            payload = pickle.dumps((fn, args, kwargs))
+        except Exception as e:
+            future.set_exception(e)
+            return future
+        with self.lock:
+            task_id = self.next_id
+            self.next_id += 1
+            self.futures[task_id] = future
+            self.connection.send(("submit", task_id, payload))
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        if wait:
+            with self.lock:
+                futures = list(self.futures.values())
+            wait_for(futures)
+        with self.lock:
+            try:
+                self.connection.send(None)
+            except (EOFError, OSError):
+                pass
+        self.connection.close()
+
+
+if __name__ == "__main__":
+
+    class MyFormatter(
+        argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter
+    ):
+        pass
+
+    parser = argparse.ArgumentParser(
+        formatter_class=MyFormatter,
+        description=textwrap.dedent(
+            """\
+                  Share a pool of tcp workers between several experiments.
+
+                  A typical invocation could be:
+                     python3 scheduler.py --listen 0.0.0.0:5555 --clients 0.0.0.0:5556 --authkey KEY
+                  """
+        ),
+    )
+    parser.add_argument(
+        "--listen",
+        type=str,
+        default="0.0.0.0:5555",
+        help="host:port on which the scheduler waits for workers",
+    )
+    parser.add_argument(
+        "--clients",
+        type=str,
+        default="0.0.0.0:5556",
+        help="host:port on which the scheduler waits for experiments",
+    )
+    parser.add_argument(
+        "--authkey",
+        type=str,
+        default=os.environ.get("NG4SF_AUTHKEY", ""),
+        help="Key the workers and experiments need, defaults to the NG4SF_AUTHKEY environment variable, random if empty",
+    )
+    parser.add_argument(
+        "--report",
+        type=float,
+        default=60.0,
+        help="Seconds between reports of the throughput of the experiments",
+    )
+    args = parser.parse_args()
+
+    scheduler = FairShareScheduler(parse_address(args.listen), parse_address(args.clients), args.authkey.encode())
+    print(
+        "Scheduler started, start workers with:\n   python3 tcp_executor.py --connect HOST:%d --authkey %s\n"
+        "and experiments with:\n   --backend scheduler --scheduler HOST:%d --authkey %s"
+        % (scheduler.address[1], scheduler.authkey.decode(), scheduler.client_address[1], scheduler.authkey.decode()),
+        flush=True,
+    )
+    try:
+        while True:
+            time.sleep(args.report)
+            print(scheduler.report(), flush=True)
+    except KeyboardInterrupt:
+        scheduler.client_listener.close()
+        scheduler.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,493 @@
+"""
+Checks of the parts of the tuner that do not need cutechess or stockfish.
+
+Run with ./test.sh, which also runs the selftest of the tcp executor.
+"""
+
+import os
+import sys
+import json
+import time
+import math
+import tempfile
+import argparse
+from concurrent.futures import Future
+
+import numpy as np
+
+from result_cache import ResultCache, pairs_to_pentanomial
+from fidelity import parse_fidelity
+from budget import Budget
+from cutechess_batches import CutechessLocalBatch, CutechessExecutorBatch, parse_game_results
+from precision import more_games
+from spatial_index import SpatialIndex
+from warm_start import prior_observations
+from opening_book import OpeningBook
+from surrogate import Surrogate
+from losses import LOSSES, get_loss, pentanomial_probabilities
+from telemetry import parse_pgn, position_key, summarize, combine
+from blocks import prefix, group_params
+from sensitivity import design, effects
+from scheduler import Experiment, FairShareScheduler, SchedulerExecutor
+from tcp_executor import start_workers
+
+
+def check_result_cache():
+    with tempfile.TemporaryDirectory() as directory:
+        binary = os.path.join(directory, "stockfish")
+        book = os.path.join(directory, "book.epd")
+        for name in [binary, book]:
+            with open(name, "w") as outfile:
+                outfile.write(name)
+        cache = ResultCache(os.path.join(directory, "cache"))
+
+        def key(variables, **settings):
+            return cache.key(binary, binary, "10+0.1", "10+0.1", book, variables, **settings)
+
+        assert key({"A": 1, "B": 2}, hash=16) == key({"B": 2, "A": 1}, hash=16)
+        assert key({"A": 1}, hash=16) != key({"A": 2}, hash=16)
+        assert key({"A": 1}, hash=16, draw="movenumber=50") != key({"A": 1}, hash=16, draw="movenumber=40")
+        # the book is fingerprinted by its content
+        before = key({"A": 1})
+        with open(book, "a") as outfile:
+            outfile.write("changed")
+        os.utime(book, (0, 0))
+        assert key({"A": 1}) != before
+
+        # results are topped up as game pairs
+        first = key({"A": 1})
+        cache.add(first, ["w", "l", "d", "d"])
+        counts = cache.add(first, ["w", "w", "x"])
+        assert counts == {"wl": 1, "dd": 1, "ww": 1}, counts
+        assert pairs_to_pentanomial(counts) == [0, 0, 2, 0, 1]
+        assert sorted(cache.lookup_sequence(first)) == sorted("wlddww")
+        assert cache.lookup(key({"A": 3})) == {}
+
+        # the least recently used entry is evicted once the cache is too large
+        second, third = key({"A": 2}), key({"A": 3})
+        cache.add(second, ["d", "d"])
+        for age, entry in [(200, first), (100, second)]:
+            path = cache._entry_path(entry)
+            mtime = os.stat(path).st_mtime - age
+            os.utime(path, (mtime, mtime))
+        size = os.stat(cache._entry_path(first)).st_size
+        cache.max_bytes = 2.5 * size
+        cache.add(third, ["l", "l"])
+        assert cache.lookup(first) == {}
+        assert cache.lookup(second) == {"dd": 1}
+        assert cache.lookup(third) == {"ll": 1}
+
+
+def check_parse_fidelity():
+    fidelity = parse_fidelity("64:10000+10000 nodes=500")
+    assert (fidelity.games, fidelity.tc, fidelity.tcRef) == (64, "10000+10000 nodes=500", "10000+10000 nodes=500")
+    fidelity = parse_fidelity("8:1+0.01:2+0.02")
+    assert (fidelity.games, fidelity.tc, fidelity.tcRef) == (8, "1+0.01", "2+0.02")
+    for spec in ["64", "x:1+0.01", "1:2:3:4"]:
+        try:
+            parse_fidelity(spec)
+        except argparse.ArgumentTypeError:
+            continue
+        raise AssertionError("accepted fidelity %s" % spec)
+
+
+def check_budget():
+    assert not Budget()
+    assert Budget().reserve(100) == 100
+
+    budget = Budget(games_budget=1000, final_games=200, min_fraction=0.5)
+    assert budget.reserve(301) == 300
+    assert budget.reserve(400) == 400
+    # 100 games are left before the final evaluation, less than half of the request
+    assert budget.reserve(300) == 0
+    assert budget.reserve(150) == 100
+    budget.release(300, 250)
+    budget.release(400, 400)
+    budget.release(100, 100)
+    assert budget.remaining_games() == 250
+    assert budget.reserve(100) == 50
+    assert budget.final_evaluation_games() == 250
+
+
+def check_parse_game_results():
+    output = "\n".join(
+        [
+            "Started game 1 of 8 (test0 vs base)",
+            "Finished game 1 (test0 vs base): 1-0 {White mates}",
+            "Finished game 2 (base vs test0): 1-0 {White mates}",
+            "Finished game 4 (test1 vs base): 1/2-1/2 {Draw by adjudication}",
+            "Finished game 3 (base vs test1): 0-1 {Black mates}",
+            "Finished game 5 (test0 vs base): 0-1 {Black mates}",
+            "Finished game 6 (base vs test0): * {No result}",
+            "Finished game 7 (test1 vs base): 1-0 {White mates}",
+        ]
+    )
+    sequences, incomplete_pairs = parse_game_results(output, ["test0", "test1"])
+    # pairs are kept in order of the game numbers, from the test engine's perspective
+    assert sequences == {"test0": ["wl"], "test1": ["wd"]}, sequences
+    # the pair with an unterminated game and the pair with a missing game are dropped
+    assert incomplete_pairs == 2, incomplete_pairs
+
+
+def check_more_games():
+    # no games yet: the floor, or two games
+    assert more_games(0, math.inf, 10, 64, 1000) == 64
+    assert more_games(0, math.inf, 10, 0, 1000) == 2
+    # the target is reached, or the ceiling
+    assert more_games(100, 5, 10, 64, 1000) == 0
+    assert more_games(1000, 50, 10, 64, 1000) == 0
+    # the games at most double per round, and stay even and below the ceiling
+    assert more_games(100, 50, 10, 64, 1000) == 100
+    assert more_games(100, 11, 10, 64, 1000) == 22
+    assert more_games(100, 50, 10, 64, 151) == 50
+    assert more_games(150, 50, 10, 64, 151) == 0
+
+
+def check_spatial_index():
+    # many points in many dimensions, where the cells within the radius of a query are far too many to visit
+    rng = np.random.default_rng(0)
+    dimensions, size = 40, 20000
+    bounds = {"p%d" % i: (0, 100) for i in range(dimensions)}
+    index = SpatialIndex(bounds, cell_size=0.05)
+    points = rng.uniform(0, 100, (size, dimensions))
+    for i, x in enumerate(points):
+        index.add(dict(zip(sorted(bounds), x)), [0, 0, 1, 0, i % 2])
+    for x in [np.full(dimensions, 50.0), points[7]]:
+        params = dict(zip(sorted(bounds), x))
+        z = index.scale(params)
+        distances = np.sort(np.linalg.norm(index.points[:size] - z, axis=1))
+        start = time.perf_counter()
+        indices, found = index.nearest(params, 10)
+        assert time.perf_counter() - start < 1.0, "slow nearest neighbour query"
+        assert np.allclose(found, distances[:10]), found
+        indices, found = index.within(params, distances[20])
+        assert len(indices) == 21 and np.all(found <= distances[20])
+
+    # pooling weighs the games of nearby points, and replaces those of the point itself
+    index = SpatialIndex({"a": (0, 10), "b": (0, 10)}, cell_size=0.5)
+    index.add({"a": 5, "b": 5}, [0, 0, 4, 0, 0])
+    index.add({"a": 6, "b": 5}, [0, 0, 0, 0, 4])
+    index.add({"a": 0, "b": 0}, [4, 0, 0, 0, 0])
+    pooled = index.pooled({"a": 5, "b": 5}, 0.4, [0, 0, 8, 0, 0])
+    assert np.allclose(pooled, [0, 0, 8, 0, 4 * (1 - 0.5 ** 2)]), pooled
+
+
+def check_prior_observations():
+    sf_params = {"A": (50, 0, 100), "B": (10, 0, 20)}
+    experiment = {
+        "evalpoints": [
+            {"params": {"A": 60, "B": 5}, "fidelity": ["10+0.1", "10+0.1"], "stats": {"pentanomial": [0, 1, 2, 3, 0]}},
+            {"params": {"A": 70, "B": 5}, "fidelity": ["1+0.01", "1+0.01"], "stats": {"pentanomial": [0, 3, 2, 1, 0]}},
+            {"params": {"A": 200}, "stats": {"pentanomial": [0, 0, 4, 0, 0]}},
+        ]
+    }
+    # screening evaluations are left out, records without a fidelity are kept, parameters are clipped
+    observations = prior_observations(sf_params, experiment, 0.5, loss=sum, fidelity=["10+0.1", "10+0.1"])
+    assert observations == [({"A": 60.0, "B": 5.0}, 3.0), ({"A": 100.0, "B": 10.0}, 2.0)], observations
+
+
+# a cutechess-cli playing a gauntlet in which a test engine with option.Win=1 wins all its games
+FAKE_CUTECHESS = """#!%s
+import sys
+args = " ".join(sys.argv[1:])
+engines = [e.split()[0][len("name="):] for e in args.split("-engine ")[1:]]
+wins = ["option.Win=1" in e for e in args.split("-engine ")[1:]]
+rounds = int(args.split("-rounds ")[1].split()[0])
+lines, game = [], 0
+for _ in range(rounds):
+    for name, win in zip(engines, wins):
+        if name == "base":
+            continue
+        game += 2
+        lines.append("Finished game %%d (%%s vs base): %%s {}" %% (game - 1, name, "1-0" if win else "0-1"))
+        lines.append("Finished game %%d (base vs %%s): %%s {}" %% (game, name, "0-1" if win else "1-0"))
+for line in reversed(lines):
+    print(line)
+""" % sys.executable
+
+
+def check_multi_candidate():
+    with tempfile.TemporaryDirectory() as directory:
+        cutechess = os.path.join(directory, "cutechess")
+        with open(cutechess, "w") as outfile:
+            outfile.write(FAKE_CUTECHESS)
+        os.chmod(cutechess, 0o755)
+        book = os.path.join(directory, "book.epd")
+        with open(book, "w") as outfile:
+            outfile.write("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq -\n")
+        batch = CutechessLocalBatch(cutechess=cutechess, stockfish="stockfish", book=book, rounds=3, concurrency=1)
+        # the results of the candidates sharing the cutechess process are demultiplexed by engine name
+        results = batch.run_multi([{"Win": 1}, {"Win": 0}, {"Win": 1}])
+        assert results == [["w"] * 6, ["l"] * 6, ["w"] * 6], results
+        assert batch.run({"Win": 0}) == ["l"] * 6
+
+
+def check_opening_book():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "book.epd")
+        with open(path, "w") as outfile:
+            outfile.write("a w - -\n\nb w - -\nc w - -")
+        book = OpeningBook(path)
+        assert len(book) == 3 and book.opening(2) == b"c w - -\n"
+        assert os.path.exists(path + ".idx")
+        # slices wrap around the end of the book, each opening repeated in a row
+        slice_path = book.write_slice(2, 2, repeat=2)
+        with open(slice_path, "rb") as infile:
+            lines = [line for line in infile.read().splitlines() if line]
+        os.remove(slice_path)
+        assert lines == [b"c w - -", b"c w - -", b"a w - -", b"a w - -"], lines
+        book.cursor = 2
+        assert book.take(2) == 2 and book.take(1) == 1
+
+        # the index is reused while the book is unchanged, and rebuilt once it changes
+        assert list(OpeningBook(path).offsets) == list(book.offsets)
+        with open(path, "a") as outfile:
+            outfile.write("\nd w - -\n")
+        os.utime(path, (0, 0))
+        assert len(OpeningBook(path)) == 4
+
+        path = os.path.join(directory, "book.pgn")
+        with open(path, "w") as outfile:
+            outfile.write('[Event "1"]\n[FEN "x"]\n\n1. e4 *\n\n[Event "2"]\n\n1. d4 *\n')
+        book = OpeningBook(path)
+        assert len(book) == 2 and book.opening(1) == b'[Event "2"]\n\n1. d4 *\n'
+
+
+class RecordingExecutor:
+    """Records the openings and seed of the submitted batches, which play no games"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, variables_list, openings, seed, *args):
+        self.submitted.append((openings, seed))
+        future = Future()
+        future.set_result(([[] for _ in variables_list], {"telemetry": None}))
+        return future
+
+
+def check_crn():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "book.epd")
+        with open(path, "w") as outfile:
+            outfile.write("".join("%d w - -\n" % i for i in range(100)))
+        executor = RecordingExecutor()
+        batch = CutechessExecutorBatch(rounds=4, batches=2, executor=executor, opening_book=OpeningBook(path))
+
+        # the points of a block play the same slices with the same seeds
+        batch.run({"A": 1}, crn=(10, 7))
+        batch.run({"A": 2}, crn=(10, 7))
+        assert executor.submitted == 2 * [((10, 4, 1), 7), ((14, 4, 1), 8)], executor.submitted
+        # candidates of a multi-candidate batch play each opening once per candidate
+        executor.submitted = []
+        batch.run_multi([{"A": 1}, {"A": 2}, {"A": 3}], crn=(10, 7))
+        assert executor.submitted == [((10, 4, 3), 7), ((14, 4, 3), 8)], executor.submitted
+        # small batches for balancing the load cover the same openings
+        executor.submitted = []
+        batch.load_balance = True
+        batch.run({"A": 1}, crn=(10, 7))
+        assert [openings for openings, seed in executor.submitted] == [(i, 1, 1) for i in range(10, 18)]
+
+        # without common random numbers, the points take disjoint slices of the book
+        executor.submitted = []
+        batch.load_balance = False
+        batch.opening_book.cursor = 0
+        batch.run({"A": 1})
+        batch.run({"A": 2})
+        assert [openings[0] for openings, seed in executor.submitted] == [0, 4, 8, 12], executor.submitted
+
+
+def check_surrogate():
+    # the Elo of a point is a concave quadratic with its maximum at A = 30, B = -20
+    def elo(params):
+        return 10 - 20 * ((params["A"] - 30) / 50) ** 2 - 10 * ((params["B"] + 20) / 50) ** 2
+
+    grid = [{"A": a, "B": b} for a in range(0, 101, 20) for b in range(-50, 51, 20)]
+    for full_max_params in [2, 1]:
+        surrogate = Surrogate({"A": (0, 100), "B": (-50, 50)}, full_max_params=full_max_params, seed=0)
+        for params in grid:
+            surrogate.add(params, [1000 * p for p in pentanomial_probabilities(elo(params))])
+        assert surrogate.observations == len(grid) and round(surrogate.games) == 2000 * len(grid)
+        params, predicted, sigma = surrogate.recommendation()
+        assert abs(params["A"] - 30) <= 2 and abs(params["B"] + 20) <= 2, params
+        assert abs(predicted - 10) < 1 and 0 < sigma < 2, (predicted, sigma)
+        assert len(surrogate.suggestions(count=3)) == 3
+
+
+def check_parse_pgn():
+    pgn = """[White "test"]
+[Black "base"]
+[Result "1/2-1/2"]
+[FEN "4k3/8/8/8/8/8/8/4K3 b - - 0 1"]
+[PlyCount "3"]
+
+1... Kd7 {+0.10/5 0.5s} 2. Ke2 {-0.10/5 0.25s} Ke7 {0.00/5 0.5s, Draw by adjudication} 1/2-1/2
+
+[White "base"]
+[Black "test"]
+[Result "0-1"]
+
+1. f3 {-1.00/5 0.1s} e5 {+1.00/5 0.2s} 2. g4 {-9.00/5 0.1s} Qh4# {+M1/5 0.2s, Black mates} 0-1
+
+[White "other"]
+[Black "base"]
+[Result "1-0"]
+
+1. e4 {0.1s} 1-0
+
+[White "base"]
+[Black "test"]
+[Result "1-0"]
+[Termination "time forfeit"]
+
+1. e4 {+0.10/5 0.1s} e5 {0.00/5 1.0s, Black loses on time} 1-0
+"""
+    openings = {position_key("4k3/8/8/8/8/8/8/4K3 b - - 0 1"): 12}
+    records = parse_pgn(pgn.splitlines(keepends=True), ["test"], openings)
+    # games of other engines are left out, times are attributed by the side to move of the start position
+    assert [record["termination"] for record in records] == ["draw adjudication", "mate", "time forfeit"], records
+    assert records[0] == {
+        "engine": "test", "plies": 3, "termination": "draw adjudication", "time": 0.25, "time_ref": 1.0, "opening": 12
+    }, records[0]
+    assert (records[1]["plies"], records[1]["time"], records[1]["time_ref"], records[1]["opening"]) == (4, 0.4, 0.2, None)
+
+    summary = combine([summarize(records[:1]), summarize(records[1:])])
+    assert (summary["games"], summary["plies"], summary["max_plies"], summary["draw_adjudication_plies"]) == (3, 9, 4, 3)
+    assert summary["terminations"] == {"draw adjudication": 1, "mate": 1, "time forfeit": 1}
+
+
+def check_group_params():
+    assert [prefix(name) for name in ["futilityMargin[1]", "razor_margin", "PawnValueMg", "RFP2", "LMR"]] == [
+        "futility", "razor", "Pawn", "RFP", "LMR"
+    ]
+    names = ["futilityMargin", "futilityDepth", "razorMargin", "PawnValueMg", "PawnValueEg"]
+    assert group_params("prefix", names) == {
+        "futility": ["futilityMargin", "futilityDepth"], "razor": ["razorMargin"], "Pawn": ["PawnValueMg", "PawnValueEg"]
+    }
+
+    # parameters that are not tunable are dropped, those not in any group are in "other",
+    # a parameter is only in its first group
+    spec = json.dumps(
+        {"search": ["razorMargin", "lmrDepth", "futilityMargin"], "pruning": ["futilityMargin"], "eval": ["PawnValueMg"]}
+    )
+    expected = {
+        "search": ["razorMargin", "futilityMargin"], "eval": ["PawnValueMg"], "other": ["futilityDepth", "PawnValueEg"]
+    }
+    assert group_params(spec, names) == expected
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "groups.json")
+        with open(path, "w") as outfile:
+            outfile.write(spec)
+        assert group_params(path, names) == expected
+
+
+def check_sensitivity():
+    sf_params = {"A": (10, 0, 100), "B": (0, 0, 10), "C": (5, 5, 5)}
+    points = design({"A": (10, 3.4), "B": (0, 2.4), "C": (5, 0.2)}, sf_params)
+    # perturbations clipped away at the bounds are left out
+    assert points == [
+        (None, 0, {"A": 10, "B": 0, "C": 5}),
+        ("A", 1, {"A": 13, "B": 0, "C": 5}),
+        ("A", -1, {"A": 7, "B": 0, "C": 5}),
+        ("B", 1, {"A": 10, "B": 2, "C": 5}),
+    ], points
+
+    def pentanomial(elo):
+        return [1000 * p for p in pentanomial_probabilities(elo)]
+
+    report = effects(points, [pentanomial(0), pentanomial(20), pentanomial(0), [0] * 5], 2.0)
+    # a point without game pairs is left out
+    assert sorted(report) == ["A"] and not report["A"]["frozen"], report
+    assert abs(report["A"]["plus"]["elo"] - 20) < 1e-6 and abs(report["A"]["minus"]["elo"]) < 1e-6
+    # the most significant parameter is not frozen, even below the threshold
+    report = effects(points, [pentanomial(0), pentanomial(0), pentanomial(0), pentanomial(3)], 2.0)
+    assert report["A"]["frozen"] and not report["B"]["frozen"], report
+    assert effects(points, [[0] * 5] * 4, 2.0) == {}
+
+
+def check_losses():
+    even, better = [10, 20, 40, 20, 10], [5, 15, 40, 25, 15]
+    for name in LOSSES:
+        loss = get_loss(name, 0.0, 2.0)
+        assert loss(better) < loss(even), name
+    assert get_loss("elo")(even) == 0 and get_loss("los")(even) == 0.5
+    # the SPRT LLR is clamped to its bounds, the GSPRT LLRs are not
+    many = [100 * n for n in better]
+    assert math.isclose(get_loss("sprt")(many), -math.log(0.95 / 0.05), rel_tol=1e-3)
+    assert get_loss("llr_normalized")(many) < get_loss("sprt")(many)
+    try:
+        get_loss("unknown")
+    except SystemExit:
+        pass
+    else:
+        raise AssertionError("accepted an unknown loss")
+
+
+def check_scheduler():
+    scheduler = FairShareScheduler(("127.0.0.1", 0), ("127.0.0.1", 0))
+    try:
+        # without workers, the tasks are taken by hand: b has twice the weight of a, each task takes 1s
+        scheduler.experiments = {"a": Experiment("a", 1.0), "b": Experiment("b", 2.0)}
+        for i in range(6):
+            for name in ["a", "b"]:
+                scheduler.submit_to(name, pow, 2, i)
+        order = []
+        for _ in range(6):
+            with scheduler.condition:
+                task = scheduler.next_task()
+            order.append(scheduler.tasks_of[task[0]][0].name)
+            scheduler.task_done(task, 1.0)
+        assert order == list("abbabb"), order
+        # an experiment that was idle starts from the least usage of the active ones
+        scheduler.experiments["c"] = Experiment("c", 1.0)
+        scheduler.submit_to("c", pow, 2, 0)
+        assert scheduler.experiments["c"].usage == 2.0, scheduler.experiments["c"].usage
+    finally:
+        scheduler.client_listener.close()
+        scheduler.shutdown(wait=False)
+
+    # two experiments share a worker
+    scheduler = FairShareScheduler(("127.0.0.1", 0), ("127.0.0.1", 0))
+    processes = start_workers(scheduler.address, scheduler.authkey, 1, retry=0.1)
+    scheduler.wait_for_workers(1)
+    experiments = [SchedulerExecutor(scheduler.client_address, scheduler.authkey, name) for name in ["a", "b"]]
+    futures = [executor.submit(pow, i, 2) for i in range(3) for executor in experiments]
+    assert [future.result(timeout=30) for future in futures] == [0, 0, 1, 1, 4, 4]
+    for executor in experiments:
+        executor.shutdown()
+    scheduler.client_listener.close()
+    scheduler.shutdown()
+    for process in processes:
+        process.join(timeout=10)
+
+
+CHECKS = [
+    check_result_cache,
+    check_parse_fidelity,
+    check_budget,
+    check_parse_game_results,
+    check_more_games,
+    check_spatial_index,
+    check_prior_observations,
+    check_multi_candidate,
+    check_opening_book,
+    check_crn,
+    check_surrogate,
+    check_parse_pgn,
+    check_group_params,
+    check_sensitivity,
+    check_losses,
+    check_scheduler,
+]
+
+if __name__ == "__main__":
+    failed = 0
+    for check in CHECKS:
+        try:
+            check()
+            print("%s passed" % check.__name__)
+        except AssertionError as e:
+            failed += 1
+            print("%s FAILED: %s" % (check.__name__, e))
+    if failed:
+        sys.exit("%d of %d checks failed" % (failed, len(CHECKS)))
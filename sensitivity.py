@@ -0,0 +1,68 @@
+"""
+Sensitivity screening of the parameters, before tuning them.
+
+Many parameters barely affect strength, but still widen the space the optimizer
+has to search. A one-at-a-time design measures their effect cheaply: games are
+played at the start values (the center), and for each parameter at the center
+moved by plus and minus its mutation sigma. The Elo difference of each
+perturbation with the center, and its error, follow from the pentanomials.
+Parameters for which neither perturbation differs significantly from the center
+are frozen at their start values. Comparing with the center, rather than the
+two perturbations with each other, also keeps parameters that are already near
+their optimum, where both perturbations lose Elo.
+"""
+
+import math
+
+from cutechess_batches import pentanomial_elo
+
+
+def design(start_values, sf_params):
+    """The points of the design, as a list of (name, sign, params), the center first with name None
+
+    start_values holds the (init, sigma) of each tunable parameter. The perturbations are rounded
+    to at least 1 and clipped to the bounds, perturbations that are clipped away are left out.
+    """
+    center = {name: int(round(init)) for name, (init, sigma) in start_values.items()}
+    points = [(None, 0, center)]
+    for name, (init, sigma) in start_values.items():
+        lower, upper = sf_params[name][1], sf_params[name][2]
+        step = max(1, int(round(sigma)))
+        for sign in [1, -1]:
+            value = max(lower, min(upper, center[name] + sign * step))
+            if value != center[name]:
+                points.append((name, sign, {**center, name: value}))
+    return points
+
+
+def effects(points, pentanomials, threshold):
+    """The effect of each parameter, from the pentanomials played at the points of the design
+
+    Returns a dict of name: {"plus": ..., "minus": ..., "z": ..., "frozen": ...}, with
+    the Elo difference (and its 95% error) of each perturbation with the center, and the
+    largest significance (in standard errors) of the two. Parameters with a significance
+    below threshold are frozen, except the most significant one, so that something is left to tune.
+    Points at which no game pair was completed are left out.
+    """
+    report = {}
+    if sum(pentanomials[0]) == 0:
+        return report
+    center_elo, center_variance = pentanomial_elo(pentanomials[0])
+    for (name, sign, params), pentanomial in zip(points[1:], pentanomials[1:]):
+        if sum(pentanomial) == 0:
+            continue
+        elo, variance = pentanomial_elo(pentanomial)
+        error = math.sqrt(variance + center_variance)
+        entry = report.setdefault(name, {"z": 0.0})
+        entry["plus" if sign > 0 else "minus"] = {
+            "value": params[name],
+            "elo": elo - center_elo,
+            "elo_error": 1.96 * error,
+            "pentanomial": pentanomial,
+        }
+        entry["z"] = max(entry["z"], abs(elo - center_elo) / error)
+    for entry in report.values():
+        entry["frozen"] = entry["z"] < threshold
+    if report and all(entry["frozen"] for entry in report.values()):
+        report[max(report, key=lambda name: report[name]["z"])]["frozen"] = False
+    return report
@@ -0,0 +1,149 @@
+"""
+Spatial index over evaluated points, for pooling the games of nearby points.
+
+Points are scaled to [-1, 1] by the parameter bounds. They are hashed into a
+grid over a random orthonormal projection to a few dimensions, with cells the
+size of the query radius. As the projection does not increase distances, all
+points within the radius are found in the neighboring cells, which are then
+filtered by their projected and finally their exact distance. Sparse regions
+only cost the 3^k cells visited (k at most 5); in dense regions, or with many
+parameters where the projection separates points less, the projected
+coordinates of all points are filtered in a single vectorized pass. Nearest
+neighbour queries grow the radius until enough points are found, and scan all
+points at once when the cells within the radius would outnumber the occupied ones.
+"""
+
+import itertools
+
+import numpy as np
+
+
+class SpatialIndex:
+    def __init__(self, bounds, cell_size, projections=5, seed=0):
+        """bounds is a dict of name: (lower, upper), cell_size the typical query radius"""
+        self.names = sorted(bounds)
+        self.lower = np.array([bounds[name][0] for name in self.names], dtype=float)
+        self.upper = np.array([bounds[name][1] for name in self.names], dtype=float)
+        self.cell_size = cell_size
+        dimensions = len(self.names)
+        q, _ = np.linalg.qr(np.random.default_rng(seed).standard_normal((dimensions, min(dimensions, projections))))
+        self.projection = q
+        self.offsets = {}
+        self.cells = {}
+        self.points = np.empty((1024, dimensions))
+        # stored by projected coordinate, to filter one coordinate at a time
+        self.projected = np.empty((self.projection.shape[1], 1024))
+        self.pentanomials = np.empty((1024, 5))
+        # squared norms of the points, for a brute-force nearest neighbour scan as a matrix-vector product
+        self.norms = np.empty(1024)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def scale(self, params):
+        x = np.array([float(params[name]) for name in self.names])
+        return 2 * (x - self.lower) / (self.upper - self.lower) - 1
+
+    def cell(self, z):
+        return np.floor(z @ self.projection / self.cell_size).astype(int)
+
+    def add(self, params, pentanomial):
+        """Add the pentanomial of games played at a point"""
+        if self.size == len(self.points):
+            self.points = np.concatenate((self.points, np.empty_like(self.points)))
+            self.projected = np.concatenate((self.projected, np.empty_like(self.projected)), axis=1)
+            self.pentanomials = np.concatenate((self.pentanomials, np.empty_like(self.pentanomials)))
+            self.norms = np.concatenate((self.norms, np.empty_like(self.norms)))
+        z = self.scale(params)
+        self.points[self.size] = z
+        self.projected[:, self.size] = z @ self.projection
+        self.pentanomials[self.size] = pentanomial
+        self.norms[self.size] = z @ z
+        self.cells.setdefault(tuple(self.cell(z)), []).append(self.size)
+        self.size += 1
+
+    def use_grid(self, radius):
+        """Whether visiting the cells within radius is cheaper than filtering all points
+
+        The number of cells is checked before building their offsets, as it grows as reach^k. A cell
+        visited costs about as much as filtering a few tens of points in the vectorized pass.
+        """
+        reach = int(np.ceil(radius / self.cell_size))
+        return 32 * (2 * reach + 1) ** self.projection.shape[1] < len(self.cells)
+
+    def candidates(self, z, radius):
+        """Indices of the points whose projection is within radius of that of z (in each projected coordinate)
+
+        The grid cells within reach are visited, unless there are more of them than occupied cells, or
+        they hold too many points, in which case all projected points are filtered at once.
+        """
+        reach = int(np.ceil(radius / self.cell_size))
+        pz = z @ self.projection
+        if self.use_grid(radius):
+            if reach not in self.offsets:
+                self.offsets[reach] = np.array(
+                    list(itertools.product(range(-reach, reach + 1), repeat=self.projection.shape[1])), dtype=int
+                )
+            cells = self.offsets[reach] + np.floor(pz / self.cell_size).astype(int)
+            indices = []
+            for cell in map(tuple, cells.tolist()):
+                indices.extend(self.cells.get(cell, ()))
+                if len(indices) > self.size // 8:
+                    break
+            else:
+                return self.filter(np.array(indices, dtype=int), pz, radius)
+        return self.filter(None, pz, radius)
+
+    def filter(self, indices, pz, radius):
+        """The indices (all points if None) whose projected coordinates are within radius of pz"""
+        for j, coordinate in enumerate(pz):
+            if indices is None:
+                indices = np.flatnonzero(np.abs(self.projected[j, :self.size] - coordinate) <= radius)
+            else:
+                indices = indices[np.abs(self.projected[j, indices] - coordinate) <= radius]
+        return indices
+
+    def within(self, params, radius):
+        """(indices, distances) of the points within radius of params"""
+        z = self.scale(params)
+        indices = self.candidates(z, radius)
+        distances = np.linalg.norm(self.points[indices] - z, axis=1)
+        near = distances <= radius
+        return indices[near], distances[near]
+
+    def nearest(self, params, k):
+        """(indices, distances) of the k nearest points to params, closest first"""
+        z = self.scale(params)
+        radius = self.cell_size
+        while True:
+            if not self.use_grid(radius):
+                # a single vectorized pass over all points, rather than growing the radius further
+                squared = self.norms[: self.size] - 2 * (self.points[: self.size] @ z)
+                order = np.argpartition(squared, k - 1)[:k] if k < self.size else np.arange(self.size)
+                distances = np.linalg.norm(self.points[order] - z, axis=1)
+                closest = np.argsort(distances)
+                return order[closest], distances[closest]
+            indices = self.candidates(z, radius)
+            distances = np.linalg.norm(self.points[indices] - z, axis=1)
+            # only the points within radius are guaranteed to have been found
+            if np.count_nonzero(distances <= radius) >= min(k, self.size):
+                break
+            radius *= 2
+        order = np.argsort(distances)[:k]
+        return indices[order], distances[order]
+
+    def pooled(self, params, radius, pentanomial=None):
+        """Pentanomial pooled over the points within radius, weighted by 1 - (distance / radius)^2
+
+        If given, pentanomial holds all games of the point itself, replacing the indexed ones at its position.
+        """
+        indices, distances = self.within(params, radius)
+        weights = 1 - (distances / radius) ** 2
+        pooled = np.zeros(5)
+        if pentanomial is not None:
+            weights[distances == 0] = 0
+            pooled += pentanomial
+        if len(indices):
+            pooled += weights @ self.pentanomials[indices]
+        return list(pooled)
@@ -0,0 +1,144 @@
+"""
+Quadratic response surface over all evaluated points.
+
+Every batch of games adds an observation: the Elo measured at a point, with
+the variance derived from its pentanomial. The parameters are scaled to [-1, 1]
+by their bounds, and a quadratic in the scaled parameters is fitted by weighted
+least squares with a weak ridge prior. The normal equations are accumulated, so
+that adding an observation is cheap and the fit uses all games ever played.
+
+With few parameters the quadratic includes all cross terms, otherwise only the
+squares, as the number of coefficients grows quadratically.
+"""
+
+import numpy as np
+
+from cutechess_batches import pentanomial_elo
+
+
+class Surrogate:
+    def __init__(self, bounds, full_max_params=8, prior_sigma=100.0, seed=None):
+        """bounds is a dict of name: (lower, upper) of the tuned parameters
+
+        prior_sigma is the prior standard deviation (in Elo) of the coefficients.
+        """
+        self.names = sorted(bounds)
+        self.lower = np.array([bounds[name][0] for name in self.names], dtype=float)
+        self.upper = np.array([bounds[name][1] for name in self.names], dtype=float)
+        self.full = len(self.names) <= full_max_params
+        features = self.features(np.zeros((1, len(self.names)))).shape[1]
+        self.A = np.eye(features) / prior_sigma ** 2
+        self.b = np.zeros(features)
+        self.observations = 0
+        self.games = 0
+        self.coefficients = None
+        self.covariance = None
+        self.points = []
+        self.rng = np.random.default_rng(seed)
+
+    def scale(self, params):
+        x = np.array([float(params[name]) for name in self.names])
+        return 2 * (x - self.lower) / (self.upper - self.lower) - 1
+
+    def unscale(self, z):
+        x = self.lower + (np.clip(z, -1, 1) + 1) * (self.upper - self.lower) / 2
+        return {name: int(round(value)) for name, value in zip(self.names, x)}
+
+    def features(self, Z):
+        """Quadratic features of the rows of Z"""
+        n = Z.shape[1]
+        if self.full:
+            cross = np.stack([Z[:, i] * Z[:, j] for i in range(n) for j in range(i, n)], axis=1)
+        else:
+            cross = Z * Z
+        return np.hstack((np.ones((len(Z), 1)), Z, cross))
+
+    def add(self, params, pentanomial):
+        """Add the games played at a point"""
+        if sum(pentanomial) == 0:
+            return
+        elo, variance = pentanomial_elo(pentanomial)
+        z = self.scale(params)
+        phi = self.features(z[np.newaxis])[0]
+        self.A += np.outer(phi, phi) / variance
+        self.b += phi * elo / variance
+        self.observations += 1
+        self.games += 2 * sum(pentanomial)
+        self.points.append(z)
+        self.coefficients = None
+
+    def fit(self):
+        if self.coefficients is None:
+            self.covariance = np.linalg.inv(self.A)
+            self.coefficients = self.covariance @ self.b
+        return self.coefficients
+
+    def predict(self, Z):
+        """(Elo, standard deviation) predicted at the scaled points, the rows of Z"""
+        coefficients = self.fit()
+        phi = self.features(Z)
+        variance = np.einsum("ij,jk,ik->i", phi, self.covariance, phi)
+        return phi @ coefficients, np.sqrt(np.maximum(0.0, variance))
+
+    def stationary_point(self):
+        """Maximum of the quadratic if it is concave, clipped to the bounds"""
+        coefficients = self.fit()
+        n = len(self.names)
+        gradient = coefficients[1:n + 1]
+        hessian = np.zeros((n, n))
+        k = n + 1
+        if self.full:
+            for i in range(n):
+                for j in range(i, n):
+                    hessian[i, j] += coefficients[k]
+                    hessian[j, i] += coefficients[k]
+                    k += 1
+        else:
+            hessian[np.diag_indices(n)] = 2 * coefficients[k:]
+        if np.all(np.linalg.eigvalsh(hessian) < 0):
+            return np.clip(np.linalg.solve(hessian, -gradient), -1, 1)
+        return None
+
+    def recommendation(self):
+        """(params, predicted Elo, standard deviation) of the best point of the surface
+
+        Candidates are the evaluated points and the maximum of the quadratic.
+        """
+        candidates = list(self.points)
+        stationary = self.stationary_point()
+        if stationary is not None:
+            candidates.append(stationary)
+        elo, sigma = self.predict(np.array(candidates))
+        best = int(np.argmax(elo))
+        return self.unscale(candidates[best]), float(elo[best]), float(sigma[best])
+
+    def suggestions(self, count=4, kappa=2.0, samples=1000, sigma=0.1):
+        """Points to evaluate next, maximizing the upper confidence bound Elo + kappa * std
+
+        Candidates are drawn around the recommendation and uniformly over the bounds.
+        """
+        center = self.scale(self.recommendation()[0])
+        local = center + sigma * self.rng.standard_normal((samples // 2, len(self.names)))
+        uniform = self.rng.uniform(-1, 1, (samples - samples // 2, len(self.names)))
+        candidates = np.clip(np.vstack((local, uniform)), -1, 1)
+        elo, sigma = self.predict(candidates)
+        ucb = elo + kappa * sigma
+        suggested = []
+        for i in np.argsort(ucb)[::-1]:
+            params = self.unscale(candidates[i])
+            if params not in suggested:
+                suggested.append(params)
+            if len(suggested) == count:
+                break
+        return suggested
+
+    def export(self):
+        params, elo, sigma = self.recommendation()
+        return {
+            "observations": self.observations,
+            "games": self.games,
+            "recommendation": params,
+            "elo": elo,
+            "elo_error": 1.96 * sigma,
+            "suggestions": self.suggestions(),
+        }
@@ -0,0 +1,379 @@
+"""
+Elastic pool of workers connected over TCP, an alternative to MPIPoolExecutor.
+
+The master listens on a TCP port, workers connect to it (authenticated with a
+shared key), register their host and core count, and run one task at a time.
+Workers can join or leave at any time: the task of a worker that disconnects,
+or stops sending heartbeats, is queued again for the next free worker, unless
+it already lost MAX_LOST workers, in which case it fails.
+
+Start workers on any machine that can reach the master, e.g. 8 on this host:
+   python3 tcp_executor.py --connect master:5555 --authkey KEY --workers 8
+
+Check the pool with a few local workers, one of which is killed mid-run:
+   python3 tcp_executor.py --selftest
+"""
+
+import os
+import sys
+import time
+import socket
+import secrets
+import argparse
+import textwrap
+import threading
+import collections
+import multiprocessing
+from concurrent.futures import Executor, Future, wait as wait_for
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+# seconds between heartbeats of a busy worker, it is considered lost after 3 missed ones
+HEARTBEAT = 10.0
+
+# a task that lost this many workers fails, rather than taking down the whole pool
+MAX_LOST = 3
+
+
+def parse_address(text, default_host="0.0.0.0"):
+    """host:port (or just port) as an address tuple"""
+    host, _, port = text.rpartition(":")
+    return (host or default_host, int(port))
+
+
+class TCPPoolExecutor(Executor):
+    def __init__(self, address=("0.0.0.0", 0), authkey=b"", heartbeat=HEARTBEAT):
+        """Listen for workers on address, authenticated by authkey (a random key if empty)"""
+        self.authkey = authkey or secrets.token_hex(16).encode()
+        self.heartbeat = heartbeat
+        self.listener = Listener(address, authkey=self.authkey)
+        self.address = self.listener.address
+        self.tasks = collections.deque()
+        self.futures = set()
+        self.workers = {}
+        self.lost = {}
+        self.threads = []
+        self.condition = threading.Condition()
+        self.shutting_down = False
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    @property
+    def num_workers(self):
+        with self.condition:
+            return len(self.workers)
+
+    def wait_for_workers(self, count):
+        """Block until at least count workers are connected"""
+        with self.condition:
+            while len(self.workers) < count:
+                self.condition.wait()
+
+    def accept(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except AuthenticationError:
+                print("tcp executor: rejected a worker with a wrong authkey", flush=True)
+                continue
+            except OSError:
+                # the listener is closed at shutdown
+                return
+            thread = threading.Thread(target=self.serve, args=(connection,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def serve(self, connection):
+        """Send tasks to a connected worker, one at a time, until it leaves or the pool shuts down"""
+        try:
+            info = connection.recv()
+        except (EOFError, OSError):
+            connection.close()
+            return
+        worker = "%s:%d" % (info["host"], info["pid"])
+        with self.condition:
+            self.workers[worker] = info
+            self.condition.notify_all()
+        print("tcp executor: worker %s joined (%d cores), %d workers" % (worker, info["cores"], self.num_workers), flush=True)
+
+        task = None
+        try:
+            while True:
+                with self.condition:
+                    while not self.has_tasks() and not self.shutting_down:
+                        self.condition.wait()
+                    if not self.has_tasks():
+                        break
+                    task = self.next_task()
+                future, fn, args, kwargs = task
+                if not (future.running() or future.set_running_or_notify_cancel()):
+                    task = None
+                    continue
+                try:
+                    connection.send((fn, args, kwargs))
+                except (EOFError, OSError):
+                    raise
+                except Exception as e:
+                    # the task can not be pickled, no worker will be able to run it
+                    task = None
+                    future.set_exception(e)
+                    continue
+                start = time.monotonic()
+                message = ("alive",)
+                while message[0] == "alive":
+                    if not connection.poll(3 * self.heartbeat):
+                        raise TimeoutError("no heartbeat")
+                    message = connection.recv()
+                self.task_done(task, time.monotonic() - start)
+                task = None
+                with self.condition:
+                    self.lost.pop(future, None)
+                kind, value = message
+                if kind == "result":
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            connection.send(None)
+        except (EOFError, OSError, TimeoutError) as e:
+            print("tcp executor: lost worker %s (%s)" % (worker, e.__class__.__name__), flush=True)
+        finally:
+            if task:
+                # another worker picks up the task of the lost one, unless the task keeps losing workers
+                with self.condition:
+                    lost = self.lost.pop(task[0], 0) + 1
+                    if lost < MAX_LOST:
+                        self.lost[task[0]] = lost
+                        self.requeue(task)
+                        self.condition.notify()
+                    else:
+                        self.task_failed(task)
+                if lost >= MAX_LOST:
+                    task[0].set_exception(RuntimeError("the task lost %d workers" % lost))
+            with self.condition:
+                del self.workers[worker]
+            connection.close()
+
+    # the queue of tasks, called with the condition held. Subclasses can order the tasks differently.
+    def has_tasks(self):
+        return bool(self.tasks)
+
+    def next_task(self):
+        return self.tasks.popleft()
+
+    def requeue(self, task):
+        self.tasks.appendleft(task)
+
+    def task_failed(self, task):
+        """Called with the condition held for a task that is given up on"""
+        pass
+
+    def task_done(self, task, seconds):
+        """Called (without the condition held) when a worker returns the result of a task, after seconds"""
+        pass
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        with self.condition:
+            if self.shutting_down:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            self.tasks.append((future, fn, args, kwargs))
+            self.futures.add(future)
+            self.condition.notify()
+        future.add_done_callback(self.futures.discard)
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self.condition:
+            if cancel_futures:
+                for future, fn, args, kwargs in self.tasks:
+                    future.cancel()
+            self.shutting_down = True
+            self.condition.notify_all()
+        if wait:
+            wait_for(list(self.futures))
+            # let the workers know they are done
+            for thread in self.threads:
+                thread.join(timeout=1.0)
+        self.listener.close()
+
+
+def run_worker(address, authkey, retry=5.0, heartbeat=HEARTBEAT):
+    """Connect to the master and run its tasks, reconnecting if the connection is lost
+
+    Returns when the master shuts the pool down.
+    """
+    while True:
+        try:
+            connection = Client(address, authkey=authkey)
+        except (ConnectionRefusedError, ConnectionResetError, socket.gaierror):
+            time.sleep(retry)
+            continue
+        except AuthenticationError:
+            sys.exit("tcp worker: the master rejected the authkey")
+        connection.send({"host": socket.gethostname(), "pid": os.getpid(), "cores": len(os.sched_getaffinity(0))})
+        lock = threading.Lock()
+        try:
+            while True:
+                try:
+                    task = connection.recv()
+                except (EOFError, OSError):
+                    raise
+                except Exception as e:
+                    # e.g. the modules of the task are missing on this host
+                    connection.send(("error", RuntimeError("cannot unpickle task: %r" % e)))
+                    continue
+                if task is None:
+                    return
+                fn, args, kwargs = task
+
+                done = threading.Event()
+
+                def beat():
+                    while not done.wait(heartbeat):
+                        with lock:
+                            connection.send(("alive",))
+
+                beater = threading.Thread(target=beat, daemon=True)
+                beater.start()
+                try:
+                    message = ("result", fn(*args, **kwargs))
+                except Exception as e:
+                    message = ("error", e)
+                except SystemExit as e:
+                    # the task exits, but the worker stays to run the next one
+                    message = ("error", RuntimeError("the task exited: %s" % e.code))
+                done.set()
+                beater.join()
+                with lock:
+                    try:
+                        connection.send(message)
+                    except (EOFError, OSError):
+                        raise
+                    except Exception as e:
+                        connection.send(("error", RuntimeError("unpicklable result: %r" % e)))
+        except (EOFError, OSError):
+            print("tcp worker: lost the master, reconnecting", flush=True)
+            time.sleep(retry)
+        finally:
+            connection.close()
+
+
+def start_workers(address, authkey, workers, retry=5.0):
+    """Start worker processes, each knowing its local rank for cpu affinity"""
+    processes = []
+    for rank in range(workers):
+        os.environ["AFFINITY_LOCAL_RANK"] = str(rank)
+        os.environ["AFFINITY_LOCAL_SIZE"] = str(workers)
+        process = multiprocessing.Process(target=run_worker, args=(address, authkey, retry))
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def _square_slowly(x):
+    time.sleep(0.2)
+    return x * x
+
+
+def _exit_task():
+    sys.exit("failed to execute command")
+
+
+def _kill_worker():
+    os._exit(1)
+
+
+def selftest(workers=3, tasks=24):
+    """Run tasks on local workers, losing one and gaining another one on the way
+
+    A task that exits fails without taking its worker down, and a task that kills its
+    workers fails after MAX_LOST of them.
+    """
+    executor = TCPPoolExecutor(("127.0.0.1", 0))
+    processes = start_workers(executor.address, executor.authkey, workers, retry=0.1)
+    executor.wait_for_workers(workers)
+    futures = [executor.submit(_square_slowly, i) for i in range(tasks)]
+    exiting = executor.submit(_exit_task)
+    time.sleep(0.5)
+    processes[0].kill()
+    processes += start_workers(executor.address, executor.authkey, 1, retry=0.1)
+    results = [future.result() for future in futures]
+    if not isinstance(exiting.exception(), RuntimeError):
+        sys.exit("tcp executor selftest failed: the exiting task returned %r" % exiting.exception())
+
+    # workers that die are replaced, as a supervisor would
+    processes += start_workers(executor.address, executor.authkey, MAX_LOST, retry=0.1)
+    killing = executor.submit(_kill_worker)
+    if not isinstance(killing.exception(timeout=30), RuntimeError):
+        sys.exit("tcp executor selftest failed: the killing task returned %r" % killing.exception())
+    after = executor.submit(_square_slowly, tasks)
+    if after.result(timeout=30) != tasks * tasks:
+        sys.exit("tcp executor selftest failed: no worker left after the killing task")
+
+    executor.shutdown()
+    for process in processes:
+        process.join()
+    if results != [i * i for i in range(tasks)]:
+        sys.exit("tcp executor selftest failed: %s" % results)
+    print(
+        "tcp executor selftest passed: %d tasks on %d workers, one lost and one joined, "
+        "an exiting task and a task killing %d workers failed" % (tasks, workers, MAX_LOST)
+    )
+
+
+if __name__ == "__main__":
+
+    class MyFormatter(
+        argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter
+    ):
+        pass
+
+    parser = argparse.ArgumentParser(
+        formatter_class=MyFormatter,
+        description=textwrap.dedent(
+            """\
+                  Run workers for a master started with --backend tcp.
+
+                  A typical invocation could be:
+                     python3 tcp_executor.py --connect master:5555 --authkey KEY --workers 8
+                  """
+        ),
+    )
+    parser.add_argument(
+        "--connect",
+        type=str,
+        default="127.0.0.1:5555",
+        help="host:port on which the master listens",
+    )
+    parser.add_argument(
+        "--authkey",
+        type=str,
+        default=os.environ.get("NG4SF_AUTHKEY", ""),
+        help="Key shared with the master, defaults to the NG4SF_AUTHKEY environment variable",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes, each running one cutechess batch at a time",
+    )
+    parser.add_argument(
+        "--retry",
+        type=float,
+        default=5.0,
+        help="Seconds between attempts to (re)connect to the master",
+    )
+    parser.add_argument(
+        "--selftest",
+        action="store_true",
+        help="Test the pool with a few local workers",
+    )
+    args = parser.parse_args()
+
+    if args.selftest:
+        selftest()
+        sys.exit(0)
+    if not args.authkey:
+        sys.exit("tcp workers need the --authkey printed by the master.")
+
+    processes = start_workers(parse_address(args.connect), args.authkey.encode(), args.workers, args.retry)
+    for process in processes:
+        process.join()
@@ -0,0 +1,148 @@
+"""
+Per-game telemetry from the PGN written by cutechess (-pgnout).
+
+Each game becomes a compact record: the test engine, the number of plies, how
+the game ended, the engine time used by the test and reference engine, and the
+index of its opening in the book (if known). Records are summarized per batch
+(i.e. per rank), and summaries are combined per evaluation, to spot what costs
+games/s, such as long games before a draw adjudication or time losses.
+"""
+
+import re
+
+HEADER = re.compile(r'^\[(\w+) "(.*)"\]')
+COMMENT = re.compile(r"\{([^}]*)\}")
+MOVE_TIME = re.compile(r"/\d+ (\d+(?:\.\d+)?)s")
+
+TERMINATIONS = ["mate", "resign", "resign adjudication", "draw adjudication", "draw rule", "time forfeit", "other"]
+
+
+def termination(text, result):
+    """Category of the comment describing how a game ended"""
+    text = text.lower()
+    if "on time" in text or "time forfeit" in text:
+        return "time forfeit"
+    if "adjudication" in text:
+        return "draw adjudication" if result == "1/2-1/2" else "resign adjudication"
+    if "mates" in text:
+        return "mate"
+    if "resigns" in text:
+        return "resign"
+    if text.startswith("draw"):
+        # repetition, fifty move rule, stalemate, insufficient material
+        return "draw rule"
+    return "other"
+
+
+def position_key(fen):
+    """The board, side to move, castling and en passant fields of a FEN or EPD line"""
+    return " ".join(fen.split()[:4])
+
+
+def game_record(headers, movetext, names, openings):
+    """The record of a single game, None if no test engine played it"""
+    white, black = headers.get("White"), headers.get("Black")
+    if white not in names and black not in names:
+        return None
+    test_is_white = white in names
+    comments = COMMENT.findall(movetext)
+
+    # moves alternate between the sides, starting with the side to move in the start position
+    fen = headers.get("FEN", "")
+    white_first = len(fen.split()) < 2 or fen.split()[1] == "w"
+    times = [0.0, 0.0]
+    for ply, comment in enumerate(comments):
+        m = MOVE_TIME.search(comment)
+        if m:
+            times[(ply % 2 == 0) != white_first] += float(m.group(1))
+    test_time, base_time = times if test_is_white else times[::-1]
+
+    last = comments[-1].split(", ")[-1] if comments else ""
+    result = headers.get("Result", "*")
+    return {
+        "engine": white if test_is_white else black,
+        "plies": int(headers["PlyCount"]) if "PlyCount" in headers else len(comments),
+        "termination": "time forfeit" if headers.get("Termination") == "time forfeit" else termination(last, result),
+        "time": test_time,
+        "time_ref": base_time,
+        "opening": openings.get(position_key(fen)) if openings and fen else None,
+    }
+
+
+def parse_pgn(lines, names, openings=None):
+    """Stream the lines of a PGN file into game records
+
+    openings maps position_key of the start positions to their index in the book.
+    """
+    records = []
+    headers, movetext = {}, []
+    for line in lines:
+        m = HEADER.match(line)
+        if m:
+            if movetext:
+                record = game_record(headers, " ".join(movetext), names, openings)
+                if record:
+                    records.append(record)
+                headers, movetext = {}, []
+            headers[m.group(1)] = m.group(2)
+        elif line.strip():
+            movetext.append(line.strip())
+    if headers:
+        record = game_record(headers, " ".join(movetext), names, openings)
+        if record:
+            records.append(record)
+    return records
+
+
+def summarize(records):
+    """Totals over records, which can be combined with those of other batches"""
+    terminations = {}
+    for record in records:
+        terminations[record["termination"]] = terminations.get(record["termination"], 0) + 1
+    return {
+        "games": len(records),
+        "plies": sum(record["plies"] for record in records),
+        "max_plies": max((record["plies"] for record in records), default=0),
+        "time": sum(record["time"] for record in records),
+        "time_ref": sum(record["time_ref"] for record in records),
+        "draw_adjudication_plies": sum(
+            record["plies"] for record in records if record["termination"] == "draw adjudication"
+        ),
+        "terminations": terminations,
+    }
+
+
+def combine(summaries):
+    """Sum of the totals of several summaries"""
+    combined = summarize([])
+    for summary in summaries:
+        for key in ["games", "plies", "time", "time_ref", "draw_adjudication_plies"]:
+            combined[key] += summary[key]
+        combined["max_plies"] = max(combined["max_plies"], summary["max_plies"])
+        for name, count in summary["terminations"].items():
+            combined["terminations"][name] = combined["terminations"].get(name, 0) + count
+    return combined
+
+
+def report(summary):
+    """A single line describing a summary"""
+    games = summary["games"]
+    if games == 0:
+        return "no games"
+    terminations = ", ".join(
+        "%s %.1f%%" % (name, 100 * summary["terminations"][name] / games)
+        for name in TERMINATIONS
+        if name in summary["terminations"]
+    )
+    text = "%d games, %.1f plies/game (max %d), %.3fs/%.3fs engine time/game (test/ref), %s" % (
+        games,
+        summary["plies"] / games,
+        summary["max_plies"],
+        summary["time"] / games,
+        summary["time_ref"] / games,
+        terminations,
+    )
+    draws = summary["terminations"].get("draw adjudication", 0)
+    if draws:
+        text += ", %.1f plies/adjudicated draw" % (summary["draw_adjudication_plies"] / draws)
+    return text
@@ -0,0 +1,6 @@
+#!/bin/bash
+
+# checks that need neither cutechess nor stockfish
+set -e
+python3 selftest.py
+python3 tcp_executor.py --selftest
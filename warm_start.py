@@ -0,0 +1,88 @@
+"""
+Warm-start a tuning run from the output of a previous experiment.
+
+The recommendation in optimal.json provides the initial values, the spread of
+the recommendations in all_optimals.json the mutation sigmas. Optionally the
+points in all_evalpoints.json are told to the new optimizer, with their
+pentanomials down-weighted since they were measured with a different binary.
+"""
+
+import os
+import sys
+import json
+import statistics
+from pathlib import Path
+
+from losses import get_loss
+
+
+def load_experiment(path):
+    """Read the json output of a previous experiment directory (or its optimal.json)"""
+    path = Path(path)
+    experiment_dir = path.parent if path.is_file() else path
+    optimal_path = path if path.is_file() else Path(experiment_dir, "optimal.json")
+    if not optimal_path.is_file():
+        sys.exit(f"Missing warm start file: {optimal_path}\n")
+
+    def load(file_path, default):
+        if not os.path.isfile(file_path):
+            return default
+        with open(file_path, "r") as infile:
+            return json.load(infile)
+
+    return {
+        "optimal": load(optimal_path, {}),
+        "optimals": load(Path(experiment_dir, "all_optimals.json"), []),
+        "evalpoints": load(Path(experiment_dir, "all_evalpoints.json"), []),
+    }
+
+
+def clip(value, lower, upper):
+    return max(lower, min(upper, value))
+
+
+def warm_start_values(sf_params, experiment, last_optimals=10):
+    """Initial value and mutation sigma for each tunable parameter
+
+    Parameters not known to the previous experiment keep their sf default and sigma.
+    The sigma of the others is the spread of the last recommendations, bounded to
+    between 1/40 and 1/4 of the parameter range.
+    """
+    recommendations = [o["recommendation"] for o in experiment["optimals"][-last_optimals:]]
+    values = {}
+    for name, (default, lower, upper) in sf_params.items():
+        if lower == upper:
+            continue
+        max_sigma = (upper - lower) / 4
+        init = experiment["optimal"].get(name, default)
+        history = [r[name] for r in recommendations if name in r]
+        sigma = statistics.pstdev(history) if len(history) > 1 else max_sigma
+        values[name] = (
+            float(clip(init, lower, upper)),
+            clip(sigma, max_sigma / 10, max_sigma),
+        )
+    return values
+
+
+def prior_observations(sf_params, experiment, weight, max_points=1000, loss=None, fidelity=None):
+    """Previous evaluations as (params, loss), with the loss of down-weighted pentanomials
+
+    Scaling the pentanomial counts by weight treats the old results as if fewer games
+    had been played, shrinking their LLR towards zero. loss is a function of the
+    pentanomial, by default that of the fishtest SPRT. With fidelity, a [tc, tcRef] pair,
+    evaluations recorded at other time controls (e.g. screening) are left out.
+    """
+    loss = loss or get_loss()
+    observations = []
+    evalpoints = experiment["evalpoints"]
+    if fidelity:
+        evalpoints = [e for e in evalpoints if list(e.get("fidelity", fidelity)) == list(fidelity)]
+    for evalpoint in evalpoints[-max_points:]:
+        params = {}
+        for name, (default, lower, upper) in sf_params.items():
+            if lower != upper:
+                params[name] = float(clip(evalpoint["params"].get(name, default), lower, upper))
+        pentanomial = [weight * n for n in evalpoint["stats"]["pentanomial"]]
+        if sum(pentanomial) > 0:
+            observations.append((params, loss(pentanomial)))
+    return observations